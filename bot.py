@@ -3,10 +3,12 @@ import asyncio
 import json
 import os
 import logging
+import time
 import traceback
 from copy import deepcopy
+from datetime import datetime, timedelta
+from typing import Union
 
-import aiohttp
 import discord as ds  # noqa
 from discord.ext.commands import NotOwner  # noqa
 
@@ -17,18 +19,46 @@ from services.danawa import DanawaService
 from services.naver import NaverService
 from services.eleventhst import EleventhStreetService
 from services.univstore import UnivStoreService
+from services.base import format_price
+from util.browser import BrowserManager
+from util.scheduler import Scheduler, AdaptiveInterval
+from util.ratelimit import RATE_LIMITER
+from util.linkcache import LINK_CACHE
+from util.resilience import FetchResult, Quarantine
+from util.executor import PARSE_EXECUTOR, LoopLagMonitor
+from util.parser import set_backend
+from util.store import Store
+from util.history import PriceHistory
+from util.rules import RuleBook
+from util.notifier import Notifier
 
 # Add service class here to add new service
 SERVICES = (CoupangService, DanawaService, NaverService, EleventhStreetService, UnivStoreService)
 
 
+DEFAULT_CONFIG = {"token": "",
+                  "user_id": "",
+                  "interval": 60,
+                  "interval_jitter": 0.1,
+                  "result_freshness": 30,
+                  "database": "prices.db",
+                  "service_intervals": {},
+                  "item_intervals": {},
+                  "service_rules": {},
+                  "item_rules": {},
+                  "adaptive_polling": {"enabled": True, "min_interval": 30, "max_interval": 1800},
+                  "rate_limit": {"rate": 2, "burst": 4, "max_concurrency": 6},
+                  "parser": {"executor": "process", "max_workers": 2, "backend": "auto"},
+                  "quarantine": {"transient_failures": 5, "permanent_failures": 2, "interval": 3600},
+                  "notifications": {"coalesce_window": 10},
+                  "stats_interval": 600,
+                  "test_mode": False,
+                  "chromium_executable_override": ""
+                  }
+
+
 def reset_cfg():
-    default = {"token": "",
-               "user_id": "",
-               "interval": 60,
-               "test_mode": False,
-               "chromium_executable_override": ""
-               }
+    default = deepcopy(DEFAULT_CONFIG)
 
     for service in SERVICES:
         if service.SERVICE_DEFAULT_CONFIG is not None:
@@ -55,28 +85,16 @@ class DiscordPriceBot(ds.Bot):
         super().__init__(intents=intents, owner_id=self.owner_id)
 
         self.item_dict = {}
-
-        try:
-            with open('url.json', 'r') as f:
-                self.url_dict = json.load(f)
-
-        except (FileNotFoundError, json.JSONDecodeError):
-            print('URL json file not found or invalid. Creating one')
-            self.url_dict = {}
-
-            with open('url.json', 'w') as f:
-                json.dump(self.url_dict, f, indent=4)
-
-        for service in SERVICES:
-            if service.SERVICE_NAME not in self.url_dict:
-                self.url_dict[service.SERVICE_NAME] = []
-
-            self.item_dict[service.SERVICE_NAME] = {}
-
         self.services = {}
 
         config_updated = False
 
+        for key, value in DEFAULT_CONFIG.items():
+            if key not in cfg:
+                print(f'Config is missing key {key}. Adding default value...')
+                cfg[key] = deepcopy(value)
+                config_updated = True
+
         for service in SERVICES:
             if service.SERVICE_DEFAULT_CONFIG is not None:
                 print('Testing config for', service.SERVICE_NAME)
@@ -89,12 +107,11 @@ class DiscordPriceBot(ds.Bot):
                     config_updated = True
                     continue
 
-                for key in service.SERVICE_DEFAULT_CONFIG:
+                for key, value in service.SERVICE_DEFAULT_CONFIG.items():
                     if key not in service_cfg:
-                        print(f'Config for {service.SERVICE_NAME} is missing key {key}. Resetting to default...')
-                        cfg[service.SERVICE_NAME] = deepcopy(service.SERVICE_DEFAULT_CONFIG)
+                        print(f'Config for {service.SERVICE_NAME} is missing key {key}. Adding default value...')
+                        service_cfg[key] = deepcopy(value)
                         config_updated = True
-                        break
             else:
                 print(f'No config required for {service.SERVICE_NAME}')
 
@@ -105,18 +122,55 @@ class DiscordPriceBot(ds.Bot):
             print('Updated config file. Please review and edit settings as needed.')
             sys.exit(1)
 
+        try:
+            self.rules = RuleBook(cfg['service_rules'], cfg['item_rules'])
+        except ValueError as e:
+            print('Invalid alert rule in config:', e)
+            sys.exit(1)
+
+        self.store = Store(cfg['database'])
+
+        # url.json is only an import/export format. It is imported into an empty database
+        # and written back on shutdown
+        if not self.store.has_urls() and self.store.import_json('url.json'):
+            print('Imported URLs from url.json')
+
+        self.url_dict = self.store.load_urls()
+        self.history = PriceHistory(self.store.connection)
+
+        for service in SERVICES:
+            if service.SERVICE_NAME not in self.url_dict:
+                self.url_dict[service.SERVICE_NAME] = []
+
+            self.item_dict[service.SERVICE_NAME] = {}
+
         if cfg['chromium_executable_override'] != "" and os.path.exists(cfg['chromium_executable_override']):
             chromium_path = cfg['chromium_executable_override']
             print('Using chromium path:', chromium_path)
         else:
             chromium_path = None
 
+        self.browser_manager = BrowserManager(chromium_path)
+        RATE_LIMITER.configure(**cfg['rate_limit'])
+        # Worker processes may not inherit the backend, so they select it again on startup
+        parser_backend = cfg['parser'].get('backend', 'auto')
+
+        try:
+            set_backend(parser_backend)
+            PARSE_EXECUTOR.configure(cfg['parser']['executor'], cfg['parser']['max_workers'],
+                                     initializer=set_backend, initargs=(parser_backend,))
+        except ValueError as e:
+            print('Invalid parser config:', e)
+            sys.exit(1)
+        # Lag is reported by the stats summary only, over windows as long as its interval
+        self.loop_lag = LoopLagMonitor(window=cfg['stats_interval'])
+
         for service in SERVICES:
             print('Initializing service:', service.SERVICE_NAME)
             if service.SERVICE_USES_PLAYWRIGHT and service.SERVICE_DEFAULT_CONFIG is not None:
-                self.services[service.SERVICE_NAME] = service(cfg[service.SERVICE_NAME], chromium_path)
+                self.services[service.SERVICE_NAME] = service(cfg[service.SERVICE_NAME], self.browser_manager)
             elif service.SERVICE_USES_PLAYWRIGHT:
-                self.services[service.SERVICE_NAME] = service(chromium_path)
+                self.services[service.SERVICE_NAME] = service(self.browser_manager)
             elif service.SERVICE_DEFAULT_CONFIG is not None:
                 self.services[service.SERVICE_NAME] = service(cfg[service.SERVICE_NAME])
             else:
@@ -125,22 +179,121 @@ class DiscordPriceBot(ds.Bot):
         self.command_busy = False
         self.message_with_view_id = None
 
-        print('Initializing item dict...')
-        asyncio.run(self.update_item_dict())
+        self.scheduler = Scheduler(cfg['interval_jitter'])
+
+        if cfg['adaptive_polling']['enabled']:
+            self.adaptive_interval = AdaptiveInterval(cfg['adaptive_polling']['min_interval'],
+                                                      cfg['adaptive_polling']['max_interval'])
+        else:
+            self.adaptive_interval = None
+
+        self.quarantine = Quarantine(cfg['quarantine']['transient_failures'], cfg['quarantine']['permanent_failures'])
+        self.check_tasks = set()
+        self.notifier = Notifier(self.send_notification_message, self.render_notification,
+                                 after_flush=self.repost_menu_view, is_busy=lambda: self.interaction,
+                                 window=cfg['notifications']['coalesce_window'])
+        self.stats_task = None
         self.bg_task = self.loop.create_task(self.check_price())
 
-    def save_url_dict(self) -> None:
-        with open('url.json', 'w') as f:
-            json.dump(self.url_dict, f, indent=4)
+    async def start(self, *args, **kwargs) -> None:
+        # Services are started inside the bot's event loop so that their sessions and the shared browser
+        # can be reused by the price check loop
+        await asyncio.gather(*[service.start() for service in self.services.values()])
+        self.loop_lag.start()
+        self.notifier.start()
+        self.stats_task = asyncio.create_task(self.report_stats())
 
-    async def update_item_dict(self) -> None:
-        async def get(service):
-            self.item_dict[service.SERVICE_NAME] = await service.fetch_items(self.url_dict[service.SERVICE_NAME])
+        print('Loading item snapshots...')
+        self.load_snapshots()
 
-        await asyncio.gather(*[get(service) for service in self.services.values()])
+        for service_name, url_list in self.url_dict.items():
+            for url in url_list:
+                # Items without a snapshot are fetched right away, the rest are spread over their interval
+                delay = None if url in self.item_dict[service_name] else 0
+                self.scheduler.add((service_name, url), self.get_interval(service_name, url), delay)
+
+        await super().start(*args, **kwargs)
+
+    async def close(self) -> None:
+        if self.stats_task is not None:
+            self.stats_task.cancel()
+
+        await self.notifier.stop()
+        await asyncio.gather(*[service.close() for service in self.services.values()])
+        await self.browser_manager.close()
+        self.loop_lag.stop()
+        PARSE_EXECUTOR.shutdown()
+        self.store.export_json('url.json', list(self.services))
+        self.store.close()
+        await super().close()
+
+    @staticmethod
+    def get_interval(service_name: str, url: str) -> float:
+        """Returns the polling interval of an item. Item intervals take precedence over service intervals."""
+        return cfg['item_intervals'].get(url, cfg['service_intervals'].get(service_name, cfg['interval']))
+
+    def get_next_interval(self, service_name: str, url: str, item, last_item) -> float:
+        """Returns the interval until the next check of an item, adapted to its change history if enabled."""
+        interval = self.get_interval(service_name, url)
+
+        if self.adaptive_interval is None or last_item is None:
+            return interval
+
+        # Coming back in stock is the change we least want to miss
+        restocked = last_item.in_stock() is False and item.in_stock() is True
+
+        changed = item.fingerprint != last_item.fingerprint
+        return self.adaptive_interval.update((service_name, url), interval, changed, urgent=restocked)
+
+    def load_snapshots(self) -> None:
+        """Loads the last saved item of every tracked URL, so that the first check reports changes made while
+        the bot was down. Snapshots saved under a different item schema are dropped."""
+        for service_name, service in self.services.items():
+            item_class = service.SERVICE_ITEM_CLASS
+
+            if self.store.get_meta(service_name, 'schema') != item_class.schema():
+                self.store.clear_snapshots(service_name)
+                self.store.set_meta(service_name, 'schema', item_class.schema())
+                continue
+
+            for url, fields in self.store.load_snapshots(service_name).items():
+                if url not in self.url_dict[service_name]:
+                    continue
+
+                try:
+                    self.item_dict[service_name][url] = item_class.from_dict(fields)
+                except (KeyError, TypeError) as e:
+                    print(f'Discarding invalid snapshot of {url}: {e}')
+
+    def record_history(self, service_name: str, url: str, item) -> None:
+        self.history.record(service_name, url, item['price'], item.in_stock())
+
+    def get_history_fields(self, service_name: str, url: str) -> list:
+        """Returns (label, value) pairs summarizing the price history of an item."""
+        fields = []
+        now = time.time()
+
+        low = self.history.all_time_low(service_name, url)
+
+        if low is not None:
+            price, timestamp = low
+            fields.append(('역대 최저가', f'{format_price(price)} ({datetime.fromtimestamp(timestamp):%Y-%m-%d})'))
+
+        average = self.history.average(service_name, url, 30 * 24 * 3600, now)
+
+        if average is not None:
+            fields.append(('30일 평균가', format_price(round(average))))
+
+        since = self.history.out_of_stock_since(service_name, url)
+
+        if since is not None:
+            duration = timedelta(seconds=int(now - since))
+            fields.append(('품절 기간', f'{duration.days}일 {duration.seconds // 3600}시간'))
+
+        return fields
 
     def get_menu_view(self):
-        return MenuView(self.services, self.item_dict, self.add, self.list_, self.info, self.delete, self.interaction_start, self.select_cancel)
+        return MenuView(self.services, self.url_dict, self.item_dict, self.add, self.list_, self.info, self.delete, self.interaction_start, self.select_cancel)
 
     async def interaction_start(self):
         self.interaction = True
@@ -218,10 +371,10 @@ class DiscordPriceBot(ds.Bot):
         print('Fetching item info...')
         await update_context_message('상품 정보를 가져오는 중...')
 
-        try:
-            url, item_info = await service.get_product_info(standardized_url)
-        except aiohttp.client.ClientError as e:
-            print(e, 'while fetching item status of URL: ' + input_url)
+        result = await service.fetch_item(standardized_url, max_age=cfg['result_freshness'])
+
+        if not result.ok:
+            print(result.describe(), 'while fetching item status of URL: ' + input_url)
             response_with_view = await interaction.edit_original_response(
                 embed=get_embed('추가 실패', '상품 정보를 가져오는 데 실패했습니다.', color=self.COLOR_ERROR),
                 view=self.get_menu_view()
@@ -230,7 +383,11 @@ class DiscordPriceBot(ds.Bot):
             self.interaction = False
             return
 
+        url, item_info = standardized_url, result.item
         self.url_dict[service.SERVICE_NAME].append(standardized_url)
+        self.store.add_url(service.SERVICE_NAME, url)
+        self.store.save_snapshots(service.SERVICE_NAME, {url: item_info.to_dict()})
+        self.record_history(service.SERVICE_NAME, url, item_info)
 
         embed = get_embed('상품 추가됨', '다음 상품을 추가했습니다.',
                           color=service.SERVICE_COLOR,
@@ -249,17 +406,7 @@ class DiscordPriceBot(ds.Bot):
 
             try:
                 label = entry['label']
-
-                if entry['type'] is list:
-                    value = ', '.join(value)
-                elif entry['type'] is dict:
-                    string_list = []
-                    for value_key, value_value in value.items():
-                        string_list.append(f'{value_key}: {value_value}')
-
-                    value = '\n'.join(string_list)
-
-                embed.add_field(name=label, value=value, inline=False)
+                embed.add_field(name=label, value=item_info.display(key), inline=False)
             except KeyError:
                 if entry['type'] is dict:
                     for option_label, option in value.items():
@@ -271,7 +418,7 @@ class DiscordPriceBot(ds.Bot):
         self.interaction = False
         self.message_with_view_id = response_with_view.id
         self.item_dict[service.SERVICE_NAME][url] = item_info
-        self.save_url_dict()
+        self.scheduler.add((service.SERVICE_NAME, url), self.get_interval(service.SERVICE_NAME, url))
 
     async def delete(self, interaction: ds.Interaction, service_name: str, delete_url_list: list):
         embed = get_embed('상품 제거됨', '다음 상품을 제거했습니다.',
@@ -280,10 +427,23 @@ class DiscordPriceBot(ds.Bot):
                           icon=self.services[service_name].SERVICE_ICON)
 
         for url in delete_url_list:
-            deleted_item = self.item_dict[service_name][url]
-            del self.item_dict[service_name][url]
+            # Items that were never fetched have no item, only their URL
+            deleted_item = self.item_dict[service_name].pop(url, None)
+            self.quarantine.forget((service_name, url))
+            self.services[service_name].forget(url)
 
             self.url_dict[service_name].remove(url)
+            self.store.remove_url(service_name, url)
+            self.history.forget(service_name, url)
+            self.rules.forget(service_name, url)
+            self.scheduler.remove((service_name, url))
+
+            if self.adaptive_interval is not None:
+                self.adaptive_interval.forget((service_name, url))
+
+            if deleted_item is None:
+                embed.add_field(name=url, value='상품 정보를 가져오지 못했습니다.', inline=False)
+                continue
 
             options = []
             try:
@@ -299,7 +459,6 @@ class DiscordPriceBot(ds.Bot):
 
             embed.add_field(name=deleted_item['name'], value=options_string, inline=False)
 
-        self.save_url_dict()
         response_with_view = await interaction.edit_original_response(embed=embed, view=self.get_menu_view())
         self.message_with_view_id = response_with_view.id
         self.interaction = False
@@ -307,38 +466,49 @@ class DiscordPriceBot(ds.Bot):
 
     async def info(self, interaction: ds.Interaction, service_name: str, url: str):
         service = self.services[service_name]
-        selected_item = self.item_dict[service_name][url]
 
-        embed = get_embed('상품 정보', None, color=service.SERVICE_COLOR,
-                          author=service.SERVICE_LABEL, icon=service.SERVICE_ICON)
+        # Shares the fetch with the check loop if it's fetching the same item right now.
+        # The result is only shown, not stored, so that the loop still notifies about changes
+        result = await service.fetch_item(url, max_age=cfg['result_freshness'])
 
-        for key, entry in selected_item.items():
-            value = entry['value']
+        if result.ok:
+            selected_item = result.item
+            description = None
+        else:
+            print(f'Failed to refresh {url}: {result.describe()}')
+            selected_item = self.item_dict[service_name].get(url)
 
-            if key == 'thumbnail':
-                embed.set_thumbnail(url=value)
-                continue
+            if selected_item is not None:
+                description = '최신 정보를 가져오지 못해 마지막으로 확인한 정보를 표시합니다.'
+            else:
+                description = '상품 정보를 가져오지 못했습니다.'
 
-            if not value:
-                continue
+        embed = get_embed('상품 정보', description, color=service.SERVICE_COLOR,
+                          author=service.SERVICE_LABEL, icon=service.SERVICE_ICON)
 
-            try:
-                label = entry['label']
+        if selected_item is None:
+            embed.add_field(name='오류', value=result.describe()[:1024], inline=False)
+        else:
+            for key, entry in selected_item.items():
+                value = entry['value']
 
-                if entry['type'] is list:
-                    value = ', '.join(value)
-                elif entry['type'] is dict:
-                    string_list = []
-                    for value_key, value_value in value.items():
-                        string_list.append(f'{value_key}: {value_value}')
+                if key == 'thumbnail':
+                    embed.set_thumbnail(url=value)
+                    continue
 
-                    value = '\n'.join(string_list)
+                if not value:
+                    continue
 
-                embed.add_field(name=label, value=value, inline=False)
-            except KeyError:
-                if entry['type'] is dict:
-                    for option_label, option in value.items():
-                        embed.add_field(name=option_label, value=option, inline=False)
+                try:
+                    label = entry['label']
+                    embed.add_field(name=label, value=selected_item.display(key), inline=False)
+                except KeyError:
+                    if entry['type'] is dict:
+                        for option_label, option in value.items():
+                            embed.add_field(name=option_label, value=option, inline=False)
+
+        for label, value in self.get_history_fields(service_name, url):
+            embed.add_field(name=label, value=value, inline=True)
 
         embed.add_field(name='URL', value=url, inline=False)
 
@@ -357,7 +527,11 @@ class DiscordPriceBot(ds.Bot):
                                   icon=self.services[service_name].SERVICE_ICON)
 
                 for url in url_list:
-                    item = self.item_dict[service_name][url]
+                    item = self.item_dict[service_name].get(url)
+
+                    if item is None:
+                        embed.add_field(name=url, value='상품 정보를 가져오지 못했습니다.', inline=False)
+                        continue
 
                     options = []
                     try:
@@ -373,7 +547,7 @@ class DiscordPriceBot(ds.Bot):
 
                     embed.add_field(
                         name=item['name'],
-                        value=f"{item['price']}{options_string}",
+                        value=f"{item.display_price() or '가격 정보 없음'}{options_string}",
                         inline=False
                     )
 
@@ -411,144 +585,214 @@ class DiscordPriceBot(ds.Bot):
             self.message_with_view_id = response_with_view.id
             self.initialized = True
 
+    def get_change_embed(self, service_name: str, url: str, item, last_item, changed_fields: list) -> ds.Embed:
+        changed_fields = {item.SHOWN_WITH.get(key, key) for key in changed_fields}
+        embed = get_embed(
+            '상품 정보 변경됨', '다음 상품의 정보가 변경되었습니다.',
+            author=self.services[service_name].SERVICE_LABEL,
+            icon=self.services[service_name].SERVICE_ICON,
+            color=self.services[service_name].SERVICE_COLOR
+        )
+
+        for key, entry in item.items():
+            item_value = entry['value']
+            last_value = last_item[key]
+
+            if key == 'thumbnail':
+                embed.set_thumbnail(url=item_value)
+                continue
+
+            try:
+                label = entry['label']
+                item_value_string = item.display(key, ' / ')
+                last_value_string = last_item.display(key, ' / ')
+
+                if key in changed_fields:
+                    if not item_value:
+                        item_value_string = '정보 없음'
+                    if not last_value:
+                        last_value_string = '정보 없음'
+
+                    embed.add_field(
+                        name=f'__{label}__',
+                        value=f'__{last_value_string} -> {item_value_string}__',
+                        inline=False)
+                    print(f'{key}: {last_value_string} -> {item_value_string}')
+                else:
+                    if item_value:
+                        embed.add_field(name=label, value=item_value_string, inline=False)
+
+            except KeyError:
+                if entry['type'] is dict:
+                    for option_label, option in item_value.items():
+                        if key in changed_fields and option != last_value.get(option_label):
+                            embed.add_field(
+                                name=option_label,
+                                value=f"{last_value.get(option_label, '정보 없음')} -> {option}",
+                                inline=False
+                            )
+                        else:
+                            embed.add_field(name=option_label, value=option, inline=False)
+
+        embed.add_field(name='URL', value=url, inline=False)
+        return embed
+
+    def get_quarantine_embed(self, service_name: str, url: str, result: FetchResult) -> ds.Embed:
+        embed = get_embed(
+            '상품 확인 실패', '다음 상품의 정보를 계속 가져오지 못해 확인 주기를 늘렸습니다.\n'
+            '정보를 다시 가져오면 원래 주기로 확인합니다.',
+            author=self.services[service_name].SERVICE_LABEL,
+            icon=self.services[service_name].SERVICE_ICON,
+            color=self.COLOR_ERROR
+        )
+
+        last_item = self.item_dict[service_name].get(url)
+
+        if last_item is not None:
+            embed.add_field(name='상품명', value=last_item['name'], inline=False)
+
+        embed.add_field(name='오류', value=result.describe()[:1024], inline=False)
+        embed.add_field(name='URL', value=url, inline=False)
+        return embed
+
+    def record_failure(self, service_name: str, url: str, result: FetchResult) -> Union[ds.Embed, None]:
+        """Counts a failed fetch and quarantines the item once the failures persist.
+        Returns an embed reporting the quarantine, only the first time."""
+        key = (service_name, url)
+
+        # Already quarantined items were reported before
+        if not self.quarantine.record_failure(key, result):
+            return None
+
+        print(f'Quarantining {url} after {self.quarantine.failures(key)} failures')
+        return self.get_quarantine_embed(service_name, url, result)
+
+    def render_notification(self, key: tuple, first_item, latest_item) -> Union[ds.Embed, None]:
+        """Renders the changes of an item coalesced by the notifier, or None if they no longer need a notification."""
+        service_name, url = key
+
+        if url not in self.url_dict[service_name]:  # Deleted while queued
+            return None
+
+        changed_fields = self.rules.get(service_name, url).evaluate(latest_item, first_item)
+
+        if not changed_fields:
+            return None
+
+        return self.get_change_embed(service_name, url, latest_item, first_item, changed_fields)
+
+    async def send_notification_message(self, embeds: list) -> None:
+        await self.target.send(f'<@{self.owner_id}> 상품 정보 변동 알림', embeds=embeds)
+
+    async def repost_menu_view(self) -> None:
+        """Moves the menu below the notifications, once per notifier flush."""
+        if self.message_with_view_id is not None:
+            message_with_view = self.target.get_partial_message(self.message_with_view_id)
+
+            try:
+                await self.notifier.call('edit', lambda: message_with_view.edit(view=None))
+            except ds.HTTPException:
+                await self.notifier.call('delete', message_with_view.delete)
+
+        response_with_view = await self.notifier.call('send', lambda: self.target.send(view=self.get_menu_view()))
+        self.message_with_view_id = response_with_view.id
+
+    async def check_items(self, service_name: str, url_list: list) -> None:
+        next_intervals = {}
+
+        try:
+            results = await self.services[service_name].fetch_items(url_list)
+            snapshots = {}
+
+            for url, result in results.items():
+                if url not in self.url_dict[service_name]:  # Deleted while fetching
+                    continue
+
+                key = (service_name, url)
+
+                if not result.ok:
+                    print(f'Failed to fetch {url}: {result.describe()}')
+                    embed = self.record_failure(service_name, url, result)
+
+                    if embed is not None:
+                        self.notifier.push_embed(embed)
+                    if key in self.quarantine:
+                        next_intervals[url] = cfg['quarantine']['interval']
+                    continue
+
+                if self.quarantine.record_success(key):
+                    print('Item recovered from quarantine:', url)
+
+                item = result.item
+                last_item = self.item_dict[service_name].get(url)
+                self.item_dict[service_name][url] = item
+                next_intervals[url] = self.get_next_interval(service_name, url, item, last_item)
+
+                if last_item is None or item.fingerprint != last_item.fingerprint:
+                    snapshots[url] = item.to_dict()
+                    self.record_history(service_name, url, item)
+
+                if cfg['test_mode'] is True:
+                    print(f'{item["name"]} | {item["price"]} | {url}')
+                elif last_item is not None and item.fingerprint != last_item.fingerprint:
+                    # Changes are recorded above either way, rules only decide whether to notify
+                    changed_fields = self.rules.get(service_name, url).evaluate(item, last_item)
+
+                    if changed_fields:
+                        print('Item status changed:', item['name'], f"({url})")
+                        # Sent by the notifier, so that checks never wait on Discord
+                        self.notifier.push((service_name, url), last_item, item)
+                    else:
+                        print('Item status changed without matching alert rules:', item['name'], f"({url})")
+
+            if snapshots:
+                self.store.save_snapshots(service_name, snapshots)
+
+        except Exception as e:
+            print(f'Price check failed for {service_name} with exception {e}')
+            traceback.print_tb(e.__traceback__)
+
+        finally:
+            # Items that failed keep their current interval
+            for url in url_list:
+                self.scheduler.reschedule((service_name, url), next_intervals.get(url))
+
+    async def report_stats(self) -> None:
+        """Prints one summary of the shared components and every service each stats_interval seconds,
+        instead of one per checked batch."""
+        while True:
+            await asyncio.sleep(cfg['stats_interval'])
+
+            print('Stats summary:')
+            print(RATE_LIMITER.report())
+            print(self.loop_lag.report())
+            print(LINK_CACHE.report())
+
+            for service_name, service in self.services.items():
+                for line in service.report():
+                    print(f'[{service_name}]', line)
+
     async def check_price(self):
         print('Starting price check loop...')
         while not self.is_ready():
             print('Waiting for bot to be ready...')
             await asyncio.sleep(1)
+
         if cfg['test_mode'] is True:
             print('Test mode enabled')
-            while True:
-                self.item_dict = {}
-                await self.update_item_dict()
-                for service_name, service_item_dict in self.item_dict.items():
-                    for url, item in service_item_dict.items():
-                        print(f'{item["name"]} | {item["price"]} | {url}')
-
-                await asyncio.sleep(cfg['interval'])
-
-        else:
-            print('Loop is now starting...')
-            while True:
-                try:
-                    last_dict = deepcopy(self.item_dict)
-                    await self.update_item_dict()
-
-                    embeds_to_send = []
-
-                    for service_name, service_item_dict in self.item_dict.items():
-                        try:
-                            for url, item in service_item_dict.items():
-                                last_item = last_dict[service_name][url]
-
-                                if item != last_item:
-                                    print('Item status changed:', item['name'], f"({url})")
-                                    embed = get_embed(
-                                         '상품 정보 변경됨', '다음 상품의 정보가 변경되었습니다.',
-                                         author=self.services[service_name].SERVICE_LABEL,
-                                         icon=self.services[service_name].SERVICE_ICON,
-                                         color=self.services[service_name].SERVICE_COLOR
-                                    )
-
-                                    for key, entry in item.items():
-                                        item_value = entry['value']
-                                        last_value = last_item[key]
-
-                                        item_value_string = item_value
-                                        last_value_string = last_value
-
-                                        if key == 'thumbnail':
-                                            embed.set_thumbnail(url=item_value)
-                                            continue
-
-                                        try:
-                                            label = entry['label']
-
-                                            if entry['type'] is list:
-                                                item_value_string = ', '.join(item_value)
-                                                last_value_string = ', '.join(last_value)
-                                            elif entry['type'] is dict:
-                                                string_list = []
-                                                last_string_list = []
-                                                for value_key, value_value in item_value.items():
-                                                    string_list.append(f'{value_key}: {value_value}')
-
-                                                for last_value_key, last_value_value in last_value.items():
-                                                    last_string_list.append(f'{last_value_key}: {last_value_value}')
-
-                                                item_value_string = ' / '.join(string_list)
-                                                last_value_string = ' / '.join(last_string_list)
-
-                                            if item_value != last_item[key]:
-                                                if not item_value:
-                                                    item_value_string = '정보 없음'
-                                                if not last_value:
-                                                    last_value_string = '정보 없음'
-
-                                                embed.add_field(
-                                                    name=f'__{label}__',
-                                                    value=f'__{last_value_string} -> {item_value_string}__',
-                                                    inline=False)
-                                                print(f'{key}: {last_value_string} -> {item_value_string}')
-                                            else:
-                                                if item_value:
-                                                    embed.add_field(name=label, value=item_value_string, inline=False)
-
-                                        except KeyError:
-                                            if entry['type'] is dict:
-                                                for option_label, option in item_value.items():
-                                                    if option != last_value[option_label]:
-                                                        embed.add_field(
-                                                            name=option_label,
-                                                            value=f'{last_value[option_label]} -> {option}',
-                                                            inline=False
-                                                        )
-                                                    else:
-                                                        embed.add_field(name=option_label, value=option, inline=False)
-
-                                    embed.add_field(name='URL', value=url, inline=False)
-                                    embeds_to_send.append(embed)
-
-                        except KeyError:  # New items
-                            pass
-
-                    if embeds_to_send:
-                        if self.interaction:
-                            print('Waiting for interaction to finish...')
-                            while True:
-                                if not self.interaction:
-                                    await asyncio.sleep(3)
-                                    break
-                                await asyncio.sleep(1)
-
-                        if len(embeds_to_send) <= 10:
-                            await self.target.send(f'<@{self.owner_id}>', embeds=embeds_to_send)
-                        else:
-                            buffer = []
-                            for i, embed in enumerate(embeds_to_send):
-                                i += 1
-                                buffer.append(embed)
-
-                                if i % 10 == 0:
-                                    await self.target.send(f'<@{self.owner_id}> 상품 정보 변동 알림', embeds=buffer)
-                                    buffer = []
-
-                        message_with_view = await self.target.fetch_message(self.message_with_view_id)
-
-                        try:
-                            await message_with_view.edit(view=None)
-                        except ds.HTTPException:
-                            await message_with_view.delete()
 
-                        response_with_view = await self.target.send(view=self.get_menu_view())
-                        self.message_with_view_id = response_with_view.id
+        print('Loop is now starting...')
+        while True:
+            urls_by_service = {}
 
-                    await asyncio.sleep(cfg['interval'])
+            for service_name, url in await self.scheduler.next_batch():
+                urls_by_service.setdefault(service_name, []).append(url)
 
-                except Exception as e:
-                    print(f'Price check failed with exception {e}')
-                    traceback.print_tb(e.__traceback__)
-                    await asyncio.sleep(cfg['interval'])
+            # Every batch is checked independently, so a slow service never delays the others
+            for service_name, url_list in urls_by_service.items():
+                task = asyncio.create_task(self.check_items(service_name, url_list))
+                self.check_tasks.add(task)
+                task.add_done_callback(self.check_tasks.discard)
 
 
 if __name__ == '__main__':
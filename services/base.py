@@ -1,77 +1,338 @@
+import re
 import abc
+import json
+from copy import copy
+import asyncio
+from hashlib import blake2b
 from fake_useragent import UserAgent
 from aiohttp import ClientTimeout
-from typing import Union, Dict, Any
+from typing import Union, Dict, Any, List, Tuple, Iterator, Type, Callable
+from util.resilience import FetchResult, FetchStatus, RetryPolicy, CircuitBreaker, CircuitOpenError, classify_error
+from util.singleflight import SingleFlight
 
 USER_AGENT = UserAgent().chrome
 TIMEOUT = ClientTimeout(total=30)
 
 
 class AbstractService(abc.ABC):
-    SERVICE_DEFAULT_CONFIG: Union[None, Dict[str, Union[str, int, bool]]]
+    SERVICE_DEFAULT_CONFIG: Union[None, Dict[str, Union[str, int, bool, List[str]]]]
     SERVICE_NAME: str
     SERVICE_LABEL: str
     SERVICE_COLOR: int
     SERVICE_USES_PLAYWRIGHT: bool = False
+    SERVICE_ITEM_CLASS: Type['BaseServiceItem']
+    RETRY_POLICY = RetryPolicy()
+
+    async def start(self) -> None:
+        """Called once inside the bot's event loop before the first fetch. Open long-lived resources here."""
+        pass
+
+    async def close(self) -> None:
+        """Called on shutdown. Close everything opened in start()."""
+        pass
 
     @abc.abstractmethod
     async def standardize_url(self, url: str) -> Union[str, None]:
         raise NotImplementedError
 
     @abc.abstractmethod
-    async def fetch_items(self, url_list: list):
+    async def fetch_items(self, url_list: list) -> Dict[str, FetchResult]:
         raise NotImplementedError
 
+    @property
+    def circuit_breaker(self) -> CircuitBreaker:
+        if '_circuit_breaker' not in self.__dict__:
+            self._circuit_breaker = CircuitBreaker()
+
+        return self._circuit_breaker
+
+    @property
+    def single_flight(self) -> SingleFlight:
+        if '_single_flight' not in self.__dict__:
+            self._single_flight = SingleFlight()
+
+        return self._single_flight
+
+    def report(self) -> List[str]:
+        """Lines of the periodic stats summary of this service. Extend it with the stats of service resources."""
+        return [self.circuit_breaker.report(), self.single_flight.report()]
+
+    def forget(self, url: str) -> None:
+        """Called when an item is deleted. Drop everything kept for url here."""
+        self.single_flight.forget(url)
+
+    async def fetch_item(self, url: str, max_age: float = 0) -> FetchResult:
+        """Fetches a single item with get_product_info, retrying transient failures according to RETRY_POLICY.
+        Never raises; the outcome is returned as a FetchResult.
+
+        Concurrent fetches of the same URL share a single fetch. With max_age, a successful result
+        fetched at most max_age seconds ago is returned without fetching."""
+        return await self.single_flight.do(url, lambda: self._fetch_item(url), max_age, keep=lambda result: result.ok)
+
+    async def _fetch_item(self, url: str) -> FetchResult:
+        for attempt in range(self.RETRY_POLICY.attempts):
+            try:
+                probe = self.circuit_breaker.check()
+            except CircuitOpenError as e:
+                return FetchResult(FetchStatus.SKIPPED, error=e)
+
+            try:
+                _, item = await self.get_product_info(url)
+            except Exception as e:
+                status = classify_error(e)
+
+                if status is FetchStatus.PERMANENT:
+                    # The host answered, so the service is up even though this item failed
+                    if probe:
+                        self.circuit_breaker.record_success()
+
+                    return FetchResult(status, error=e)
+
+                self.circuit_breaker.record_failure()
+
+                if attempt == self.RETRY_POLICY.attempts - 1:
+                    return FetchResult(status, error=e)
+            else:
+                self.circuit_breaker.record_success()
+                return FetchResult.success(item)
+            finally:
+                # A probe that ended any other way, e.g. by cancellation, must not keep the circuit half-open
+                if probe:
+                    self.circuit_breaker.end_probe()
+
+            await asyncio.sleep(self.RETRY_POLICY.delay(attempt))
+
+    async def fetch_results(self, url_list: list) -> Dict[str, FetchResult]:
+        """Fetches every item independently, so that one failing URL doesn't affect the others."""
+        results = await asyncio.gather(*[self.fetch_item(url) for url in url_list])
+        return dict(zip(url_list, results))
+
     @abc.abstractmethod
     async def get_product_info(self, url: str):
         raise NotImplementedError
 
 
+def hash_value(value: Any) -> bytes:
+    """Stable 8 byte hash of a field value. Dict values hash the same regardless of key order."""
+    encoded = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str).encode()
+    return blake2b(encoded, digest_size=8).digest()
+
+
+PRICE_PATTERN = re.compile('[0-9][0-9,]*')
+
+
+def parse_price(text: Union[str, None]) -> Union[int, None]:
+    """Returns the first number in a price string like '12,340원', or None if there is none."""
+    match = PRICE_PATTERN.search(text) if text else None
+    return int(match.group().replace(',', '')) if match else None
+
+
+def format_price(price: int) -> str:
+    return f'{price:,}원'
+
+
+def format_percent(rate: int) -> str:
+    return f'{rate}%'
+
+
+class Field:
+    """Schema entry of an item field, shared by every instance of the item class.
+    Fields without a label are not shown as a labeled value, e.g. thumbnails and options.
+    A default of None makes the field optional, so that None can stand for an unknown value.
+    render formats a value for display, or every value of a list or dict field."""
+    __slots__ = ('name', 'type', 'default', 'label', 'render')
+
+    def __init__(self, name: str, type_: type, default: Any, label: Union[str, None] = None,
+                 render: Union[Callable[[Any], str], None] = None):
+        self.name = name
+        self.type = type_
+        self.default = default
+        self.label = label
+        self.render = render
+
+    def __repr__(self):
+        return f'Field({self.name!r}, {self.type.__name__}, {self.default!r}, {self.label!r})'
+
+
+class FieldEntry:
+    """Read-only view of a field of an item, indexable by 'label', 'type' and 'value' like the old item dicts.
+    Indexing 'label' raises KeyError if the field has no label."""
+    __slots__ = ('field', 'value')
+
+    def __init__(self, field: Field, value: Any):
+        self.field = field
+        self.value = value
+
+    def __getitem__(self, key: str) -> Any:
+        if key == 'value':
+            return self.value
+        elif key == 'type':
+            return self.field.type
+        elif key == 'label' and self.field.label is not None:
+            return self.field.label
+
+        raise KeyError(key)
+
+    def __repr__(self):
+        return f'{self.field.name}={self.value!r}'
+
+
 class BaseServiceItem:
-    """Base class for service items."""
-    def __init__(self, item_dict: dict, **kwargs):
-        self.dict = item_dict
+    """Base class for service items.
+
+    Subclasses declare their schema once in FIELDS and an empty __slots__, and every instance only stores
+    its values. Values are accessed like a dict, item['name'], and items() yields FieldEntry views.
+
+    Each item carries a fingerprint of its values and a hash per field, computed once on first use,
+    so that change detection compares a few bytes instead of whole items.
+
+    Prices and stock are stored as typed values, price as an int and in_stock as a bool, and are only
+    formatted by display() when shown."""
+    FIELDS: Tuple[Field, ...] = ()
+    # Card discount and benefit price fields, watched by card_benefit alert rules
+    BENEFIT_FIELDS: Tuple[str, ...] = ()
+    # Fields that say why there is no price, shown in its place when the price is None
+    PRICE_STATUS_FIELDS: Tuple[str, ...] = ()
+    # Unlabeled fields shown as part of a labeled one by display(), so that their changes are reported under it
+    SHOWN_WITH: Dict[str, str] = {}
+    _INDEX: Dict[str, int] = {}
+
+    __slots__ = ('_values', '_field_hashes', '_fingerprint')
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._INDEX = {field.name: i for i, field in enumerate(cls.FIELDS)}
+
+    def __init__(self, **kwargs):
+        self._values = [copy(field.default) for field in self.FIELDS]
+        self._field_hashes: Union[Tuple[bytes, ...], None] = None
+        self._fingerprint: Union[bytes, None] = None
 
         for key, value in kwargs.items():
             self.__setitem__(key, value)
 
+    @classmethod
+    def schema(cls) -> str:
+        """Signature of the field schema. Saved snapshots are only comparable under the same signature."""
+        return ','.join(f'{field.name}:{field.type.__name__}' for field in cls.FIELDS)
+
+    @classmethod
+    def from_dict(cls, fields: Dict[str, Any]) -> 'BaseServiceItem':
+        return cls(**fields)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {field.name: value for field, value in zip(self.FIELDS, self._values)}
+
+    def _field(self, key: str) -> Field:
+        return self.FIELDS[self._INDEX[key]]
+
     def label(self, key):
-        return self.dict[key]['label']
+        label = self._field(key).label
+
+        if label is None:
+            raise KeyError(f'{key} has no label')
+
+        return label
 
     def type(self, key):
-        return self.dict[key]['type']
+        return self._field(key).type
 
     def value(self, key):
-        return self.dict[key]['value']
+        return self[key]
+
+    @property
+    def field_hashes(self) -> Tuple[bytes, ...]:
+        if self._field_hashes is None:
+            self._field_hashes = tuple(hash_value(value) for value in self._values)
 
-    def __iter__(self):
-        return iter(self.dict)
+        return self._field_hashes
+
+    @property
+    def fingerprint(self) -> bytes:
+        if self._fingerprint is None:
+            self._fingerprint = blake2b(b''.join(self.field_hashes), digest_size=16).digest()
+
+        return self._fingerprint
+
+    def changed_fields(self, other: 'BaseServiceItem') -> List[str]:
+        """Returns the keys whose values differ from other, an item of the same class."""
+        if self.fingerprint == other.fingerprint:
+            return []
+
+        return [field.name for field, own_hash, other_hash in zip(self.FIELDS, self.field_hashes, other.field_hashes)
+                if own_hash != other_hash]
+
+    def display_price(self) -> str:
+        """Returns the price formatted for display, or the reason there is no price if the item gives one."""
+        price = self.display('price')
+
+        if price:
+            return price
+
+        return next(filter(None, (self.display(key) for key in self.PRICE_STATUS_FIELDS)), '')
+
+    def in_stock(self) -> Union[bool, None]:
+        """Returns whether the item is in stock, or None if the service doesn't report stock."""
+        return self['in_stock'] if 'in_stock' in self._INDEX else None
+
+    def display(self, key: str, separator: str = '\n') -> str:
+        """Returns the value of key formatted for display. List values are joined with ', ',
+        dict values are joined as 'key: value' with separator. Empty values are returned as ''."""
+        field = self._field(key)
+        value = self[key]
+        render = field.render if field.render is not None else str
+
+        if value is None or (not value and field.type is not int):
+            return ''
+        elif field.type is list:
+            return ', '.join(render(element) for element in value)
+        elif field.type is dict:
+            return separator.join(f'{name}: {render(element)}' for name, element in value.items())
+
+        return render(value)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._INDEX)
 
     def __len__(self):
-        return len(self.dict)
+        return len(self.FIELDS)
+
+    def __contains__(self, key) -> bool:
+        return key in self._INDEX
 
     def keys(self):
-        return self.dict.keys()
+        return self._INDEX.keys()
 
-    def values(self):
-        return self.dict.values()
+    def values(self) -> List[FieldEntry]:
+        return [FieldEntry(field, value) for field, value in zip(self.FIELDS, self._values)]
 
-    def items(self):
-        return self.dict.items()
+    def items(self) -> List[Tuple[str, FieldEntry]]:
+        return [(field.name, FieldEntry(field, value)) for field, value in zip(self.FIELDS, self._values)]
 
     def __getitem__(self, key) -> Any:
-        return self.dict[key]['value']
+        return self._values[self._INDEX[key]]
 
     def __setitem__(self, key, value) -> None:
-        if type(value) is not self.dict[key]['type']:
-            raise TypeError(f'{key} value type must be {self.dict[key]["type"]}, not {type(value)}')
-        elif key not in self.dict.keys():
-            raise KeyError(f'{key} is not a valid key for {self.__class__.__name__}')
-        else:
-            self.dict[key]['value'] = value
+        try:
+            index = self._INDEX[key]
+        except KeyError:
+            raise KeyError(f'{key} is not a valid key for {self.__class__.__name__}') from None
+
+        field = self.FIELDS[index]
+
+        if type(value) is not field.type and not (value is None and field.default is None):
+            raise TypeError(f'{key} value type must be {field.type}, not {type(value)}')
+
+        self._values[index] = value
+        self._field_hashes = None
+        self._fingerprint = None
 
     def __repr__(self):
-        return str(self.dict)
+        values = ', '.join(f'{field.name}={value!r}' for field, value in zip(self.FIELDS, self._values))
+        return f'{self.__class__.__name__}({values})'
 
     def __eq__(self, other):
-        return self.dict == other.dict
+        if not isinstance(other, BaseServiceItem):
+            return NotImplemented
+
+        return type(self) is type(other) and self.fingerprint == other.fingerprint
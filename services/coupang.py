@@ -1,10 +1,17 @@
 import re
+import json
 import asyncio
 import aiohttp
-from typing import Union, Tuple
+from typing import Union, Tuple, Dict, Any, List
 from furl import furl
-from bs4 import BeautifulSoup
-from services.base import AbstractService, BaseServiceItem, USER_AGENT, TIMEOUT
+from services.base import AbstractService, BaseServiceItem, Field, USER_AGENT, TIMEOUT, format_price, format_percent
+from util.resilience import FetchResult
+from util.auth import LoginManager
+from util.http import HttpClient, Response
+from util.parser import Region, text as node_text
+from util.executor import PARSE_EXECUTOR
+from util.cache import ResponseCache
+from util.linkcache import LINK_CACHE
 from util.favicon import get_favicon
 
 
@@ -12,19 +19,237 @@ def pprint(*args, **kwargs):
     print('[coupang]', *args, **kwargs)
 
 
-class CoupangItem(BaseServiceItem):
-    def __init__(self, **kwargs):
-        coupang_dict = {
-            'name': {'label': '상품명', 'type': str, 'value': ''},
-            'option': {'type': dict, 'value': {}},
-            'price': {'label': '가격', 'type': str, 'value': ''},
-            'quantity': {'label': '재고', 'type': str, 'value': ''},
-            'card_benefits': {'label': '카드 할인', 'type': dict, 'value': {}},
-            'preorder': {'label': '사전예약', 'type': str, 'value': '사전예약 중 아님'},
-            'thumbnail': {'type': str, 'value': ''}
+# Outermost elements of everything read from a product page
+PRODUCT_REGION = Region([
+    'prod-buy-header__title', 'total-price', 'title', 'value', 'benefit-label', 'ccid-benefit-badge__inr',
+    'aos-label', 'oos-label', 'prod-pre-order-badge-text', 'prod-image__detail'
+])
+
+# Only shown in the header of pages requested with a valid session
+LOGGED_IN_MARKER = b'login.coupang.com/login/logout.pang'
+PRODUCT_PAGE_MARKER = b'class="prod-atf'
+
+PRODUCT_ID_PATTERN = re.compile('[0-9]+')
+NON_DIGIT_PATTERN = re.compile('[^0-9]')
+
+# Checked in order, since some keys are substrings of other image names
+CARD_ISSUERS = (
+    ('hana-sk', '하나'),
+    ('kb', '국민'),
+    ('lotte', '롯데'),
+    ('shinhan', '신한'),
+    ('hyundai', '현대'),
+    ('woori', '우리'),
+    ('samsung', '삼성'),
+    ('bc', 'BC'),
+    ('nh', '농협')
+)
+
+
+def parse_product(body: bytes, encoding: str, use_wow_price: bool) -> Dict[str, Any]:
+    """Parses a product page into CoupangItem fields."""
+    soup = PRODUCT_REGION.parse(body, encoding)
+
+    price_match = soup.select('span.total-price > strong')
+    item_match = soup.find_all('h2', class_='prod-buy-header__title')
+
+    item_name = node_text(item_match[0])
+
+    option_names = [node_text(option_name) for option_name in soup.find_all('span', class_='title')]
+    option_values = [node_text(option_value) for option_value in soup.find_all('span', class_='value')]
+
+    option = {}
+
+    for x in range(len(option_names)):
+        option[option_names[x]] = option_values[x]
+
+    if not price_match:
+        current_price = None
+
+    else:
+        if use_wow_price:
+            try:
+                price_output = list(price_match[1].stripped_strings)
+                if price_output == ['원']:
+                    raise IndexError
+
+            except IndexError:
+                price_output = list(price_match[0].stripped_strings)
+
+        else:
+            price_output = list(price_match[0].stripped_strings)
+
+        current_price = int(NON_DIGIT_PATTERN.sub('', price_output[0]))
+
+    card_benefits = {}
+    if soup.find('span', class_='benefit-label'):
+        rates = []
+
+        for element in soup.find_all('span', class_='benefit-label'):
+            rate = NON_DIGIT_PATTERN.sub('', node_text(element))
+
+            rates.append(int(rate))
+
+        card_sets = []
+
+        for benefit_badge in soup.find_all('div', class_='ccid-benefit-badge__inr'):
+            card_set = []
+            for element in benefit_badge.find_all('img', recursive=False):
+                img_src = element['src']
+
+                for key, issuer in CARD_ISSUERS:
+                    if key in img_src:
+                        card_set.append(issuer)
+                        break
+            card_sets.append(card_set)
+
+        for i in range(len(rates)):
+            card_benefits[', '.join(card_sets[i])] = rates[i]
+
+    in_stock = True
+
+    if soup.find('div', class_='aos-label'):
+        qty = node_text(soup.find('div', class_='aos-label'))
+    elif soup.find('div', class_='oos-label'):
+        qty = '품절'
+        in_stock = False
+    else:
+        qty = '재고 있음'
+
+    if soup.find('span', class_='prod-pre-order-badge-text').string:
+        preorder = '사전예약 중'
+    else:
+        preorder = '사전예약 중 아님'
+
+    thumbnail = soup.find('img', class_='prod-image__detail')
+    thumbnail = f"https:{thumbnail['src']}"
+
+    return {
+        'name': item_name,
+        'price': current_price,
+        'option': option,
+        'quantity': qty,
+        'in_stock': in_stock,
+        'card_benefits': card_benefits,
+        'preorder': preorder,
+        'thumbnail': thumbnail
+    }
+
+
+SDP_PATTERN = re.compile(r'exports\.sdp\s*=\s*')
+
+# Keys tried in order when reading a variant from the page state. A variant is only used if every field is found,
+# otherwise it is fetched from its own page
+VARIANT_KEYS = {
+    'name': ('vendorItemName', 'itemName'),
+    'price': ('salePrice', 'finalPrice', 'price'),
+    'wow_price': ('wowPrice', 'wowCashPrice'),
+    'sold_out': ('soldOut', 'isSoldOut'),
+    'attributes': ('attributes', 'itemAttributes'),
+    'thumbnail': ('imageUrl', 'thumbnailUrl', 'thumbnailImage')
+}
+
+
+def get_product_key(url: str) -> str:
+    """Returns the pageValue shared by every variant of the product at url."""
+    return furl(url).path.segments[-1]
+
+
+def _find_variants(node: Any, vendor_item_ids: set, found: Dict[str, dict]) -> None:
+    if isinstance(node, dict):
+        vendor_item_id = str(node.get('vendorItemId', ''))
+
+        # The same variant may appear more than once. Keep the most detailed entry
+        if vendor_item_id in vendor_item_ids and len(node) > len(found.get(vendor_item_id, {})):
+            found[vendor_item_id] = node
+
+        for value in node.values():
+            _find_variants(value, vendor_item_ids, found)
+    elif isinstance(node, list):
+        for value in node:
+            _find_variants(value, vendor_item_ids, found)
+
+
+def _first(node: dict, key: str) -> Any:
+    for candidate in VARIANT_KEYS[key]:
+        if candidate in node:
+            return node[candidate]
+
+    return None
+
+
+def parse_variants(body: bytes, encoding: str, vendor_item_ids: List[str], use_wow_price: bool) -> Dict[str, Dict[str, Any]]:
+    """Reads the variants with the given vendorItemIds from the page state embedded in a product page.
+    Returns CoupangItem fields by vendorItemId, without card_benefits and preorder which are shared by the page.
+    Variants missing any field are left out."""
+    text = body.decode(encoding, errors='replace')
+    match = SDP_PATTERN.search(text)
+
+    if match is None:
+        return {}
+
+    try:
+        state, _ = json.JSONDecoder().raw_decode(text, match.end())
+    except ValueError:
+        return {}
+
+    nodes = {}
+    _find_variants(state, set(vendor_item_ids), nodes)
+    variants = {}
+
+    for vendor_item_id, node in nodes.items():
+        name = _first(node, 'name')
+        price = _first(node, 'price')
+        wow_price = _first(node, 'wow_price')
+        sold_out = _first(node, 'sold_out')
+        attributes = _first(node, 'attributes')
+        thumbnail = _first(node, 'thumbnail')
+
+        if use_wow_price and isinstance(wow_price, int) and wow_price:
+            price = wow_price
+
+        if not (isinstance(name, str) and isinstance(price, int) and isinstance(sold_out, bool)
+                and isinstance(attributes, list) and isinstance(thumbnail, str)):
+            continue
+
+        try:
+            option = {attribute['name']: attribute['value'] for attribute in attributes}
+        except (KeyError, TypeError):
+            continue
+
+        variants[vendor_item_id] = {
+            'name': name,
+            'price': price,
+            'option': option,
+            'quantity': '품절' if sold_out else '재고 있음',
+            'in_stock': not sold_out,
+            'thumbnail': thumbnail if thumbnail.startswith('http') else f'https:{thumbnail}'
         }
 
-        super().__init__(coupang_dict, **kwargs)
+    return variants
+
+
+class CoupangItem(BaseServiceItem):
+    __slots__ = ()
+    FIELDS = (
+        Field('name', str, '', '상품명'),
+        Field('option', dict, {}),
+        Field('price', int, None, '가격', format_price),
+        Field('quantity', str, '', '재고'),
+        Field('in_stock', bool, True),
+        Field('card_benefits', dict, {}, '카드 할인', format_percent),
+        Field('preorder', str, '사전예약 중 아님', '사전예약'),
+        Field('thumbnail', str, '')
+    )
+    BENEFIT_FIELDS = ('card_benefits',)
+
+    def display(self, key: str, separator: str = '\n') -> str:
+        value = super().display(key, separator)
+
+        if key == 'price' and value and not self['in_stock']:
+            value += ' (품절)'
+
+        return value
 
 
 class CoupangService(AbstractService):
@@ -37,6 +262,9 @@ class CoupangService(AbstractService):
     SERVICE_NAME = 'coupang'
     SERVICE_LABEL = '쿠팡'
     SERVICE_COLOR = 0xC73D33
+    SERVICE_ITEM_CLASS = CoupangItem
+    # Times a variant is read from the page of another variant before its own page is checked again
+    VARIANT_READS_PER_CHECK = 3
 
     def __init__(self, cfg):
         self.USE_WOW_PRICE = cfg['use_wow_price']
@@ -45,6 +273,9 @@ class CoupangService(AbstractService):
         self.EMAIL = cfg['email']
         self.PASSWORD = cfg['password']
 
+        self.login_manager = LoginManager(self.SERVICE_NAME, self._login)
+        self.jar: Union[aiohttp.CookieJar, None] = None
+
         self.header = {
             'user-agent': USER_AGENT,
             'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9',
@@ -67,6 +298,19 @@ class CoupangService(AbstractService):
             'Referer': 'https://login.coupang.com/login/login.pang'
         }
 
+        self.http = HttpClient(headers=self.header, timeout=TIMEOUT)
+        # Everything parsed is above the product detail tabs
+        self.cache = ResponseCache(b'class="prod-atf', b'id="btfTab"')
+        # Tracked URLs by product, and the variants last read from the page of another variant of the same product.
+        # A variant read since its own last check is used instead of fetching its page again, but only if the page
+        # state matched the rendered page on its own last check, so that both ways give the same item.
+        # Consistent variants map to the reads left before their own page has to be checked again
+        self.variant_groups: Dict[str, set] = {}
+        self.variant_items: Dict[str, CoupangItem] = {}
+        self.fresh_variants = set()
+        self.consistent_variants: Dict[str, int] = {}
+        self.variant_hits = 0
+
         #self.SERVICE_ICON = get_favicon('https://www.coupang.com/', headers=self.header)
         self.SERVICE_ICON = 'https://image9.coupangcdn.com/image/coupang/favicon/v2/favicon.ico'
         pprint('coupang service initialized.')
@@ -82,18 +326,19 @@ class CoupangService(AbstractService):
             elif input_string.startswith('쿠팡을 추천합니다!'):
                 url = input_string.split('\n')[2]
 
-                async with aiohttp.ClientSession(headers=self.header) as session:
-                    async with session.get(url, headers=self.header) as r:
-                        f = furl(r.url)
+                resolved = await LINK_CACHE.resolve(self.http.session, url, accept=lambda u: 'pageValue=' in u)
+                f = furl(resolved)
 
-                        page_value = f.args['pageValue']
-                        item_id = f.args['itemId']
-                        vendor_item_id = f.args['vendorItemId']
+                page_value = f.args['pageValue']
+                item_id = f.args['itemId']
+                vendor_item_id = f.args['vendorItemId']
 
                 url = f'https://www.coupang.com/vp/products/{page_value}?itemId={item_id}&vendorItemId={vendor_item_id}'
 
             elif 'link.coupang.com' in input_string:
-                f = furl(input_string)
+                # Short links like link.coupang.com/a/... only carry the product in their redirect target
+                resolved = await LINK_CACHE.resolve(self.http.session, input_string, accept=lambda u: 'pageValue=' in u)
+                f = furl(resolved)
 
                 page_value = f.args['pageValue']
                 item_id = f.args['itemId']
@@ -104,7 +349,7 @@ class CoupangService(AbstractService):
             elif 'www.coupang.com/vp/products/' in input_string:
                 f = furl(input_string)
 
-                page_value = [string for string in re.findall('[0-9]*', input_string.split('?')[0]) if string][0]
+                page_value = PRODUCT_ID_PATTERN.findall(input_string.split('?')[0])[0]
                 item_id = f.args['itemId']
                 vendor_item_id = f.args['vendorItemId']
 
@@ -114,139 +359,146 @@ class CoupangService(AbstractService):
                 return None
 
             return url
-        except aiohttp.ClientError:
+        except (aiohttp.ClientError, KeyError):
             pprint(f'Error while standardizing Coupang URL/string: {input_string}')
             return None
 
-    async def fetch_items(self, url_list: list) -> dict:
-        async with aiohttp.ClientSession(headers=self.header, timeout=TIMEOUT) as session:
-            if self.LOGIN:
-                await self._login(session)
-            results = await asyncio.gather(*[self.get_product_info(url, session) for url in url_list])
+    async def start(self) -> None:
+        if self.LOGIN:
+            self.jar = self.login_manager.cookie_jar()
+            self.http.cookie_jar = self.jar
 
-        result_dict = {}
+        await self.http.start()
 
-        for result in results:
-            result_dict[result[0]] = result[1]
+    async def close(self) -> None:
+        await self.http.close()
 
-        return result_dict
+    def forget(self, url: str) -> None:
+        super().forget(url)
+        self.cache.forget(url)
+        self.variant_groups.get(get_product_key(url), set()).discard(url)
+        self.variant_items.pop(url, None)
+        self.fresh_variants.discard(url)
+        self.consistent_variants.pop(url, None)
+
+    async def fetch_items(self, url_list: list) -> dict:
+        results = {}
+        groups: Dict[str, List[str]] = {}
 
-    async def get_product_info(self, url: str, session: aiohttp.ClientSession = None) -> Tuple[str, CoupangItem]:
-        # TODO: Rewrite this disaster
-        if not session:
-            async with aiohttp.ClientSession(headers=self.header, timeout=TIMEOUT) as session:
-                return await self.get_product_info(url, session)
+        for url in sorted(url_list):
+            key = get_product_key(url)
+            self.variant_groups.setdefault(key, set()).add(url)
+            groups.setdefault(key, []).append(url)
 
-        async with session.get(url) as r:
-            text = await r.text()
-            r.raise_for_status()
+        async def fetch_group(urls: List[str]):
+            remaining = [url for url in urls if not self._take_variant(url, results)]
 
-        soup = BeautifulSoup(text, 'html.parser')
+            if not remaining:
+                return
 
-        price_match = soup.select('span.total-price > strong')
-        item_match = soup.find_all('h2', class_='prod-buy-header__title')
+            # Every variant shares the product page, so the rest of the group is read from the page of the first one
+            results[remaining[0]] = await self.fetch_item(remaining[0])
+            fallback = [url for url in remaining[1:] if not self._take_variant(url, results)]
 
-        item_name = re.sub('<[^<>]*>', '', str(item_match[0]))
+            if fallback:
+                results.update(await self.fetch_results(fallback))
 
-        option_names = [re.sub('<[^<>]*>', '', str(option_name)) for option_name in
-                        soup.find_all('span', class_='title')]
-        option_values = [re.sub('<[^<>]*>', '', str(option_value)) for option_value in
-                         soup.find_all('span', class_='value')]
+        await asyncio.gather(*[fetch_group(urls) for urls in groups.values()])
 
-        option = {}
+        return results
 
-        for x in range(len(option_names)):
-            option[option_names[x]] = option_values[x]
+    def report(self) -> List[str]:
+        return [self.http.stats.report(), self.cache.report(), *super().report(),
+                f'{self.variant_hits} variants read from the page of another variant']
 
-        if not price_match:
-            current_price = 0
+    async def get_product_info(self, url: str) -> Tuple[str, CoupangItem]:
+        async def fetch():
+            return await self.http.fetch(url, headers=self.cache.headers(url))
 
+        if self.LOGIN:
+            r = await self.login_manager.fetch(fetch, self._is_logged_out, self.http.session)
         else:
-            if self.USE_WOW_PRICE:
-                try:
-                    price_output = [element for element in re.split('<[^<>]*>', str(price_match[1])) if
-                                    element.strip()]
-                    if price_output == ['원']:
-                        raise IndexError
+            r = await fetch()
 
-                except IndexError:
-                    price_output = [element for element in re.split('<[^<>]*>', str(price_match[0])) if
-                                    element.strip()]
+        r.raise_for_status()
+        item = self.cache.lookup(url, r)
 
-            else:
-                price_output = [element for element in re.split('<[^<>]*>', str(price_match[0])) if
-                                element.strip()]
-
-            current_price = int(re.sub('[^0-9]', '', price_output[0]))
-
-        current_price = f'{current_price:,}원'
-
-        card_benefits = {}
-        if soup.find('span', class_='benefit-label'):
-            rates = []
-
-            for element in soup.find_all('span', class_='benefit-label'):
-                rate = ''.join(filter(str.isdigit, str(element)))
-
-                rates.append(f'{rate}%')
-
-            card_sets = []
-
-            for benefit_badge in soup.find_all('div', class_='ccid-benefit-badge__inr'):
-                card_set = []
-                for element in benefit_badge.contents:
-                    if element.name == 'img':
-                        img_src = element['src']
-                        if 'hana-sk' in img_src:
-                            card_set.append('하나')
-                        elif 'kb' in img_src:
-                            card_set.append('국민')
-                        elif 'lotte' in img_src:
-                            card_set.append('롯데')
-                        elif 'shinhan' in img_src:
-                            card_set.append('신한')
-                        elif 'hyundai' in img_src:
-                            card_set.append('현대')
-                        elif 'woori' in img_src:
-                            card_set.append('우리')
-                        elif 'samsung' in img_src:
-                            card_set.append('삼성')
-                        elif 'bc' in img_src:
-                            card_set.append('BC')
-                        elif 'nh' in img_src:
-                            card_set.append('농협')
-                card_sets.append(card_set)
-
-            for i in range(len(rates)):
-                card_benefits[', '.join(card_sets[i])] = rates[i]
-
-        if soup.find('div', class_='aos-label'):
-            qty = re.sub(r'<[^<>]*>', '', str(soup.find('div', class_='aos-label')))
-        elif soup.find('div', class_='oos-label'):
-            qty = '품절'
-            current_price += ' (품절)'
-        else:
-            qty = '재고 있음'
+        if item is None:
+            fields = await PARSE_EXECUTOR.run(parse_product, r.body, r.encoding, self.USE_WOW_PRICE)
+            item = CoupangItem(**fields)
+            self.cache.store(url, r, item)
+
+        await self._update_variants(url, r, item)
 
-        if soup.find('span', class_='prod-pre-order-badge-text').string:
-            preorder = '사전예약 중'
-        else:
-            preorder = '사전예약 중 아님'
-
-        thumbnail = soup.find('img', class_='prod-image__detail')
-        thumbnail = f"https:{thumbnail['src']}"
-
-        item = CoupangItem(
-            name=item_name,
-            price=current_price,
-            option=option,
-            quantity=qty,
-            card_benefits=card_benefits,
-            preorder=preorder,
-            thumbnail=thumbnail
-        )
         return url, item
 
+    def _take_variant(self, url: str, results: dict) -> bool:
+        """Uses the variant read for url since its own last check, if any."""
+        if url not in self.fresh_variants or url not in self.variant_items:
+            return False
+
+        self.fresh_variants.discard(url)
+        self.variant_hits += 1
+        results[url] = FetchResult.success(self.variant_items[url])
+
+        # What only the rendered page shows can change later, so the own page is fetched again after a few reads
+        reads_left = self.consistent_variants.pop(url, 0) - 1
+
+        if reads_left > 0:
+            self.consistent_variants[url] = reads_left
+
+        return True
+
+    async def _update_variants(self, url: str, r: Response, item: CoupangItem) -> None:
+        """Reads the other tracked variants of the product from the page of url."""
+        self.fresh_variants.discard(url)
+        self.variant_items.pop(url, None)
+        siblings = self.variant_groups.get(get_product_key(url), set()) - {url}
+
+        if not siblings:
+            return
+
+        if r.status == 304:
+            # The page didn't change, so the variants read from it last time are still current.
+            # The page state lies outside the region hashed by the response cache, so a 200 is always read again
+            self.fresh_variants.update(sibling for sibling in siblings
+                                       if sibling in self.variant_items and sibling in self.consistent_variants)
+            return
+
+        vendor_item_ids = {str(furl(other).args.get('vendorItemId')): other for other in siblings | {url}}
+        variants = await PARSE_EXECUTOR.run(parse_variants, r.body, r.encoding, list(vendor_item_ids),
+                                            self.USE_WOW_PRICE)
+        items = {
+            vendor_item_ids[vendor_item_id]: CoupangItem(
+                card_benefits=item['card_benefits'], preorder=item['preorder'], **fields
+            )
+            for vendor_item_id, fields in variants.items()
+        }
+
+        # The page state lacks some of what the rendered page shows, e.g. the remaining quantity.
+        # Reading this variant from another page is only allowed while both give the same item
+        if items.get(url) == item:
+            self.consistent_variants[url] = self.VARIANT_READS_PER_CHECK
+        else:
+            self.consistent_variants.pop(url, None)
+
+        for sibling in siblings:
+            self.variant_items.pop(sibling, None)
+            self.fresh_variants.discard(sibling)
+
+            if sibling in items and sibling in self.consistent_variants:
+                self.variant_items[sibling] = items[sibling]
+                self.fresh_variants.add(sibling)
+
+    @staticmethod
+    def _is_logged_out(r: Response) -> bool:
+        # Product pages are public, so an expired session only shows as a product page whose header
+        # offers to log in instead of out. Error pages and 304 responses say nothing about the session
+        if r.status == 401 or 'login.coupang.com' in str(r.url):
+            return True
+
+        return r.status == 200 and PRODUCT_PAGE_MARKER in r.body and LOGGED_IN_MARKER not in r.body
+
     async def _login(self, session: aiohttp.ClientSession):
         post_data = {'email': self.EMAIL,
                      'password': self.PASSWORD,
@@ -257,20 +509,30 @@ class CoupangService(AbstractService):
                            headers=self.login_header,
                            data=post_data)
 
+        self.jar.save(self.login_manager.cookie_path)
+
 
 if __name__ == '__main__':
-    coupang = CoupangService({
-        'use_wow_price': True,
-        'login': False,
-        'email': '',
-        'password': '',
-    })
+    async def main():
+        coupang = CoupangService({
+            'use_wow_price': True,
+            'login': False,
+            'email': '',
+            'password': '',
+        })
+        await coupang.start()
+
+        print('Coupang module test')
+        test_url = input('Enter coupang URL: ')
+
+        try:
+            standardized_test_url = await coupang.standardize_url(test_url)
+            print('Standardized URL:', standardized_test_url)
+            _, test_item = await coupang.get_product_info(standardized_test_url)
+        finally:
+            await coupang.close()
 
-    print('Coupang module test')
-    test_url = input('Enter coupang URL: ')
-    standardized_test_url = asyncio.run(coupang.standardize_url(test_url))
-    print('Standardized URL:', standardized_test_url)
-    _, test_item = asyncio.run(coupang.get_product_info(standardized_test_url))
+        for key, value in test_item.items():
+            print(key, '-', value)
 
-    for key, value in test_item.items():
-        print(key, '-', value)
+    asyncio.run(main())
@@ -1,10 +1,12 @@
-import asyncio
-import aiohttp
 import ssl
-from typing import Union, Tuple
+from typing import Union, Tuple, Dict, Any, List
 from furl import furl
-from bs4 import BeautifulSoup
-from services.base import AbstractService, BaseServiceItem, USER_AGENT, TIMEOUT
+from services.base import AbstractService, BaseServiceItem, Field, USER_AGENT, TIMEOUT, parse_price, format_price
+from util.http import HttpClient
+from util.parser import Region
+from util.executor import PARSE_EXECUTOR
+from util.cache import ResponseCache
+from util.linkcache import LINK_CACHE
 
 context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
 context.options |= 0x4  # OP_LEGACY_SERVER_CONNECT
@@ -14,16 +16,75 @@ def pprint(*args, **kwargs):
     print('[danawa]', *args, **kwargs)
 
 
+# Product name and lowest prices are inside the summary box. The product image sits next to it
+SUMMARY_REGION = Region('summary_info', ids='baseImage')
+
+
+def parse_product(body: bytes, encoding: str) -> Dict[str, Any]:
+    """Parses a product page into DanawaItem fields."""
+    soup = SUMMARY_REGION.parse(body, encoding)
+
+    prod_name = str(soup.select_one('div.summary_info > div.top_summary > h3 > span').contents[0])
+    thumbnail = f"https:{soup.find('img', id='baseImage')['src']}"
+
+    txt_no = soup.select_one(
+        'div.summary_info > div.detail_summary > div.summary_left > div.lowest_area > div.no_data > p > strong'
+    )
+
+    status = ''
+    price = None
+    card_price = None
+    card_name = ''
+
+    if txt_no:
+        status = str(txt_no.string)
+    else:
+        price = soup.select_one(
+            'div.lowest_area > div.lowest_top > div.row.lowest_price > span.lwst_prc > a > em'
+        )
+        price = parse_price(price.string)
+        card_price_match = soup.select_one(
+            'div.lowest_area > div.lowest_list > table > tbody.card_list > tr > td.price > a > span.txt_prc > em'
+        )
+
+        if card_price_match:
+            card_price_card = soup.select_one(
+                'div.lowest_area > div.lowest_list > table > tbody.card_list > tr > td.price > a > span.txt_dsc'
+            )
+            card_name = str(card_price_card.contents[0])
+            card_price = parse_price(str(card_price_match.contents[0]))
+
+    return {
+        'name': prod_name,
+        'price': price,
+        'status': status,
+        'card_price': card_price,
+        'card_name': card_name,
+        'thumbnail': thumbnail
+    }
+
+
 class DanawaItem(BaseServiceItem):
-    def __init__(self, **kwargs):
-        danawa_dict = {
-            'name': {'label': '상품명', 'type': str, 'value': ''},
-            'price': {'label': '최저가', 'type': str, 'value': ''},
-            'card_price': {'label': '카드 최저가', 'type': str, 'value': ''},
-            'thumbnail': {'type': str, 'value': ''}
-        }
+    __slots__ = ()
+    FIELDS = (
+        Field('name', str, '', '상품명'),
+        Field('price', int, None, '최저가', format_price),
+        Field('status', str, '', '가격 정보'),
+        Field('card_price', int, None, '카드 최저가', format_price),
+        Field('card_name', str, ''),
+        Field('thumbnail', str, '')
+    )
+    BENEFIT_FIELDS = ('card_price',)
+    PRICE_STATUS_FIELDS = ('status',)
+    SHOWN_WITH = {'card_name': 'card_price'}
+
+    def display(self, key: str, separator: str = '\n') -> str:
+        value = super().display(key, separator)
+
+        if key == 'card_price' and value and self['card_name']:
+            value += f" ({self['card_name']})"
 
-        super().__init__(danawa_dict, **kwargs)
+        return value
 
 
 class DanawaService(AbstractService):
@@ -31,16 +92,23 @@ class DanawaService(AbstractService):
     SERVICE_NAME = 'danawa'
     SERVICE_LABEL = '다나와'
     SERVICE_COLOR = 0x5EC946
+    SERVICE_ITEM_CLASS = DanawaItem
     SERVICE_ICON = 'https://img.danawa.com/new/tour/img/logo/sns_danawa.jpg'
 
     def __init__(self):
+        self.http = HttpClient(ssl_context=context, timeout=TIMEOUT)
+        self.cache = ResponseCache((b'id="baseImage"', b'class="summary_info"'), b'class="prod_spec"')
         pprint('danawa service initialized.')
 
+    async def start(self) -> None:
+        await self.http.start()
+
+    async def close(self) -> None:
+        await self.http.close()
+
     async def standardize_url(self, url: str) -> Union[str, None]:
         if 'danawa.page.link' in url:  # Mobile App Share URL to Mobile Web URL
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, ssl=context) as r:
-                    url = str(r.url)
+            url = await LINK_CACHE.resolve(self.http.session, url, accept=lambda u: 'danawa.page.link' not in u)
 
         f = furl(url)
 
@@ -51,62 +119,25 @@ class DanawaService(AbstractService):
 
         return url
 
-    async def fetch_items(self, url_list: list) -> dict:
-        async with aiohttp.ClientSession(timeout=TIMEOUT) as session:
-            results = await asyncio.gather(*[self.get_product_info(url, session) for url in url_list])
-
-        result_dict = {}
-
-        for result in results:
-            result_dict[result[0]] = result[1]
-
-        return result_dict
-
-    async def get_product_info(self, url: str, session: aiohttp.ClientSession = None) -> Tuple[str, DanawaItem]:
-        if not session:
-            async with aiohttp.ClientSession(timeout=TIMEOUT) as session:
-                return await self.get_product_info(url, session)
+    def forget(self, url: str) -> None:
+        super().forget(url)
+        self.cache.forget(url)
 
-        async with session.get(url, ssl=context) as r:
-            text = await r.text()
-            r.raise_for_status()
-
-        soup = BeautifulSoup(text, 'html.parser')
+    async def fetch_items(self, url_list: list) -> dict:
+        return await self.fetch_results(url_list)
 
-        prod_name = str(soup.select_one('#blog_content > div.summary_info > div.top_summary > h3 > span').contents[0])
-        thumbnail = f"https:{soup.find('img', id='baseImage')['src']}"
+    def report(self) -> List[str]:
+        return [self.http.stats.report(), self.cache.report(), *super().report()]
 
-        txt_no = soup.select_one(
-            '#blog_content > div.summary_info > div.detail_summary > div.summary_left > div.lowest_area > div.no_data > p > strong'
-        )
+    async def get_product_info(self, url: str) -> Tuple[str, DanawaItem]:
+        r = await self.http.fetch(url, headers=self.cache.headers(url))
+        r.raise_for_status()
+        item = self.cache.lookup(url, r)
 
-        if txt_no:
-            price = txt_no.string
-            card_price = ''
-        else:
-            price = soup.select_one(
-                'div.lowest_area > div.lowest_top > div.row.lowest_price > span.lwst_prc > a > em'
-            )
-            price = f'{price.string}원'
-            card_price = soup.select_one(
-                'div.lowest_area > div.lowest_list > table > tbody.card_list > tr > td.price > a > span.txt_prc > em'
-            )
-
-            if card_price:
-                card_price_card = soup.select_one(
-                    'div.lowest_area > div.lowest_list > table > tbody.card_list > tr > td.price > a > span.txt_dsc'
-                )
-                card_price_card = card_price_card.contents[0]
-                card_price = f'{card_price.contents[0]}원 ({card_price_card})'
-            else:
-                card_price = ''
-
-        item = DanawaItem(
-            name=prod_name,
-            price=price,
-            card_price=card_price,
-            thumbnail=thumbnail
-        )
+        if item is None:
+            fields = await PARSE_EXECUTOR.run(parse_product, r.body, r.encoding)
+            item = DanawaItem(**fields)
+            self.cache.store(url, r, item)
 
         return url, item
 
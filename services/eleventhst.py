@@ -1,43 +1,78 @@
 import re
+import time
 import asyncio
-from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError, BrowserContext
-from typing import Union, Tuple
-from services.base import AbstractService, BaseServiceItem, USER_AGENT
+from playwright.async_api import BrowserContext
+from typing import Union, Tuple, List
+from services.base import AbstractService, BaseServiceItem, Field, USER_AGENT, parse_price, format_price
+from util.browser import BrowserManager, ServiceContext, RequestFilter, extract, goto
 from util.favicon import get_favicon
 
-# Debug settings
-HEADLESS = True
-DELAY = 0
-
 
 def pprint(*args, **kwargs):
     print('[11st]', *args, **kwargs)
 
 
-class EleventhStreetItem(BaseServiceItem):
-    def __init__(self, **kwargs):
-        naver_dict = {
-            'name': {'label': '상품명', 'type': str, 'value': ''},
-            'price': {'label': '가격', 'type': str, 'value': ''},
-            'coupon': {'label': '쿠폰', 'type': str, 'value': ''},
-            'delivery': {'label': '배송비', 'type': str, 'value': ''},
-            'agency_fee': {'label': '예상 통관대행료', 'type': str, 'value': ''},
-            'thumbnail': {'type': str, 'value': ''}
-        }
+# Returns null until name, price, delivery and thumbnail are rendered
+EXTRACT_SCRIPT = """() => {
+    const text = (selector) => {
+        const element = document.querySelector(selector);
+        return element === null ? null : element.textContent.trim();
+    };
+
+    const name = text('h1.title');
+    const price = text('dl.price > dd > strong');
+    const delivery = text('div.delivery') ?? text('div.delivery_abroad');
+    const thumbnail = document.querySelector('#productImg > div > img')
+        ?? document.querySelector('div.l_product_side_view > div.c_product_view_img > div.img_full.img_full_height > img');
+
+    if (!name || !price || delivery === null || thumbnail === null) {
+        return null;
+    }
 
-        super().__init__(naver_dict, **kwargs)
+    return {
+        name: name,
+        price: price,
+        coupon: document.querySelector('dl > div.coupon') !== null,
+        agency_fee: text('div.c_product_agency_fee > div > dl > dd'),
+        delivery: delivery,
+        thumbnail: thumbnail.getAttribute('src')
+    };
+}"""
+
+
+class EleventhStreetItem(BaseServiceItem):
+    __slots__ = ()
+    FIELDS = (
+        Field('name', str, '', '상품명'),
+        Field('price', int, None, '가격', format_price),
+        Field('coupon', str, '', '쿠폰'),
+        Field('delivery', str, '', '배송비'),
+        Field('agency_fee', str, '', '예상 통관대행료'),
+        Field('thumbnail', str, '')
+    )
 
 
 class EleventhStreetService(AbstractService):
-    SERVICE_DEFAULT_CONFIG = None
+    SERVICE_DEFAULT_CONFIG = {
+        'max_pages': 4,
+        'blocked_resource_types': ['image', 'media', 'font'],
+        'blocked_url_patterns': [
+            'googletagmanager.com', 'google-analytics.com', 'doubleclick.net',
+            'facebook.net', 'criteo.com', 'criteo.net'
+        ]
+    }
     SERVICE_NAME = '11st'
     SERVICE_LABEL = '11번가'
     SERVICE_COLOR = 0xea3a40
+    SERVICE_ITEM_CLASS = EleventhStreetItem
     SERVICE_ICON = get_favicon('https://www.11st.co.kr/')
     SERVICE_USES_PLAYWRIGHT = True
 
-    def __init__(self, chromium_path=None):
-        self.chromium_path = chromium_path
+    def __init__(self, cfg, browser_manager: BrowserManager):
+        self.request_filter = RequestFilter(cfg['blocked_resource_types'], cfg['blocked_url_patterns'])
+        self.context = ServiceContext(browser_manager, timeout=20000, max_pages=cfg['max_pages'],
+                                      request_filter=self.request_filter, setup=self._warm_up,
+                                      user_agent=USER_AGENT)
         pprint('11st service initialized.')
 
     async def standardize_url(self, url) -> Union[str, None]:
@@ -59,113 +94,76 @@ class EleventhStreetService(AbstractService):
 
         return None
 
-    async def fetch_items(self, url_list: list) -> dict:
-        if url_list:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(executable_path=self.chromium_path, headless=HEADLESS, slow_mo=DELAY)
-                context = await browser.new_context(
-                    user_agent=USER_AGENT)
-                context.set_default_timeout(20000)
-
-                results = await asyncio.gather(*[self.get_product_info(url, context) for url in url_list])
+    @staticmethod
+    async def _warm_up(context: BrowserContext) -> None:
+        # Product pages expect the cookies set by the homepage. Visiting it once per context is enough.
+        page = await context.new_page()
 
-                await context.close()
-                await browser.close()
-
-            result_dict = {}
+        try:
+            await page.goto('https://www.11st.co.kr/', wait_until='domcontentloaded')
+        finally:
+            await page.close()
 
-            for result in results:
-                result_dict[result[0]] = result[1]
+    async def fetch_items(self, url_list: list) -> dict:
+        if url_list:
+            start = time.perf_counter()
+            results = await self.fetch_results(url_list)
+            pprint(f'Fetched {len(url_list)} items in {time.perf_counter() - start:.2f}s')
 
-            return result_dict
+            return results
         else:
             return {}
 
-    async def get_product_info(self, url: str, context: BrowserContext = None) -> Tuple[str, EleventhStreetItem]:
-        if context is None:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(executable_path=self.chromium_path, headless=HEADLESS, slow_mo=DELAY)
-                context = await browser.new_context(
-                    user_agent=USER_AGENT)
-                context.set_default_timeout(20000)
-
-                url, item = await self.get_product_info(url, context)
-                await context.close()
-                await browser.close()
-
-            return url, item
+    def report(self) -> List[str]:
+        return [self.request_filter.report(), *super().report()]
 
-        product_page = await context.new_page()
-        await product_page.goto('https://www.11st.co.kr/', timeout=20000)
-        await product_page.goto(url, timeout=20000)
-        await product_page.wait_for_load_state()
+    async def get_product_info(self, url: str) -> Tuple[str, EleventhStreetItem]:
+        async with self.context.page() as product_page:
+            await goto(product_page, url, wait_until='domcontentloaded')
+            result = await extract(product_page, EXTRACT_SCRIPT)
 
-        item_name = await product_page.wait_for_selector('h1.title')
-        item_name = await item_name.text_content()
-        item_name = item_name.strip()
+        agency_fee = result['agency_fee']
 
-        price = await product_page.wait_for_selector('dl.price > dd > strong')
-        price = await price.text_content()
-        price = price.strip()
-
-        try:
-            await product_page.wait_for_selector('dl > div.coupon', timeout=500)
-            coupon = '있음'
-        except PlaywrightTimeoutError:
-            coupon = '없음'
-
-        try:
-            agency_fee = await product_page.wait_for_selector('div.c_product_agency_fee > div > dl > dd', timeout=500)
-            agency_fee = await agency_fee.text_content()
-
-            if '없음' in agency_fee:
-                agency_fee = '없음'
-            else:
-                agency_fee = agency_fee.split(' ')[0]
-                agency_fee = agency_fee.strip()
-        except PlaywrightTimeoutError:
+        if agency_fee is None:
             agency_fee = '해외직구 상품 아님'
+        elif '없음' in agency_fee:
+            agency_fee = '없음'
+        else:
+            agency_fee = agency_fee.split(' ')[0]
+            agency_fee = agency_fee.strip()
 
-        try:
-            delivery = await product_page.wait_for_selector('div.delivery', timeout=500)
-        except PlaywrightTimeoutError:
-            delivery = await product_page.wait_for_selector('div.delivery_abroad', timeout=500)
-
-        delivery = await delivery.text_content()
-
-        if '무료배송' in delivery:
+        if '무료배송' in result['delivery']:
             delivery = '무료배송'
         else:
             delivery = '유료배송'
 
-        try:
-            thumbnail = await product_page.wait_for_selector('#productImg > div > img', timeout=500)
-        except PlaywrightTimeoutError:
-            thumbnail = await product_page.wait_for_selector(
-                'div.l_product_side_view > div.c_product_view_img > div.img_full.img_full_height > img'
-            )
-
-        thumbnail = await thumbnail.get_attribute('src')
-
         item = EleventhStreetItem(
-            name=item_name,
-            price=price,
-            coupon=coupon,
+            name=result['name'],
+            price=parse_price(result['price']),
+            coupon='있음' if result['coupon'] else '없음',
             delivery=delivery,
             agency_fee=agency_fee,
-            thumbnail=thumbnail
+            thumbnail=result['thumbnail']
         )
 
         return url, item
 
 
 if __name__ == '__main__':
-    eleventhst = EleventhStreetService()
-    print('11st module test')
-    test_url = input('Enter 11st item URL: ')
-    standardized_test_url = asyncio.run(eleventhst.standardize_url(test_url))
-    print('Standardized URL:', standardized_test_url)
-    _, test_item = asyncio.run(eleventhst.get_product_info(standardized_test_url))
-
-    for key, value in test_item.items():
-        print(key, '-', value)
+    async def main():
+        manager = BrowserManager()
+        eleventhst = EleventhStreetService(EleventhStreetService.SERVICE_DEFAULT_CONFIG, manager)
+        print('11st module test')
+        test_url = input('Enter 11st item URL: ')
+        standardized_test_url = await eleventhst.standardize_url(test_url)
+        print('Standardized URL:', standardized_test_url)
+
+        try:
+            _, test_item = await eleventhst.get_product_info(standardized_test_url)
+        finally:
+            await manager.close()
+
+        for key, value in test_item.items():
+            print(key, '-', value)
+
+    asyncio.run(main())
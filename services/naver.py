@@ -1,61 +1,200 @@
+import os
 import re
+import json
+import time
 import asyncio
-import aiohttp
-from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError, BrowserContext
-from typing import Union, Tuple
-from services.base import AbstractService, BaseServiceItem, USER_AGENT
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError, BrowserContext
+from typing import Union, Tuple, Dict, Any, List
+from services.base import AbstractService, BaseServiceItem, Field, USER_AGENT, TIMEOUT, parse_price, format_price
+from util.auth import LoginManager
+from util.browser import BrowserManager, ServiceContext, RequestFilter, extract, goto
+from util.http import HttpClient
+from util.executor import PARSE_EXECUTOR
+from util.linkcache import LINK_CACHE
 from util.favicon import get_favicon
 
-# Debug settings
-HEADLESS = True
-DELAY = 0
-
 
 def pprint(*args, **kwargs):
     print('[naver]', *args, **kwargs)
 
 
-class NaverItem(BaseServiceItem):
-    def __init__(self, **kwargs):
-        naver_dict = {
-            'name': {'label': '상품명', 'type': str, 'value': ''},
-            'price': {'label': '가격', 'type': str, 'value': ''},
-            'benefit_price': {'label': '혜택가', 'type': str, 'value': ''},
-            'max_point': {'label': '최대 적립 포인트', 'type': str, 'value': ''},
-            'thumbnail': {'type': str, 'value': ''}
+PRELOADED_STATE_PATTERN = re.compile(r'window\.__PRELOADED_STATE__\s*=\s*(\{.*?\})\s*</script>', re.DOTALL)
+
+
+def normalize_thumbnail(url: str) -> str:
+    """Drops the resize query the page appends to image URLs, so that every source gives the same URL."""
+    return url.split('?', 1)[0]
+
+
+def read_points(product: Dict[str, Any]) -> Union[Dict[str, Any], None]:
+    """Reads max point and thumbnail from the product of the page state. Returns None if either is missing.
+
+    Used by both the HTTP and the browser path, so that an item gets the same values whichever path reads it."""
+    thumbnail = (product.get('representImage') or {}).get('url')
+    benefits = product.get('benefitsView')
+
+    if not thumbnail or benefits is None:
+        return None
+
+    # Purchase and review points, which is what the page shows as maximum points to logged out users
+    max_point = sum(value for key, value in benefits.items()
+                    if key.endswith('Point') and isinstance(value, int))
+
+    return {
+        'max_point': max_point,
+        'thumbnail': normalize_thumbnail(thumbnail)
+    }
+
+
+def parse_preloaded_state(html: str) -> Union[Dict[str, Any], None]:
+    """Reads name, price, max point and thumbnail from the state blob server-rendered into product pages.
+    Returns None if the blob or any of the fields is missing."""
+    match = PRELOADED_STATE_PATTERN.search(html)
+
+    if match is None:
+        return None
+
+    try:
+        state = json.loads(match.group(1))
+    except json.JSONDecodeError:
+        return None
+
+    for key in ('product', 'simpleProductForDetailPage'):
+        product = (state.get(key) or {}).get('A')
+        if product:
+            break
+    else:
+        return None
+
+    name = product.get('name')
+    price = product.get('discountedSalePrice', product.get('salePrice'))
+    points = read_points(product)
+
+    if not name or price is None or points is None:
+        return None
+
+    return {
+        'name': name,
+        'price': price,
+        **points
+    }
+
+
+# Returns null until name, price, max point and thumbnail are rendered.
+# Benefit price renders after them and only for logged in users, so it is waited for at most benefitGrace ms
+# after the other fields are ready, and allowed to be missing after that.
+# The product of the page state is returned too, so that read_points() can read it like the HTTP path does.
+EXTRACT_SCRIPT = """({benefitGrace}) => {
+    const text = (selector) => {
+        const element = document.querySelector(selector);
+        return element === null ? null : element.textContent;
+    };
+
+    const state = window.__PRELOADED_STATE__ || {};
+    const product = ['product', 'simpleProductForDetailPage']
+        .map((key) => (state[key] || {}).A)
+        .find((product) => product) || null;
+
+    const name = text('#content > div > div._2-I30XS1lA > div._2QCa6wHHPy > fieldset > '
+        + 'div._3k440DUKzy > div._1eddO7u4UC > h3');
+    const price = text('#content > div > div._2-I30XS1lA > div._2QCa6wHHPy > fieldset > '
+        + 'div._3k440DUKzy > div.WrkQhIlUY0 > div > strong > span._1LY7DqCnwR');
+    const max_point = text('#content > div > div._2-I30XS1lA > div._2QCa6wHHPy > fieldset > '
+        + 'div._2a18RJADk5 > div._3gd5biYh9U > div > div > span');
+    const thumbnail = document.querySelector('#content > div > div._2-I30XS1lA > div.-g-2PI3RtF > '
+        + 'div._367LI5Az0t > div._2tT_gkmAOr._3CdGr9Fejo > img');
+
+    if (name === null || price === null || max_point === null || thumbnail === null) {
+        return null;
+    }
+
+    const benefit_price = text('#content > div > div._2-I30XS1lA > div._2QCa6wHHPy > fieldset > '
+        + 'div._2a18RJADk5 > div._1UNQIwX1sN > div > strong._-2CCeRkfCX > span');
+
+    if (benefit_price === null && benefitGrace > 0) {
+        // Kept on the window, so it is reset when the page navigates
+        window.__benefitWaitStart = window.__benefitWaitStart || performance.now();
+
+        if (performance.now() - window.__benefitWaitStart < benefitGrace) {
+            return null;
+        }
+    }
+
+    return {
+        name: name,
+        price: price,
+        max_point: max_point,
+        benefit_price: benefit_price,
+        thumbnail: thumbnail.getAttribute('src'),
+        product: product === null ? null : {
+            representImage: product.representImage || null,
+            benefitsView: product.benefitsView || null
         }
+    };
+}"""
 
-        super().__init__(naver_dict, **kwargs)
+
+# Same as the timeout the benefit price was waited for with before all fields were read in one script
+BENEFIT_GRACE = 1000
+
+
+class NaverItem(BaseServiceItem):
+    __slots__ = ()
+    FIELDS = (
+        Field('name', str, '', '상품명'),
+        Field('price', int, None, '가격', format_price),
+        Field('benefit_price', int, None, '혜택가', format_price),
+        Field('max_point', int, None, '최대 적립 포인트', format_price),
+        Field('thumbnail', str, '')
+    )
+    BENEFIT_FIELDS = ('benefit_price',)
 
 
 class NaverService(AbstractService):
     SERVICE_DEFAULT_CONFIG = {
         'login': False,
         'id': '',
-        'password': ''
+        'password': '',
+        'max_pages': 4,
+        'blocked_resource_types': ['image', 'media', 'font'],
+        'blocked_url_patterns': [
+            'wcs.naver.net', 'lcs.naver.com', 'nlog.naver.com', 'siape.veta.naver.com',
+            'googletagmanager.com', 'google-analytics.com', 'doubleclick.net'
+        ]
     }
     SERVICE_NAME = 'naver'
     SERVICE_LABEL = '네이버'
     SERVICE_COLOR = 0x5ECC69
+    SERVICE_ITEM_CLASS = NaverItem
     SERVICE_ICON = get_favicon('https://www.naver.com/')
     SERVICE_USES_PLAYWRIGHT = True
 
-    def __init__(self, cfg, chromium_path=None):
+    def __init__(self, cfg, browser_manager: BrowserManager):
         self.LOGIN = cfg['login']
         self.NAVER_ID = cfg['id']
         self.NAVER_PW = cfg['password']
-        self.chromium_path = chromium_path
+        self.headers = {'User-Agent': USER_AGENT}
+        self.http = HttpClient(headers=self.headers, timeout=TIMEOUT)
+        self.login_manager = LoginManager(self.SERVICE_NAME, self._login)
+        self.request_filter = RequestFilter(cfg['blocked_resource_types'], cfg['blocked_url_patterns'])
+        self.context = ServiceContext(browser_manager, timeout=10000, max_pages=cfg['max_pages'],
+                                      request_filter=self.request_filter, setup=self._setup_context,
+                                      user_agent=USER_AGENT)
 
         if not self.LOGIN:
             pprint("Warning: login is disabled. "
                    "Maximum points will be inaccurate and benefit price won't be available")
         pprint('naver service initialized.')
 
+    async def start(self) -> None:
+        await self.http.start()
+
+    async def close(self) -> None:
+        await self.http.close()
+
     async def standardize_url(self, url) -> Union[str, None]:
         if 'naver.me' in url:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as r:
-                    url = str(r.url)
+            url = await LINK_CACHE.resolve(self.http.session, url, accept=lambda u: '/products/' in u)
 
         url = url.replace('m.', '')
 
@@ -68,6 +207,22 @@ class NaverService(AbstractService):
 
         return url
 
+    async def _setup_context(self, context: BrowserContext) -> None:
+        if self.LOGIN:
+            if os.path.isfile(self.login_manager.state_path):
+                pprint('Loading saved session...')
+                with open(self.login_manager.state_path, 'r') as f:
+                    await context.add_cookies(json.load(f)['cookies'])
+
+            if await self._is_logged_in(context):
+                self.login_manager.mark_valid()
+            else:
+                await self.login_manager.login(self.login_manager.generation, context)
+
+    @staticmethod
+    async def _is_logged_in(context: BrowserContext) -> bool:
+        return any(cookie['name'] == 'NID_AUT' for cookie in await context.cookies('https://www.naver.com/'))
+
     async def _login(self, context: BrowserContext) -> None:
         main_page = await context.new_page()
         await main_page.goto('https://www.naver.com/')
@@ -93,108 +248,112 @@ class NaverService(AbstractService):
                 pass
 
         await main_page.wait_for_load_state('networkidle')
+        await main_page.close()
+
+        await context.storage_state(path=self.login_manager.state_path)
 
     async def fetch_items(self, url_list: list) -> dict:
         if url_list:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(executable_path=self.chromium_path, headless=HEADLESS, slow_mo=DELAY)
-                context = await browser.new_context(
-                    user_agent=USER_AGENT)
-                context.set_default_timeout(10000)
+            start = time.perf_counter()
+            results = await self.fetch_results(url_list)
+            pprint(f'Fetched {len(url_list)} items in {time.perf_counter() - start:.2f}s')
 
-                if self.LOGIN:
-                    await self._login(context)
+            return results
+        else:
+            return {}
 
-                results = await asyncio.gather(*[self.get_product_info(url, context) for url in url_list])
+    def report(self) -> List[str]:
+        return [self.request_filter.report(), self.http.stats.report(), *super().report()]
 
-                await context.close()
-                await browser.close()
+    async def get_product_info(self, url: str) -> Tuple[str, NaverItem]:
+        # Benefit price is only rendered for logged in browser sessions
+        if not self.LOGIN:
+            item = await self._get_product_info_from_state(url)
 
-            result_dict = {}
+            if item is not None:
+                return url, item
 
-            for result in results:
-                result_dict[result[0]] = result[1]
+            pprint('Embedded state not found. Falling back to browser:', url)
 
-            return result_dict
-        else:
-            return {}
+        return await self._get_product_info_from_browser(url)
 
-    async def get_product_info(self, url: str, context: BrowserContext = None) -> Tuple[str, NaverItem]:
-        if context is None:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(executable_path=self.chromium_path, headless=HEADLESS, slow_mo=DELAY)
-                context = await browser.new_context(
-                    user_agent=USER_AGENT)
-                context.set_default_timeout(10000)
+    async def _get_product_info_from_state(self, url: str) -> Union[NaverItem, None]:
+        """Returns None only if the page has no usable state. HTTP errors are raised, since the browser would get them too."""
+        r = await self.http.fetch(url)
+        r.raise_for_status()
+        result = await PARSE_EXECUTOR.run(parse_preloaded_state, r.text())
 
-                if self.LOGIN:
-                    await self._login(context)
+        if result is None:
+            return None
 
-                url, item = await self.get_product_info(url, context)
-                await context.close()
-                await browser.close()
+        return NaverItem(**result)
 
-            return url, item
+    async def _get_product_info_from_browser(self, url: str) -> Tuple[str, NaverItem]:
+        for attempt in range(2):
+            generation = self.login_manager.generation
 
-        product_page = await context.new_page()
-        await product_page.goto(url)
+            async with self.context.page() as product_page:
+                await goto(product_page, url, wait_until='domcontentloaded')
+                result = await extract(product_page, EXTRACT_SCRIPT,
+                                       {'benefitGrace': BENEFIT_GRACE if self.LOGIN else 0})
 
-        item_name = await product_page.wait_for_selector(
-            '#content > div > div._2-I30XS1lA > div._2QCa6wHHPy > fieldset > '
-            'div._3k440DUKzy > div._1eddO7u4UC > h3')
-        item_name = await item_name.text_content()
+            # Missing benefit price is the only visible sign of a logged out session, so check the cookie then
+            if self.LOGIN and not attempt and result['benefit_price'] is None:
+                context = await self.context.get()
 
-        current_price = await product_page.wait_for_selector(
-            '#content > div > div._2-I30XS1lA > div._2QCa6wHHPy > fieldset > '
-            'div._3k440DUKzy > div.WrkQhIlUY0 > div > strong > span._1LY7DqCnwR'
-        )
-        current_price = await current_price.text_content() + '원'
+                if not await self._is_logged_in(context):
+                    pprint('Session has expired. Logging in again...')
+                    await self.login_manager.login(generation, context)
+                    continue
 
-        max_point = await product_page.wait_for_selector(
-            '#content > div > div._2-I30XS1lA > div._2QCa6wHHPy > fieldset > '
-            'div._2a18RJADk5 > div._3gd5biYh9U > div > div > span',
-        )
-        max_point = await max_point.text_content() + '원'
+            break
 
-        thumbnail = await product_page.wait_for_selector(
-            '#content > div > div._2-I30XS1lA > div.-g-2PI3RtF > div._367LI5Az0t > div._2tT_gkmAOr._3CdGr9Fejo > img'
-        )
-        thumbnail = await thumbnail.get_attribute('src')
+        points = {
+            'max_point': parse_price(result['max_point']),
+            'thumbnail': normalize_thumbnail(result['thumbnail'])
+        }
+
+        benefit_price = None
 
         if self.LOGIN:
-            try:
-                benefit_price = await product_page.wait_for_selector(
-                    '#content > div > div._2-I30XS1lA > div._2QCa6wHHPy > fieldset > '
-                    'div._2a18RJADk5 > div._1UNQIwX1sN > div > strong._-2CCeRkfCX > span',
-                    timeout=1000)
-                benefit_price = await benefit_price.text_content() + '원'
-            except PlaywrightTimeoutError:
-                benefit_price = ''
-        else:
-            benefit_price = ''
+            # Logged in, the page shows the points of the user, which the state doesn't have
+            benefit_price = parse_price(result['benefit_price'])
+        elif result['product'] is not None:
+            # Logged out, this is a fallback of the HTTP path, so read the same source it does
+            points = read_points(result['product']) or points
 
         item = NaverItem(
-            name=item_name,
-            price=current_price,
+            name=result['name'],
+            price=parse_price(result['price']),
             benefit_price=benefit_price,
-            max_point=max_point,
-            thumbnail=thumbnail
+            **points
         )
 
         return url, item
 
 
 if __name__ == '__main__':
-    naver = NaverService({
-        'login': True,
-        'id': input('Enter naver ID: '),
-        'password': input('Enter naver PW: ')
-    })
-    print('Naver module test')
-    test_url = input('Enter naver shopping URL: ')
-    standardized_test_url = asyncio.run(naver.standardize_url(test_url))
-    print('Standardized URL:', standardized_test_url)
-    _, test_item = asyncio.run(naver.get_product_info(standardized_test_url))
-
-    for key, value in test_item.items():
-        print(key, '-', value)
+    async def main():
+        manager = BrowserManager()
+        naver = NaverService({
+            **NaverService.SERVICE_DEFAULT_CONFIG,
+            'login': True,
+            'id': input('Enter naver ID: '),
+            'password': input('Enter naver PW: ')
+        }, manager)
+        await naver.start()
+        print('Naver module test')
+        test_url = input('Enter naver shopping URL: ')
+        standardized_test_url = await naver.standardize_url(test_url)
+        print('Standardized URL:', standardized_test_url)
+
+        try:
+            _, test_item = await naver.get_product_info(standardized_test_url)
+        finally:
+            await naver.close()
+            await manager.close()
+
+        for key, value in test_item.items():
+            print(key, '-', value)
+
+    asyncio.run(main())
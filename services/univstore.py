@@ -1,28 +1,60 @@
-import asyncio
-import os
 import re
 import aiohttp
 
-from typing import Union, Tuple
-from bs4 import BeautifulSoup
+from typing import Union, Tuple, Dict, Any, List
 
-from services.base import AbstractService, BaseServiceItem, USER_AGENT, TIMEOUT
+from services.base import AbstractService, BaseServiceItem, Field, USER_AGENT, TIMEOUT, parse_price, format_price
+from util.auth import LoginManager
+from util.http import HttpClient, Response
+from util.parser import Region
+from util.executor import PARSE_EXECUTOR
+from util.cache import ResponseCache
 
 
 def pprint(*args, **kwargs):
     print('[univstore]', *args, **kwargs)
 
 
-class UnivStoreItem(BaseServiceItem):
-    def __init__(self, **kwargs):
-        univstore_dict = {
-            'name': {'label': '상품명', 'type': str, 'value': ''},
-            'price': {'label': '가격', 'type': str, 'value': ''},
-            'stock': {'label': '재고', 'type': str, 'value': ''},
-            'thumbnail': {'type': str, 'value': ''}
-        }
+# Item card with the name, price and stock, and the photo slides wherever the layout puts them
+ITEM_REGION = Region(['usItemAreaTop', 'swiper-lazy'])
+ITEM_CARD_INFO = 'div.usItemAreaTop > div > div.usItemCardController > div.usItemCardInfo'
+
+
+def parse_product(body: bytes, encoding: str, logged_in: bool) -> Dict[str, Any]:
+    """Parses a product page into UnivStoreItem fields."""
+    soup = ITEM_REGION.parse(body, encoding)
 
-        super().__init__(univstore_dict, **kwargs)
+    thumbnail = soup.find('div', class_='swiper-slide swiper-lazy')['data-background']
+    item_name = soup.select_one(f'{ITEM_CARD_INFO} > div.usItemCardInfoName > a > span').string
+
+    if logged_in:
+        item_price = parse_price(soup.select_one(f'{ITEM_CARD_INFO} > div.usItemCardInfoPrice2').string)
+        in_stock = not soup.select_one(f'{ITEM_CARD_INFO} > div.usOutofstockMessage')
+        stock = '재고 있음' if in_stock else '품절'
+    else:
+        item_price = None
+        in_stock = None
+        stock = '로그인 필요'
+
+    return {
+        'name': str(item_name),
+        'price': item_price,
+        'stock': stock,
+        'in_stock': in_stock,
+        'thumbnail': str(thumbnail)
+    }
+
+
+class UnivStoreItem(BaseServiceItem):
+    __slots__ = ()
+    FIELDS = (
+        Field('name', str, '', '상품명'),
+        Field('price', int, None, '가격', format_price),
+        Field('stock', str, '', '재고'),
+        Field('in_stock', bool, None),
+        Field('thumbnail', str, '')
+    )
+    PRICE_STATUS_FIELDS = ('stock',)
 
 
 class UnivStoreService(AbstractService):
@@ -34,6 +66,7 @@ class UnivStoreService(AbstractService):
     SERVICE_NAME = 'univstore'
     SERVICE_LABEL = '학생복지스토어'
     SERVICE_COLOR = 0xea5b5d
+    SERVICE_ITEM_CLASS = UnivStoreItem
     SERVICE_ICON = 'https://univstore.com/image/favicon.png'
 
     def __init__(self, cfg):
@@ -41,19 +74,28 @@ class UnivStoreService(AbstractService):
         self.LOGIN = cfg['login']
         self.UNIVSTORE_ID = cfg['id']
         self.UNIVSTORE_PASSWORD = cfg['password']
+        self.login_manager = LoginManager(self.SERVICE_NAME, self._login)
+
+        self.jar: Union[aiohttp.CookieJar, None] = None
 
         if not self.LOGIN:
             pprint("Warning: login is disabled. "
                    "Price data is not available.")
-            self.jar = None
-        else:
-            self.jar = aiohttp.CookieJar()
-            if os.path.isfile('cookies/univstore'):
-                pprint('Loading saved cookie...')
-                self.jar.load('cookies/univstore')
 
+        self.http = HttpClient(headers=self.headers, timeout=TIMEOUT)
+        self.cache = ResponseCache((b'swiper-lazy', b'class="usItemAreaTop"'), b'class="usItemAreaBottom"')
         pprint('univstore service initialized.')
 
+    async def start(self) -> None:
+        if self.LOGIN:
+            self.jar = self.login_manager.cookie_jar()
+            self.http.cookie_jar = self.jar
+
+        await self.http.start()
+
+    async def close(self) -> None:
+        await self.http.close()
+
     async def standardize_url(self, url: str) -> Union[str, None]:
         if re.match('https://univstore.com/item/[0-9]+', url):
             return url
@@ -72,56 +114,42 @@ class UnivStoreService(AbstractService):
                 data = {'userid': self.UNIVSTORE_ID, 'password': self.UNIVSTORE_PASSWORD, 'autologin': '1'}
                 await session.post('https://univstore.com/api/user/login', data=data)
 
-        self.jar.save('cookies/univstore')
-
-    async def fetch_items(self, url_list: list) -> dict:
-        async with aiohttp.ClientSession(headers=self.headers, cookie_jar=self.jar, timeout=TIMEOUT) as session:
-            if self.LOGIN:
-                await self._login(session)
-            results = await asyncio.gather(*[self.get_product_info(url, session) for url in url_list])
-
-        result_dict = {}
+        self.jar.save(self.login_manager.cookie_path)
 
-        for result in results:
-            result_dict[result[0]] = result[1]
+    @staticmethod
+    def _is_logged_out(r: Response) -> bool:
+        if r.status == 401 or 'login' in str(r.url):
+            return True
 
-        return result_dict
+        # Price is only shown to logged in users, so a product page without it means the session expired.
+        # Error pages, removed items and 304 responses say nothing about the session
+        return r.status == 200 and b'class="usItemAreaTop"' in r.body and b'usItemCardInfoPrice2' not in r.body
 
-    async def get_product_info(self, url: str, session: aiohttp.ClientSession = None) -> Tuple[str, UnivStoreItem]:
-        if not session:
-            async with aiohttp.ClientSession(headers=self.headers, cookie_jar=self.jar, timeout=TIMEOUT) as session:
-                if self.LOGIN:
-                    await self._login(session)
-                return await self.get_product_info(url, session)
+    def forget(self, url: str) -> None:
+        super().forget(url)
+        self.cache.forget(url)
 
-        async with session.get(url) as r:
-            text = await r.text()
-            r.raise_for_status()
+    async def fetch_items(self, url_list: list) -> dict:
+        return await self.fetch_results(url_list)
 
-        soup = BeautifulSoup(text, 'html.parser')
+    def report(self) -> List[str]:
+        return [self.http.stats.report(), self.cache.report(), *super().report()]
 
-        thumbnail = soup.find('div', class_='swiper-slide swiper-lazy')['data-background']
-        item_name = soup.select_one(
-            'body > main > div.usItemAreaTop > div > div.usItemCardController > div.usItemCardInfo > div.usItemCardInfoName > a > span').string
+    async def get_product_info(self, url: str) -> Tuple[str, UnivStoreItem]:
+        async def fetch():
+            return await self.http.fetch(url, headers=self.cache.headers(url))
 
         if self.LOGIN:
-            item_price = soup.select_one(
-                'body > main > div.usItemAreaTop > div > div.usItemCardController > div.usItemCardInfo > div.usItemCardInfoPrice2').string
-
-            if soup.select_one(
-                    'body > main > div.usItemAreaTop > div > div.usItemCardController > div.usItemCardInfo > div.usOutofstockMessage'):
-                stock = '품절'
-            else:
-                stock = '재고 있음'
+            r = await self.login_manager.fetch(fetch, self._is_logged_out, self.http.session)
         else:
-            item_price = '로그인 필요'
-            stock = '로그인 필요'
-
-        item = UnivStoreItem(
-            name=str(item_name),
-            price=str(item_price) + '원',
-            stock=stock,
-            thumbnail=str(thumbnail)
-        )
+            r = await fetch()
+
+        r.raise_for_status()
+        item = self.cache.lookup(url, r)
+
+        if item is None:
+            fields = await PARSE_EXECUTOR.run(parse_product, r.body, r.encoding, self.LOGIN)
+            item = UnivStoreItem(**fields)
+            self.cache.store(url, r, item)
 
         return url, item
@@ -0,0 +1,70 @@
+import asyncio
+from types import SimpleNamespace
+from services.coupang import CoupangService
+from services.univstore import UnivStoreService
+from util.auth import LoginManager
+
+
+def response(status: int = 200, body: bytes = b'', url: str = 'https://example.com/item/1') -> SimpleNamespace:
+    return SimpleNamespace(status=status, body=body, url=url)
+
+
+def test_fetch_logs_in_again_once_after_logout():
+    logins = []
+    responses = [response(body=b'logged out'), response(body=b'logged in')]
+
+    async def login(*args):
+        logins.append(args)
+
+    async def fetch():
+        return responses.pop(0)
+
+    async def run():
+        manager = LoginManager('test', login)
+        manager.mark_valid()
+        return await manager.fetch(fetch, lambda r: r.body == b'logged out', 'session')
+
+    assert asyncio.run(run()).body == b'logged in'
+    assert logins == [('session',)]
+
+
+def test_fetch_does_not_log_in_while_valid():
+    logins = []
+
+    async def login(*args):
+        logins.append(args)
+
+    async def fetch():
+        return response()
+
+    async def run():
+        manager = LoginManager('test', login)
+        manager.mark_valid()
+        await manager.fetch(fetch, lambda r: False)
+
+    asyncio.run(run())
+    assert logins == []
+
+
+def test_univstore_logout_detection():
+    product = b'<div class="usItemAreaTop"><div class="usItemCardInfoPrice2">12,340</div></div>'
+    without_price = b'<div class="usItemAreaTop"><div class="usItemCardInfoName">item</div></div>'
+
+    assert not UnivStoreService._is_logged_out(response(body=product))
+    assert UnivStoreService._is_logged_out(response(body=without_price))
+    assert UnivStoreService._is_logged_out(response(url='https://univstore.com/user/login'))
+
+    # Missing items and other error pages don't mean the session expired
+    assert not UnivStoreService._is_logged_out(response(status=404, body=b'<html>not found</html>'))
+    assert not UnivStoreService._is_logged_out(response(body=b'<html>removed</html>'))
+    assert not UnivStoreService._is_logged_out(response(status=304))
+
+
+def test_coupang_logout_detection():
+    logged_in = b'<a href="https://login.coupang.com/login/logout.pang">logout</a><div class="prod-atf">'
+    logged_out = b'<a href="https://login.coupang.com/login/login.pang">login</a><div class="prod-atf">'
+
+    assert not CoupangService._is_logged_out(response(body=logged_in))
+    assert CoupangService._is_logged_out(response(body=logged_out))
+    assert not CoupangService._is_logged_out(response(status=404, body=b'<html>not found</html>'))
+    assert not CoupangService._is_logged_out(response(status=304))
@@ -0,0 +1,61 @@
+import os
+from types import SimpleNamespace
+import pytest
+from services.danawa import DanawaService
+from services.univstore import UnivStoreService
+from util.cache import ResponseCache
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def load(name: str) -> bytes:
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return f.read()
+
+
+def page(body: bytes) -> SimpleNamespace:
+    return SimpleNamespace(status=200, body=body, headers={})
+
+
+CASES = {
+    'danawa': (lambda: DanawaService().cache, 'danawa_product.html',
+               b'000/000/img/1000000_1.jpg', b'000/000/img/1000000_2.jpg',
+               '상세 스펙'.encode(), '변경된 스펙'.encode()),
+    'univstore': (lambda: UnivStoreService({'login': False, 'id': '', 'password': ''}).cache, 'univstore_product.html',
+                  b'item/1000/1.jpg', b'item/1000/9.jpg',
+                  '상세 설명'.encode(), '변경된 설명'.encode())
+}
+
+
+@pytest.mark.parametrize('service', sorted(CASES))
+def test_thumbnail_change_misses_cache(service):
+    make_cache, fixture, thumbnail, new_thumbnail, _, _ = CASES[service]
+    cache = make_cache()
+    body = load(fixture)
+    assert thumbnail in body
+
+    cache.store('url', page(body), 'item')
+
+    assert cache.lookup('url', page(body)) == 'item'
+    assert cache.lookup('url', page(body.replace(thumbnail, new_thumbnail))) is None
+
+
+@pytest.mark.parametrize('service', sorted(CASES))
+def test_change_after_region_hits_cache(service):
+    make_cache, fixture, _, _, detail, new_detail = CASES[service]
+    cache = make_cache()
+    body = load(fixture)
+    assert detail in body
+
+    cache.store('url', page(body), 'item')
+
+    assert cache.lookup('url', page(body.replace(detail, new_detail))) == 'item'
+
+
+def test_region_starts_at_tag_of_first_marker():
+    cache = ResponseCache((b'id="a"', b'class="b"'), b'class="end"')
+    body = b'<p>x</p><img src="1.jpg" id="a"><div class="b">y</div><div class="end">z</div>'
+
+    assert cache.digest(body) != cache.digest(body.replace(b'1.jpg', b'2.jpg'))
+    assert cache.digest(body) == cache.digest(body.replace(b'<p>x</p>', b'<p>w</p>'))
+    assert cache.digest(body) == cache.digest(body.replace(b'>z<', b'>v<'))
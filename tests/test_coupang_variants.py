@@ -0,0 +1,114 @@
+import os
+import asyncio
+from types import SimpleNamespace
+from services.coupang import CoupangService, CoupangItem, parse_product, parse_variants
+from util.executor import PARSE_EXECUTOR
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'coupang_product.html')
+CONFIG = {'use_wow_price': False, 'login': False, 'email': '', 'password': ''}
+
+
+def url(vendor_item_id: int) -> str:
+    return f'https://www.coupang.com/vp/products/100?itemId=1&vendorItemId={vendor_item_id}'
+
+
+def load() -> bytes:
+    with open(FIXTURE, 'rb') as f:
+        return f.read()
+
+
+def page(body: bytes, status: int = 200) -> SimpleNamespace:
+    return SimpleNamespace(status=status, body=body, encoding='utf-8')
+
+
+def own_item(body: bytes, vendor_item_id: str, **changes) -> CoupangItem:
+    """Item as parsed from the own page of a variant of the fixture."""
+    lead = parse_product(body, 'utf-8', False)
+    fields = parse_variants(body, 'utf-8', [vendor_item_id], False)[vendor_item_id]
+    fields.update(changes)
+    return CoupangItem(card_benefits=lead['card_benefits'], preorder=lead['preorder'], **fields)
+
+
+def make_service() -> CoupangService:
+    """Must be called inside the event loop, since the service creates its cookie jar."""
+    PARSE_EXECUTOR.configure('inline', None)
+    service = CoupangService(CONFIG)
+    service.variant_groups['100'] = {url(1001), url(1002), url(1003)}
+    return service
+
+
+def test_page_state_matches_rendered_page():
+    body = load()
+    fields = parse_variants(body, 'utf-8', ['1001'], False)['1001']
+    lead = parse_product(body, 'utf-8', False)
+
+    assert CoupangItem(card_benefits=lead['card_benefits'], preorder=lead['preorder'], **fields) == \
+        CoupangItem(**lead)
+
+
+def test_variant_is_read_from_sibling_page_only_if_consistent():
+    body = load()
+
+    async def run():
+        service = make_service()
+        # 1002 matched its page state on its own check, 1003 showed a remaining quantity the state doesn't have
+        await service._update_variants(url(1002), page(body), own_item(body, '1002'))
+        await service._update_variants(url(1003), page(body), own_item(body, '1003', quantity='2개 남음'))
+        await service._update_variants(url(1001), page(body), CoupangItem(**parse_product(body, 'utf-8', False)))
+        return service
+
+    service = asyncio.run(run())
+
+    assert url(1002) in service.consistent_variants
+    assert url(1003) not in service.consistent_variants
+
+    results = {}
+    assert service._take_variant(url(1002), results)
+    assert results[url(1002)].item == own_item(body, '1002')
+    assert not service._take_variant(url(1003), results)
+
+
+def test_not_modified_page_keeps_only_consistent_variants():
+    body = load()
+
+    async def run():
+        service = make_service()
+        await service._update_variants(url(1002), page(body), own_item(body, '1002'))
+        await service._update_variants(url(1001), page(body), CoupangItem(**parse_product(body, 'utf-8', False)))
+
+        # 1002 no longer matches on its own check, so a later 304 of 1001 must not reuse the old variant
+        await service._update_variants(url(1002), page(body), own_item(body, '1002', quantity='1개 남음'))
+        await service._update_variants(url(1001), page(b'', status=304), CoupangItem())
+        return service
+
+    service = asyncio.run(run())
+
+    assert not service._take_variant(url(1002), {})
+
+
+def test_variant_own_page_is_checked_again_after_sibling_reads():
+    body = load()
+
+    async def run():
+        service = make_service()
+        await service._update_variants(url(1002), page(body), own_item(body, '1002'))
+        sibling_reads = 0
+
+        # The lead is fetched every cycle and refreshes 1002, which is read from it until its reads run out
+        for _ in range(service.VARIANT_READS_PER_CHECK + 1):
+            await service._update_variants(url(1001), page(body), CoupangItem(**parse_product(body, 'utf-8', False)))
+
+            if service._take_variant(url(1002), {}):
+                sibling_reads += 1
+            else:
+                break
+
+        assert sibling_reads == service.VARIANT_READS_PER_CHECK
+        assert url(1002) not in service.consistent_variants
+
+        # Its own page now shows what the page state doesn't, so it is no longer read from the lead
+        await service._update_variants(url(1002), page(body), own_item(body, '1002', quantity='2개 남음'))
+        await service._update_variants(url(1001), page(body), CoupangItem(**parse_product(body, 'utf-8', False)))
+        assert not service._take_variant(url(1002), {})
+
+    asyncio.run(run())
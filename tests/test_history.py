@@ -0,0 +1,73 @@
+import sqlite3
+import pytest
+from util.history import PriceHistory, encode, decode, HOUR, DAY, IN_STOCK, OUT_OF_STOCK
+
+
+def test_encode_round_trip():
+    rows = [(1700000000, -1, 0), (1700000060, 12900, 1), (1700003600, -1, 2), (1700003601, 2 ** 40, 1)]
+
+    assert decode(encode(rows), 3) == rows
+    assert decode(encode([]), 5) == []
+    # Small deltas take a byte per value
+    assert len(encode([(0, 0, 0), (1, -1, 1)])) == 6
+
+
+def history(**kwargs) -> PriceHistory:
+    return PriceHistory(sqlite3.connect(':memory:'), **kwargs)
+
+
+def test_raw_points_roll_up_into_hourly_then_daily_buckets():
+    prices = history(raw_retention=2 * HOUR, hourly_retention=2 * DAY)
+
+    for t, price in ((0, 100), (600, None), (1200, 80), (1800, 120)):
+        prices.record('s', 'u', price, True, t)
+
+    prices.record('s', 'u', 90, True, 3 * HOUR)
+    series = prices.get('s', 'u')
+
+    # Unknown prices don't count towards the low and high of a bucket
+    assert series.hourly == [(0, 80, 120, 120, IN_STOCK)]
+    assert series.raw == [(3 * HOUR, 90, IN_STOCK)]
+
+    prices.record('s', 'u', 70, False, 3 * DAY)
+
+    assert series.daily == [(0, 80, 120, 90, IN_STOCK)]
+    assert series.hourly == []
+    assert series.raw == [(3 * DAY, 70, OUT_OF_STOCK)]
+    assert prices.all_time_low('s', 'u') == (70, 3 * DAY)
+    assert prices.out_of_stock_since('s', 'u') == 3 * DAY
+
+    # Stored encoded, and read back the same
+    reloaded = PriceHistory(prices.connection).get('s', 'u')
+    assert (reloaded.raw, reloaded.hourly, reloaded.daily) == (series.raw, series.hourly, series.daily)
+
+
+def test_bucket_starting_with_unknown_price():
+    prices = history(raw_retention=HOUR)
+
+    prices.record('s', 'u', None, None, 0)
+    prices.record('s', 'u', 80, None, 60)
+    prices.record('s', 'u', 90, None, 3 * HOUR)
+
+    assert prices.get('s', 'u').hourly == [(0, 80, 80, 80, 0)]
+
+
+def test_unchanged_observation_is_not_recorded():
+    prices = history()
+    prices.record('s', 'u', 100, True, 0)
+    prices.record('s', 'u', 100, True, 60)
+
+    assert prices.get('s', 'u').raw == [(0, 100, IN_STOCK)]
+
+
+def test_average_is_time_weighted_and_skips_unknown_prices():
+    prices = history()
+
+    for t, price in ((0, 100), (10, None), (20, 200)):
+        prices.record('s', 'u', price, True, t)
+
+    assert prices.average('s', 'u', 40, now=40) == pytest.approx((100 * 10 + 200 * 20) / 30)
+    # The step in effect at the start of the window only counts from the start
+    assert prices.average('s', 'u', 35, now=40) == pytest.approx((100 * 5 + 200 * 20) / 25)
+    assert prices.average('s', 'u', 25, now=40) == 200
+    assert history().average('s', 'u', 40, now=40) is None
@@ -0,0 +1,33 @@
+import asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from util.http import HttpClient
+from util.ratelimit import RATE_LIMITER
+
+
+def test_server_error_is_returned_without_retrying():
+    requests = []
+
+    async def handler(request):
+        requests.append(request)
+        return web.Response(status=503)
+
+    async def run():
+        app = web.Application()
+        app.router.add_get('/', handler)
+
+        async with TestServer(app) as server:
+            client = HttpClient()
+            await client.start()
+
+            try:
+                return await client.fetch(str(server.make_url('/')))
+            finally:
+                await client.close()
+
+    response = asyncio.run(run())
+
+    assert response.status == 503
+    assert len(requests) == 1
+    # The limiter backs the host off instead, so that the item's retry waits
+    assert RATE_LIMITER.hosts['127.0.0.1'].failures == 1
@@ -0,0 +1,19 @@
+from services.danawa import DanawaItem
+from services.univstore import UnivStoreItem
+
+
+def test_price_falls_back_to_status():
+    assert DanawaItem(name='a', price=1000).display_price() == '1,000원'
+    assert DanawaItem(name='a', status='일시 품절').display_price() == '일시 품절'
+    assert UnivStoreItem(name='a', stock='로그인 필요').display_price() == '로그인 필요'
+    assert UnivStoreItem(name='a').display_price() == ''
+
+
+def test_card_name_change_is_shown_with_card_price():
+    item = DanawaItem(name='a', price=1000, card_price=900, card_name='삼성카드')
+    last_item = DanawaItem(name='a', price=1000, card_price=900, card_name='현대카드')
+
+    changed = item.changed_fields(last_item)
+    assert changed == ['card_name']
+    assert {item.SHOWN_WITH.get(key, key) for key in changed} == {'card_price'}
+    assert item.display('card_price') == '900원 (삼성카드)'
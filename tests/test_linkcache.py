@@ -0,0 +1,59 @@
+import asyncio
+from util.linkcache import LinkCache
+
+
+class FakeResponse:
+    def __init__(self, status, location=None):
+        self.status = status
+        self.headers = {'Location': location} if location else {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeSession:
+    """Answers each URL with a fixed status and Location."""
+    def __init__(self, routes):
+        self.routes = routes
+        self.requests = 0
+
+    def get(self, url, allow_redirects=True):
+        self.requests += 1
+        return FakeResponse(*self.routes[url])
+
+
+def is_product(url: str) -> bool:
+    return '/products/' in url
+
+
+def test_accepted_resolution_is_cached(tmp_path):
+    cache = LinkCache(str(tmp_path / 'links.json'))
+    session = FakeSession({'https://naver.me/a': (302, 'https://smartstore.naver.com/s/products/1')})
+
+    assert asyncio.run(cache.resolve(session, 'https://naver.me/a', accept=is_product)) == \
+        'https://smartstore.naver.com/s/products/1'
+    assert cache.get('https://naver.me/a') == 'https://smartstore.naver.com/s/products/1'
+
+
+def test_rejected_resolution_is_not_cached(tmp_path):
+    cache = LinkCache(str(tmp_path / 'links.json'))
+    session = FakeSession({'https://naver.me/a': (302, 'https://nid.naver.com/login'),
+                           'https://nid.naver.com/login': (200,)})
+
+    assert asyncio.run(cache.resolve(session, 'https://naver.me/a', accept=is_product)) == \
+        'https://nid.naver.com/login'
+    assert cache.get('https://naver.me/a') is None
+
+
+def test_cached_resolution_is_checked(tmp_path):
+    cache = LinkCache(str(tmp_path / 'links.json'))
+    cache.put('https://naver.me/a', 'https://nid.naver.com/login')
+    session = FakeSession({'https://naver.me/a': (302, 'https://smartstore.naver.com/s/products/1')})
+
+    assert asyncio.run(cache.resolve(session, 'https://naver.me/a', accept=is_product)) == \
+        'https://smartstore.naver.com/s/products/1'
+    assert session.requests == 1
+    assert cache.get('https://naver.me/a') == 'https://smartstore.naver.com/s/products/1'
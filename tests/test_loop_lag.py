@@ -0,0 +1,25 @@
+import asyncio
+from util.executor import LoopLagMonitor
+
+
+def test_report_covers_last_complete_window():
+    async def run():
+        monitor = LoopLagMonitor(interval=0.01, window=0.05)
+        monitor.start()
+        await asyncio.sleep(0.12)
+        monitor.stop()
+        return monitor
+
+    monitor = asyncio.run(run())
+    assert monitor.last_window is not None
+
+    # Reports don't reset the window, so repeated and concurrent callers all see the same numbers
+    report = monitor.report()
+    assert monitor.report() == report
+    assert f'over {monitor.last_window[0]} samples' in report
+
+
+def test_report_before_first_window():
+    monitor = LoopLagMonitor(window=600)
+
+    assert monitor.report().startswith('Event loop lag: mean 0.0ms, max 0.0ms over 0 samples')
@@ -0,0 +1,71 @@
+import json
+import asyncio
+from types import SimpleNamespace
+import aiohttp
+import pytest
+from services.naver import NaverService, parse_preloaded_state, read_points
+from util.executor import PARSE_EXECUTOR
+
+PRODUCT = {
+    'name': '테스트 상품',
+    'salePrice': 20000,
+    'discountedSalePrice': 18000,
+    'representImage': {'url': 'https://shop-phinf.pstatic.net/test/1.jpg?type=m510'},
+    'benefitsView': {'purchasePoint': 180, 'textReviewPoint': 50, 'photoVideoReviewPoint': 150, 'presentAmount': 0}
+}
+
+
+def page(state) -> str:
+    return (f'<html><head><script>window.__PRELOADED_STATE__={json.dumps(state)}</script></head>'
+            f'<body></body></html>')
+
+
+def test_state_and_browser_read_the_same_points():
+    result = parse_preloaded_state(page({'product': {'A': PRODUCT}}))
+
+    assert result == {
+        'name': '테스트 상품',
+        'price': 18000,
+        'max_point': 380,
+        'thumbnail': 'https://shop-phinf.pstatic.net/test/1.jpg'
+    }
+
+    # The browser script only passes the image and benefits of the product on
+    browser_product = {'representImage': PRODUCT['representImage'], 'benefitsView': PRODUCT['benefitsView']}
+    assert read_points(browser_product) == {key: result[key] for key in ('max_point', 'thumbnail')}
+
+
+def test_missing_state():
+    assert parse_preloaded_state('<html></html>') is None
+    assert parse_preloaded_state(page({'product': {'A': {**PRODUCT, 'benefitsView': None}}})) is None
+
+
+class FakeHttp:
+    def __init__(self, response):
+        self.response = response
+
+    async def fetch(self, url):
+        return self.response
+
+
+def state_service(response) -> NaverService:
+    service = NaverService.__new__(NaverService)
+    service.http = FakeHttp(response)
+    return service
+
+
+def test_http_error_is_raised():
+    def raise_for_status():
+        raise aiohttp.ClientResponseError(None, (), status=503)
+
+    service = state_service(SimpleNamespace(raise_for_status=raise_for_status))
+
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(service._get_product_info_from_state('https://smartstore.naver.com/test/products/1'))
+
+
+def test_missing_state_falls_back():
+    PARSE_EXECUTOR.configure('inline', None)
+    service = state_service(SimpleNamespace(raise_for_status=lambda: None, text=lambda: '<html></html>'))
+
+    assert asyncio.run(service._get_product_info_from_state('https://smartstore.naver.com/test/products/1')) is None
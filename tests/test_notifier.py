@@ -0,0 +1,28 @@
+import discord as ds
+from util.notifier import pack, MAX_EMBEDS, MAX_EMBED_CHARS
+
+
+def embed(size: int) -> ds.Embed:
+    return ds.Embed(description='x' * size)
+
+
+def test_pack_limits_embed_count():
+    embeds = [embed(10) for _ in range(MAX_EMBEDS + 2)]
+    messages = pack(embeds)
+
+    assert [len(message) for message in messages] == [MAX_EMBEDS, 2]
+    assert [e for message in messages for e in message] == embeds
+
+
+def test_pack_limits_characters_and_keeps_order():
+    embeds = [embed(4000), embed(3000), embed(2500), embed(100)]
+    messages = pack(embeds)
+
+    assert messages == [[embeds[0], embeds[3]], [embeds[1], embeds[2]]]
+    assert all(sum(len(e) for e in message) <= MAX_EMBED_CHARS for message in messages)
+
+
+def test_pack_sends_oversized_embed_alone():
+    embeds = [embed(100), embed(MAX_EMBED_CHARS + 1)]
+
+    assert pack(embeds) == [[embeds[0]], [embeds[1]]]
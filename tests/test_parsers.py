@@ -0,0 +1,63 @@
+import os
+import pytest
+from services import coupang, danawa, univstore
+from util import parser
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+CASES = {
+    'coupang': (lambda body: coupang.parse_product(body, 'utf-8', False), 'coupang_product.html'),
+    'danawa': (lambda body: danawa.parse_product(body, 'utf-8'), 'danawa_product.html'),
+    'univstore': (lambda body: univstore.parse_product(body, 'utf-8', True), 'univstore_product.html')
+}
+
+EXPECTED = {
+    'danawa': {
+        'name': '테스트 상품 ',
+        'price': 1234000,
+        'status': '',
+        'card_price': 1199000,
+        'card_name': '삼성카드',
+        'thumbnail': 'https://img.danawa.com/prod_img/500000/000/000/img/1000000_1.jpg'
+    },
+    'univstore': {
+        'name': '테스트 노트북 15',
+        'price': 1290000,
+        'stock': '재고 있음',
+        'in_stock': True,
+        'thumbnail': 'https://univstore.com/images/item/1000/1.jpg'
+    }
+}
+
+
+def load(name: str) -> bytes:
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return f.read()
+
+
+def parse_with(backend: str, parse, body: bytes):
+    previous = parser.PARSER
+
+    try:
+        parser.set_backend(backend)
+        return parse(body)
+    finally:
+        parser.PARSER = previous
+
+
+@pytest.mark.parametrize('service', sorted(CASES))
+def test_backends_agree(service):
+    pytest.importorskip('lxml')
+    parse, fixture = CASES[service]
+    body = load(fixture)
+
+    result = parse_with('html.parser', parse, body)
+    assert result == parse_with('lxml', parse, body)
+
+    if service in EXPECTED:
+        assert result == EXPECTED[service]
+
+
+def test_set_backend_rejects_unknown():
+    with pytest.raises(ValueError):
+        parser.set_backend('html5lib')
@@ -0,0 +1,192 @@
+import asyncio
+import aiohttp
+import pytest
+from services.base import AbstractService
+from util.resilience import (FetchResult, FetchStatus, RetryPolicy, CircuitBreaker, CircuitOpenError, Quarantine,
+                             classify_error)
+
+
+class FakeService(AbstractService):
+    SERVICE_DEFAULT_CONFIG = None
+    SERVICE_NAME = 'fake'
+    SERVICE_LABEL = 'fake'
+    SERVICE_COLOR = 0
+    RETRY_POLICY = RetryPolicy(attempts=2, base_delay=0, max_delay=0)
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    async def standardize_url(self, url):
+        return url
+
+    async def fetch_items(self, url_list):
+        return await self.fetch_results(url_list)
+
+    async def get_product_info(self, url):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+
+        if isinstance(outcome, BaseException):
+            raise outcome
+        if outcome == 'hang':
+            await asyncio.sleep(3600)
+
+        return url, outcome
+
+
+def open_circuit(service: AbstractService) -> CircuitBreaker:
+    breaker = service.circuit_breaker
+    breaker.failure_threshold = 1
+    breaker.record_failure()
+    breaker.reset_timeout = 0
+    assert breaker.state == 'open'
+    return breaker
+
+
+def not_found() -> aiohttp.ClientResponseError:
+    return aiohttp.ClientResponseError(None, (), status=404)
+
+
+def test_classify_error():
+    assert classify_error(not_found()) is FetchStatus.PERMANENT
+    assert classify_error(aiohttp.ClientResponseError(None, (), status=503)) is FetchStatus.TRANSIENT
+    assert classify_error(asyncio.TimeoutError()) is FetchStatus.TRANSIENT
+    assert classify_error(KeyError('price')) is FetchStatus.PERMANENT
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+
+    for _ in range(3):
+        assert breaker.check() is False
+        breaker.record_failure()
+
+    assert breaker.state == 'open'
+
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_breaker_probe_lets_one_fetch_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+
+    assert breaker.check() is True
+    assert breaker.state == 'half-open'
+
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.check() is False
+
+
+def test_breaker_failed_probe_doubles_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, max_reset_timeout=15)
+    breaker.record_failure()
+    breaker.opened_at -= 10
+
+    assert breaker.check() is True
+    breaker.record_failure()
+
+    assert breaker.state == 'open'
+    assert breaker.reset_timeout == 15
+
+
+def test_probe_with_permanent_error_closes_circuit():
+    service = FakeService([KeyError('price'), 'item'])
+    open_circuit(service)
+
+    result = asyncio.run(service.fetch_item('a'))
+    assert result.status is FetchStatus.PERMANENT
+    assert service.circuit_breaker.state == 'closed'
+
+    assert asyncio.run(service.fetch_item('b')).ok
+
+
+def test_probe_with_not_found_closes_circuit():
+    service = FakeService([not_found()])
+    open_circuit(service)
+
+    assert asyncio.run(service.fetch_item('a')).status is FetchStatus.PERMANENT
+    assert service.circuit_breaker.state == 'closed'
+
+
+def test_cancelled_probe_is_released():
+    service = FakeService(['hang', 'item'])
+    breaker = open_circuit(service)
+
+    async def cancel_probe():
+        task = asyncio.create_task(service.fetch_item('a'))
+        await asyncio.sleep(0.01)
+        assert breaker.state == 'half-open'
+        task.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_probe())
+    assert breaker.state == 'open'
+
+    assert asyncio.run(service.fetch_item('b')).ok
+    assert breaker.state == 'closed'
+
+
+def test_skipped_while_open():
+    service = FakeService(['item'])
+    breaker = open_circuit(service)
+    breaker.reset_timeout = 60
+
+    result = asyncio.run(service.fetch_item('a'))
+    assert result.status is FetchStatus.SKIPPED
+    assert service.calls == 0
+
+
+def test_transient_error_is_retried():
+    service = FakeService([asyncio.TimeoutError(), 'item'])
+
+    result = asyncio.run(service.fetch_item('a'))
+    assert result.ok
+    assert service.calls == 2
+
+
+def test_quarantine_thresholds():
+    quarantine = Quarantine(transient_failures=3, permanent_failures=2)
+    transient = FetchResult(FetchStatus.TRANSIENT, error=asyncio.TimeoutError())
+    permanent = FetchResult(FetchStatus.PERMANENT, error=not_found())
+
+    assert not quarantine.record_failure('a', transient)
+    assert not quarantine.record_failure('a', transient)
+    assert quarantine.record_failure('a', transient)
+    assert 'a' in quarantine
+
+    # Reported only once
+    assert not quarantine.record_failure('a', transient)
+
+    assert not quarantine.record_failure('b', permanent)
+    assert quarantine.record_failure('b', permanent)
+
+
+def test_quarantine_ignores_skipped():
+    quarantine = Quarantine(transient_failures=1, permanent_failures=1)
+    skipped = FetchResult(FetchStatus.SKIPPED, error=CircuitOpenError(10))
+
+    assert not quarantine.record_failure('a', skipped)
+    assert quarantine.failures('a') == 0
+
+
+def test_quarantine_recovery_and_forget():
+    quarantine = Quarantine(transient_failures=1, permanent_failures=1)
+    transient = FetchResult(FetchStatus.TRANSIENT, error=asyncio.TimeoutError())
+
+    assert quarantine.record_failure('a', transient)
+    assert quarantine.record_success('a')
+    assert 'a' not in quarantine
+    assert not quarantine.record_success('a')
+
+    quarantine.record_failure('b', transient)
+    quarantine.forget('b')
+    assert 'b' not in quarantine
+    assert quarantine.failures('b') == 0
@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+import pytest
+from util import scheduler as scheduler_module
+from util.scheduler import Scheduler, AdaptiveInterval
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(scheduler_module, 'time', SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_fixed_rate_does_not_drift(clock):
+    scheduler = Scheduler(jitter=0)
+    scheduler.add('a', 10, delay=0)
+    assert scheduler.pop_due() == ['a']
+
+    # The fetch took 2 seconds, but the next run stays on the 10 second grid
+    clock.now = 2
+    scheduler.reschedule('a')
+    assert scheduler.time_until_next() == 8
+
+
+def test_missed_slots_are_skipped(clock):
+    scheduler = Scheduler(jitter=0)
+    scheduler.add('a', 10, delay=0)
+    scheduler.pop_due()
+
+    # Slots at 10, 20 and 30 were missed, so the next run is at 40 instead of catching up
+    clock.now = 35
+    scheduler.reschedule('a')
+    assert scheduler.time_until_next() == 5
+    assert scheduler.pop_due() == []
+
+    clock.now = 40
+    assert scheduler.pop_due() == ['a']
+
+
+def test_reschedule_with_new_interval(clock):
+    scheduler = Scheduler(jitter=0)
+    scheduler.add('a', 10, delay=0)
+    scheduler.pop_due()
+
+    scheduler.reschedule('a', 30)
+    assert scheduler.time_until_next() == 30
+
+
+def test_removed_key_is_not_returned(clock):
+    scheduler = Scheduler(jitter=0)
+    scheduler.add('a', 10, delay=0)
+    scheduler.add('b', 10, delay=0)
+    scheduler.remove('a')
+
+    assert scheduler.pop_due() == ['b']
+    assert 'a' not in scheduler
+
+
+def test_adaptive_interval_bounds():
+    adaptive = AdaptiveInterval(30, 120)
+
+    assert adaptive.update('a', 60, changed=True) == 30
+    assert adaptive.update('a', 60, changed=False) == 37.5
+    assert adaptive.update('a', 60, changed=False, urgent=True) == 30
+
+    for _ in range(10):
+        interval = adaptive.update('a', 60, changed=False)
+
+    assert interval == 120
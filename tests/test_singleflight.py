@@ -0,0 +1,67 @@
+import asyncio
+import pytest
+from util.singleflight import SingleFlight
+
+
+def test_concurrent_calls_are_coalesced():
+    flight = SingleFlight()
+    calls = []
+
+    async def func():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    async def run():
+        return await asyncio.gather(*[flight.do('key', func) for _ in range(3)])
+
+    assert asyncio.run(run()) == ['result'] * 3
+    assert len(calls) == 1
+
+
+def test_follower_calls_again_when_leader_is_cancelled():
+    flight = SingleFlight()
+    calls = []
+
+    async def func():
+        calls.append(1)
+        await asyncio.sleep(3600 if len(calls) == 1 else 0.01)
+        return 'result'
+
+    async def run():
+        leader = asyncio.create_task(flight.do('key', func))
+        await asyncio.sleep(0)
+        followers = [asyncio.create_task(flight.do('key', func)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+        return await asyncio.gather(*followers)
+
+    assert asyncio.run(run()) == ['result', 'result']
+    # One of the followers called again for both
+    assert len(calls) == 2
+
+
+def test_cancelled_follower_leaves_call_running():
+    flight = SingleFlight()
+
+    async def func():
+        await asyncio.sleep(0.02)
+        return 'result'
+
+    async def run():
+        leader = asyncio.create_task(flight.do('key', func))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do('key', func))
+        await asyncio.sleep(0.01)
+        follower.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+
+        return await leader
+
+    assert asyncio.run(run()) == 'result'
@@ -0,0 +1,74 @@
+import os
+import asyncio
+import aiohttp
+from typing import Callable, Awaitable, TypeVar
+
+T = TypeVar('T')
+
+COOKIE_DIR = 'cookies'
+
+
+class LoginManager:
+    """Keeps track of whether a service's saved login session is still valid.
+
+    Saved sessions live under cookies/ (cookie_path for aiohttp cookie jars, state_path for Playwright storage state).
+    Logins are serialized: callers pass the generation they observed before detecting a logout,
+    and only the first of several concurrent callers actually logs in again."""
+    def __init__(self, service_name: str, login: Callable[..., Awaitable[None]]):
+        self.service_name = service_name
+        self.cookie_path = os.path.join(COOKIE_DIR, service_name)
+        self.state_path = self.cookie_path + '.json'
+
+        self.generation = 0
+        self.logged_in = False
+
+        self._login = login
+        self._lock = asyncio.Lock()
+
+    def cookie_jar(self) -> aiohttp.CookieJar:
+        """Returns a cookie jar holding the saved session, if there is one. Must be called inside the event loop."""
+        jar = aiohttp.CookieJar()
+
+        if os.path.isfile(self.cookie_path):
+            print(f'[{self.service_name}]', 'Loading saved cookie...')
+            jar.load(self.cookie_path)
+            self.mark_valid()
+
+        return jar
+
+    def mark_valid(self) -> None:
+        """Marks the saved session as valid without logging in, e.g. after a successful check."""
+        self.logged_in = True
+
+    async def ensure(self, *args) -> None:
+        """Logs in if the session is not known to be valid."""
+        if not self.logged_in:
+            await self.login(self.generation, *args)
+
+    async def login(self, generation: int, *args) -> None:
+        """Logs in again, unless somebody else already did since generation was observed."""
+        async with self._lock:
+            if generation != self.generation and self.logged_in:
+                return
+
+            print(f'[{self.service_name}]', 'Logging in...')
+
+            self.logged_in = False
+            await self._login(*args)
+            self.logged_in = True
+            self.generation += 1
+
+    async def fetch(self, fetch: Callable[[], Awaitable[T]], is_logged_out: Callable[[T], bool], *args) -> T:
+        """Returns fetch(), logging in first if needed. If is_logged_out says the session expired,
+        logs in again and fetches once more. args are passed to the login function."""
+        await self.ensure(*args)
+
+        for attempt in range(2):
+            generation = self.generation
+            result = await fetch()
+
+            if attempt or not is_logged_out(result):
+                return result
+
+            print(f'[{self.service_name}]', 'Session has expired. Logging in again...')
+            await self.login(generation, *args)
@@ -0,0 +1,309 @@
+import re
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Union, Callable, Awaitable, AsyncIterator, List, Iterable, Dict, Any
+from playwright.async_api import async_playwright, Playwright, Browser, BrowserContext, Page, Route, Response, \
+    Error as PlaywrightError
+from util.ratelimit import RATE_LIMITER
+
+# Debug settings
+HEADLESS = True
+DELAY = 0
+
+
+def pprint(*args, **kwargs):
+    print('[browser]', *args, **kwargs)
+
+
+class NavigationError(Exception):
+    """Raised when a page navigation returned an error status."""
+    def __init__(self, url: str, status: int):
+        super().__init__(f'{status} while loading {url}')
+        self.url = url
+        self.status = status
+
+
+class BrowserManager:
+    """Owns a single Chromium instance shared by every Playwright service.
+
+    The browser is launched lazily on first use and relaunched if it crashes or gets disconnected.
+    Each service gets its own isolated context through ServiceContext."""
+    def __init__(self, executable_path: Union[str, None] = None):
+        self.executable_path = executable_path
+        self.generation = 0
+
+        self._playwright: Union[Playwright, None] = None
+        self._browser: Union[Browser, None] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def is_running(self) -> bool:
+        return self._browser is not None and self._browser.is_connected()
+
+    async def get_browser(self) -> Browser:
+        if self.is_running:
+            return self._browser
+
+        async with self._lock:
+            if self.is_running:
+                return self._browser
+
+            if self._browser is not None:
+                pprint('Browser disconnected. Restarting...')
+                await self._stop()
+
+            pprint('Launching Chromium...')
+            self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(
+                executable_path=self.executable_path, headless=HEADLESS, slow_mo=DELAY
+            )
+            self.generation += 1
+
+            return self._browser
+
+    async def new_context(self, **kwargs) -> BrowserContext:
+        browser = await self.get_browser()
+        return await browser.new_context(**kwargs)
+
+    async def _stop(self) -> None:
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except PlaywrightError:
+                pass
+
+        if self._playwright is not None:
+            try:
+                await self._playwright.stop()
+            except PlaywrightError:
+                pass
+
+        self._browser = None
+        self._playwright = None
+
+    async def close(self) -> None:
+        async with self._lock:
+            if self._playwright is not None:
+                pprint('Closing Chromium...')
+            await self._stop()
+
+
+class RequestFilter:
+    """Aborts requests of unwanted resource types or matching any of the blocked URL patterns.
+
+    URL patterns are matched as plain substrings. Since aborted requests never report their size,
+    saved bytes are estimated from typical sizes per resource type."""
+    ESTIMATED_SIZES = {
+        'image': 40_000,
+        'media': 500_000,
+        'font': 30_000,
+        'stylesheet': 20_000,
+        'script': 50_000
+    }
+    DEFAULT_ESTIMATED_SIZE = 5_000
+
+    def __init__(self, resource_types: Iterable[str] = (), url_patterns: Iterable[str] = ()):
+        self.resource_types = frozenset(resource_types)
+        url_patterns = [pattern for pattern in url_patterns if pattern]
+
+        if url_patterns:
+            self.url_pattern = re.compile('|'.join(re.escape(pattern) for pattern in url_patterns))
+        else:
+            self.url_pattern = None
+
+        self.blocked = 0
+        self.allowed = 0
+        self.saved_bytes = 0
+
+    def is_blocked(self, resource_type: str, url: str) -> bool:
+        if resource_type in self.resource_types:
+            return True
+
+        return self.url_pattern is not None and self.url_pattern.search(url) is not None
+
+    async def install(self, context: BrowserContext) -> None:
+        if self.resource_types or self.url_pattern is not None:
+            await context.route('**/*', self._handle)
+
+    async def _handle(self, route: Route) -> None:
+        request = route.request
+
+        if self.is_blocked(request.resource_type, request.url):
+            self.blocked += 1
+            self.saved_bytes += self.ESTIMATED_SIZES.get(request.resource_type, self.DEFAULT_ESTIMATED_SIZE)
+            await route.abort()
+        else:
+            self.allowed += 1
+            await route.continue_()
+
+    def report(self) -> str:
+        """Returns a summary of the requests blocked since the last report and resets the counters."""
+        summary = (f'Blocked {self.blocked} of {self.blocked + self.allowed} requests, '
+                   f'saved ~{self.saved_bytes / 1024:,.0f} KiB')
+        self.blocked = 0
+        self.allowed = 0
+        self.saved_bytes = 0
+
+        return summary
+
+
+class PagePool:
+    """Bounded pool of reusable pages.
+
+    At most max_pages pages are open at once. Pages are reset to about:blank before being handed out again,
+    and closed instead of recycled when the caller raised."""
+    def __init__(self, max_pages: int = 4):
+        self.max_pages = max_pages
+
+        self._semaphore = asyncio.Semaphore(max_pages)
+        self._idle: List[Page] = []
+
+    def _take(self, context: BrowserContext) -> Union[Page, None]:
+        while self._idle:
+            page = self._idle.pop()
+
+            if not page.is_closed() and page.context is context:
+                return page
+
+        return None
+
+    async def _release(self, page: Page) -> None:
+        try:
+            await page.goto('about:blank')
+        except PlaywrightError:
+            await self._discard(page)
+        else:
+            self._idle.append(page)
+
+    @staticmethod
+    async def _discard(page: Page) -> None:
+        try:
+            await page.close()
+        except PlaywrightError:
+            pass
+
+    @asynccontextmanager
+    async def page(self, context: BrowserContext) -> AsyncIterator[Page]:
+        async with self._semaphore:
+            page = self._take(context)
+
+            if page is None:
+                page = await context.new_page()
+
+            try:
+                yield page
+            except BaseException:
+                await self._discard(page)
+                raise
+            else:
+                await self._release(page)
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+
+        for page in idle:
+            await self._discard(page)
+
+
+class ServiceContext:
+    """Long-lived browser context of a single service.
+
+    The context is created on first use and recreated whenever the shared browser was restarted.
+    setup is awaited once for every new context (e.g. logging in), after request_filter is installed.
+    Pages are handed out through a PagePool which limits the number of concurrently open tabs."""
+    def __init__(self, manager: BrowserManager, timeout: int = 10000, max_pages: int = 4,
+                 request_filter: Union[RequestFilter, None] = None,
+                 setup: Union[Callable[[BrowserContext], Awaitable[None]], None] = None, **context_kwargs):
+        self.manager = manager
+        self.timeout = timeout
+        self.request_filter = request_filter
+        self.setup = setup
+        self.context_kwargs = context_kwargs
+        self.pool = PagePool(max_pages)
+
+        self._context: Union[BrowserContext, None] = None
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def _is_alive(self) -> bool:
+        return (self._context is not None
+                and self._generation == self.manager.generation
+                and self.manager.is_running)
+
+    async def get(self) -> BrowserContext:
+        if self._is_alive():
+            return self._context
+
+        async with self._lock:
+            if self._is_alive():
+                return self._context
+
+            context = await self.manager.new_context(**self.context_kwargs)
+            context.set_default_timeout(self.timeout)
+            context.on('close', lambda _: self._forget(context))
+
+            try:
+                if self.request_filter is not None:
+                    await self.request_filter.install(context)
+
+                if self.setup is not None:
+                    await self.setup(context)
+            except BaseException:
+                await context.close()
+                raise
+
+            self._context = context
+            self._generation = self.manager.generation
+
+            return context
+
+    @asynccontextmanager
+    async def page(self) -> AsyncIterator[Page]:
+        context = await self.get()
+
+        async with self.pool.page(context) as page:
+            yield page
+
+    def _forget(self, context: BrowserContext) -> None:
+        if self._context is context:
+            self._context = None
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+        if self._context is not None:
+            context = self._context
+            self._context = None
+
+            try:
+                await context.close()
+            except PlaywrightError:
+                pass
+
+
+async def extract(page: Page, script: str, arg: Any = None, timeout: Union[float, None] = None) -> Dict[str, Any]:
+    """Reads every field of a page in a single round trip.
+
+    script is a JavaScript function of arg that returns null until the page is ready and an object of field values
+    after. It is polled inside the page until it returns a value, which is returned as a dict."""
+    handle = await page.wait_for_function(script, arg=arg, timeout=timeout)
+
+    try:
+        return await handle.json_value()
+    finally:
+        await handle.dispose()
+
+
+async def goto(page: Page, url: str, **kwargs) -> Union[Response, None]:
+    """Navigates page to url through the shared per-host rate limiter.
+    Raises NavigationError on error statuses instead of waiting for content that will never render."""
+    async with RATE_LIMITER.limit(url) as slot:
+        response = await page.goto(url, **kwargs)
+
+        if response is not None:
+            slot.record(response.status, await response.header_value('retry-after'))
+
+    if response is not None and response.status >= 400:
+        raise NavigationError(url, response.status)
+
+    return response
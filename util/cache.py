@@ -0,0 +1,95 @@
+from hashlib import blake2b
+from typing import Union, Dict, Any, Tuple
+from util.http import Response
+
+
+class CacheEntry:
+    __slots__ = ('etag', 'last_modified', 'digest', 'item')
+
+    def __init__(self, etag: Union[str, None], last_modified: Union[str, None], digest: bytes, item: Any):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.digest = digest
+        self.item = item
+
+
+class ResponseCache:
+    """Per-URL cache of the last parsed item of a service, used to skip parsing unchanged pages.
+
+    Requests are revalidated with If-None-Match/If-Modified-Since. A 304 response, or a body whose region between
+    region_start and region_end hashes the same as last time, returns the cached item without parsing.
+    The region must contain everything the parser reads. It starts at the tag containing the first of the
+    region_start markers found, so parts read from different places of the page can each have a marker.
+    If no marker is found, the region extends to the start or end of the body, so a missing marker only costs
+    hits, never correctness."""
+    def __init__(self, region_start: Union[bytes, Tuple[bytes, ...], None] = None,
+                 region_end: Union[bytes, None] = None):
+        self.region_start = (region_start,) if isinstance(region_start, bytes) else tuple(region_start or ())
+        self.region_end = region_end
+
+        self.entries: Dict[str, CacheEntry] = {}
+        self.not_modified = 0
+        self.unchanged = 0
+        self.misses = 0
+
+    def headers(self, url: str) -> Dict[str, str]:
+        """Returns the conditional request headers for url."""
+        entry = self.entries.get(url)
+        headers = {}
+
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        return headers
+
+    def digest(self, body: bytes) -> bytes:
+        starts = [start for start in (body.find(marker) for marker in self.region_start) if start != -1]
+        # Markers are usually attributes, so back up to their tag to include the attributes before them
+        start = max(body.rfind(b'<', 0, min(starts)), 0) if starts else 0
+        end = body.find(self.region_end, start) if self.region_end else -1
+
+        if end == -1:
+            end = len(body)
+
+        return blake2b(body[start:end], digest_size=16).digest()
+
+    def lookup(self, url: str, r: Response) -> Any:
+        """Returns the cached item if the response shows that the page didn't change, None otherwise."""
+        entry = self.entries.get(url)
+
+        if entry is not None:
+            if r.status == 304:
+                self.not_modified += 1
+                return entry.item
+
+            if entry.digest == self.digest(r.body):
+                self.unchanged += 1
+                self._update_validators(entry, r)
+                return entry.item
+
+        self.misses += 1
+        return None
+
+    def store(self, url: str, r: Response, item: Any) -> None:
+        entry = CacheEntry(None, None, self.digest(r.body), item)
+        self._update_validators(entry, r)
+        self.entries[url] = entry
+
+    @staticmethod
+    def _update_validators(entry: CacheEntry, r: Response) -> None:
+        entry.etag = r.headers.get('ETag')
+        entry.last_modified = r.headers.get('Last-Modified')
+
+    def forget(self, url: str) -> None:
+        self.entries.pop(url, None)
+
+    def report(self) -> str:
+        hits = self.not_modified + self.unchanged
+        lookups = hits + self.misses
+        ratio = hits / lookups if lookups else 0
+
+        return (f'Response cache: {hits}/{lookups} hits ({ratio:.0%}), {self.not_modified} not modified, '
+                f'{self.unchanged} unchanged body, {self.misses} parsed')
@@ -0,0 +1,119 @@
+import time
+import asyncio
+import functools
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Union, Callable, TypeVar, Tuple
+
+T = TypeVar('T')
+
+EXECUTOR_KINDS = ('process', 'thread', 'inline')
+
+
+class ParseExecutor:
+    """Runs CPU heavy parse functions off the event loop, so that the Discord gateway stays responsive.
+
+    With the process kind, functions and their arguments must be picklable,
+    i.e. module level functions taking plain data such as the response body. They should also be pure,
+    since a worker process shares no state with the bot."""
+    def __init__(self, kind: str = 'process', max_workers: Union[int, None] = 2):
+        self.kind = kind
+        self.max_workers = max_workers
+        self.initializer: Union[Callable[..., None], None] = None
+        self.initargs: tuple = ()
+
+        self._executor: Union[Executor, None] = None
+
+    def configure(self, kind: str, max_workers: Union[int, None],
+                  initializer: Union[Callable[..., None], None] = None, initargs: tuple = ()) -> None:
+        """initializer is called with initargs in every worker process before it parses anything."""
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError(f'Executor kind must be one of {", ".join(EXECUTOR_KINDS)}, not {kind}')
+
+        self.shutdown()
+        self.kind = kind
+        self.max_workers = max_workers
+        self.initializer = initializer
+        self.initargs = initargs
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=self.initializer,
+                                                     initargs=self.initargs)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='parser')
+
+        return self._executor
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        if self.kind == 'inline':
+            return func(*args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), functools.partial(func, *args, **kwargs))
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a task sleeping for interval seconds.
+    Lag shows how long callbacks like gateway heartbeats and button interactions had to wait.
+
+    Samples are collected in fixed windows of window seconds. report() describes the last complete window
+    and doesn't reset anything, so every report covers the same span however often it is called."""
+    def __init__(self, interval: float = 0.25, window: float = 600):
+        self.interval = interval
+        self.window = window
+
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.window_start = time.perf_counter()
+        self.last_window: Union[Tuple[int, float, float], None] = None
+        self._task: Union[asyncio.Task, None] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+
+            self.samples += 1
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+
+            if time.perf_counter() - self.window_start >= self.window:
+                self.last_window = (self.samples, self.total_lag, self.max_lag)
+                self.samples = 0
+                self.total_lag = 0.0
+                self.max_lag = 0.0
+                self.window_start = time.perf_counter()
+
+    def report(self) -> str:
+        """Returns lag statistics of the last complete window, or of the current one before the first completes."""
+        if self.last_window is not None:
+            samples, total_lag, max_lag = self.last_window
+            span = self.window
+        else:
+            samples, total_lag, max_lag = self.samples, self.total_lag, self.max_lag
+            span = time.perf_counter() - self.window_start
+
+        mean_lag = total_lag / samples if samples else 0
+
+        return (f'Event loop lag: mean {mean_lag * 1000:.1f}ms, max {max_lag * 1000:.1f}ms '
+                f'over {samples} samples in the last {span:.0f}s')
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+PARSE_EXECUTOR = ParseExecutor()
@@ -0,0 +1,246 @@
+import time
+import sqlite3
+from typing import Union, Dict, List, Tuple, Hashable, Iterator
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS history (
+    service TEXT NOT NULL,
+    url TEXT NOT NULL,
+    raw BLOB NOT NULL,
+    hourly BLOB NOT NULL,
+    daily BLOB NOT NULL,
+    PRIMARY KEY (service, url)
+);
+'''
+
+# Stock states of a point. Unknown is used by services that don't report stock
+STOCK_UNKNOWN, IN_STOCK, OUT_OF_STOCK = 0, 1, 2
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    value = (value << 1) ^ (value >> 63)  # Zigzag, so that small negative deltas stay short
+
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+
+    out.append(value)
+
+
+def _read_varints(data: bytes) -> Iterator[int]:
+    value = shift = 0
+
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        shift += 7
+
+        if not byte & 0x80:
+            yield (value >> 1) ^ -(value & 1)
+            value = shift = 0
+
+
+def encode(rows: List[Tuple[int, ...]]) -> bytes:
+    """Delta-encodes rows of integers column by column as zigzag varints."""
+    out = bytearray()
+    previous = None
+
+    for row in rows:
+        if previous is None:
+            previous = (0,) * len(row)
+
+        for value, last in zip(row, previous):
+            _write_varint(out, value - last)
+
+        previous = row
+
+    return bytes(out)
+
+
+def decode(data: bytes, width: int) -> List[Tuple[int, ...]]:
+    values = list(_read_varints(data))
+    rows = []
+    previous = (0,) * width
+
+    for i in range(0, len(values), width):
+        row = tuple(last + delta for last, delta in zip(previous, values[i:i + width]))
+        rows.append(row)
+        previous = row
+
+    return rows
+
+
+class Series:
+    """History of a single item.
+
+    raw holds (time, price, stock) for every change in the last raw_retention seconds.
+    Older points are rolled up into hourly, then daily (start, min, max, last, stock) buckets.
+    Prices of -1 mean the price was unknown."""
+    __slots__ = ('raw', 'hourly', 'daily')
+
+    def __init__(self, raw: List[Tuple[int, ...]], hourly: List[Tuple[int, ...]], daily: List[Tuple[int, ...]]):
+        self.raw = raw
+        self.hourly = hourly
+        self.daily = daily
+
+    def last(self) -> Union[Tuple[int, int, int], None]:
+        if self.raw:
+            return self.raw[-1]
+
+        for buckets in (self.hourly, self.daily):
+            if buckets:
+                start, _, _, last, stock = buckets[-1]
+                return start, last, stock
+
+        return None
+
+    def steps(self) -> List[Tuple[int, int, int]]:
+        """Returns (time, price, stock) steps in time order, using the last value of rolled up buckets."""
+        return ([(start, last, stock) for start, _, _, last, stock in self.daily] +
+                [(start, last, stock) for start, _, _, last, stock in self.hourly] + list(self.raw))
+
+
+def _roll_up(points: List[Tuple[int, ...]], size: int, buckets: List[Tuple[int, ...]], is_bucket: bool) -> None:
+    for point in points:
+        if is_bucket:
+            start, low, high, last, stock = point
+        else:
+            start, last, stock = point
+            low = high = last
+
+        start -= start % size
+
+        if buckets and buckets[-1][0] == start:
+            _, bucket_low, bucket_high, _, _ = buckets[-1]
+
+            if low >= 0:
+                bucket_low = low if bucket_low < 0 else min(bucket_low, low)
+                bucket_high = max(bucket_high, high)
+
+            buckets[-1] = (start, bucket_low, bucket_high, last, stock)
+        else:
+            buckets.append((start, low, high, last, stock))
+
+
+class PriceHistory:
+    """Compact per-item price and stock history kept next to the snapshots in the SQLite store.
+
+    Every series is delta-encoded into a few bytes per change and cached decoded in memory once read,
+    so queries don't touch the database."""
+    def __init__(self, connection: sqlite3.Connection, raw_retention: float = 7 * DAY,
+                 hourly_retention: float = 90 * DAY):
+        self.connection = connection
+        self.raw_retention = raw_retention
+        self.hourly_retention = hourly_retention
+
+        self.connection.executescript(SCHEMA)
+        self._series: Dict[Hashable, Series] = {}
+
+    def get(self, service: str, url: str) -> Series:
+        key = (service, url)
+
+        if key not in self._series:
+            row = self.connection.execute('SELECT raw, hourly, daily FROM history WHERE service = ? AND url = ?',
+                                          (service, url)).fetchone()
+
+            if row is None:
+                self._series[key] = Series([], [], [])
+            else:
+                self._series[key] = Series(decode(row[0], 3), decode(row[1], 5), decode(row[2], 5))
+
+        return self._series[key]
+
+    def record(self, service: str, url: str, price: Union[int, None], in_stock: Union[bool, None],
+               timestamp: Union[float, None] = None) -> None:
+        """Appends an observation if the price or stock state differs from the last one."""
+        now = int(timestamp if timestamp is not None else time.time())
+        price = -1 if price is None else price
+        stock = STOCK_UNKNOWN if in_stock is None else IN_STOCK if in_stock else OUT_OF_STOCK
+
+        series = self.get(service, url)
+        last = series.last()
+
+        if last is not None and (last[1], last[2]) == (price, stock):
+            return
+
+        series.raw.append((now, price, stock))
+        self._compact(series, now)
+
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO history VALUES (?, ?, ?, ?, ?)',
+                                    (service, url, encode(series.raw), encode(series.hourly), encode(series.daily)))
+
+    def _compact(self, series: Series, now: int) -> None:
+        # The newest raw point is always kept, so that the current state is exact
+        raw_cutoff = now - self.raw_retention
+        expired = [point for point in series.raw[:-1] if point[0] < raw_cutoff]
+
+        if expired:
+            del series.raw[:len(expired)]
+            _roll_up(expired, HOUR, series.hourly, False)
+
+        hourly_cutoff = now - self.hourly_retention
+        expired = [bucket for bucket in series.hourly if bucket[0] < hourly_cutoff]
+
+        if expired:
+            del series.hourly[:len(expired)]
+            _roll_up(expired, DAY, series.daily, True)
+
+    def forget(self, service: str, url: str) -> None:
+        self._series.pop((service, url), None)
+
+        with self.connection:
+            self.connection.execute('DELETE FROM history WHERE service = ? AND url = ?', (service, url))
+
+    def range(self, service: str, url: str, start: float, end: float) -> List[Tuple[int, int, int]]:
+        """Returns the (time, price, stock) steps between start and end, including the step in effect at start."""
+        steps = self.get(service, url).steps()
+        result = [step for step in steps if start <= step[0] <= end]
+        before = [step for step in steps if step[0] < start]
+
+        if before:
+            result.insert(0, before[-1])
+
+        return result
+
+    def all_time_low(self, service: str, url: str) -> Union[Tuple[int, int], None]:
+        """Returns (price, time) of the lowest known price."""
+        series = self.get(service, url)
+        candidates = ([(low, start) for start, low, _, _, _ in series.daily + series.hourly if low >= 0] +
+                      [(price, t) for t, price, _ in series.raw if price >= 0])
+
+        return min(candidates) if candidates else None
+
+    def average(self, service: str, url: str, duration: float, now: Union[float, None] = None) -> Union[float, None]:
+        """Returns the time-weighted average price over the last duration seconds."""
+        now = now if now is not None else time.time()
+        steps = self.range(service, url, now - duration, now)
+        total = weight = 0.0
+
+        for i, (t, price, _) in enumerate(steps):
+            end = steps[i + 1][0] if i + 1 < len(steps) else now
+            span = end - max(t, now - duration)
+
+            if price >= 0 and span > 0:
+                total += price * span
+                weight += span
+
+        return total / weight if weight else None
+
+    def out_of_stock_since(self, service: str, url: str) -> Union[int, None]:
+        """Returns when the item went out of stock, or None if it is not out of stock."""
+        steps = self.get(service, url).steps()
+
+        if not steps or steps[-1][2] != OUT_OF_STOCK:
+            return None
+
+        since = steps[-1][0]
+
+        for t, _, stock in reversed(steps):
+            if stock != OUT_OF_STOCK:
+                break
+            since = t
+
+        return since
@@ -0,0 +1,134 @@
+import ssl
+import aiohttp
+from typing import Union, Dict, Tuple
+from multidict import CIMultiDictProxy
+from yarl import URL
+from util.ratelimit import RATE_LIMITER
+
+
+class ConnectionStats:
+    """Counts requests and how often pooled connections and cached DNS entries were reused."""
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.dns_cache_hits = 0
+        self.dns_cache_misses = 0
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        trace_config.on_dns_cache_hit.append(self._on_dns_cache_hit)
+        trace_config.on_dns_cache_miss.append(self._on_dns_cache_miss)
+
+        return trace_config
+
+    async def _on_request_start(self, *_):
+        self.requests += 1
+
+    async def _on_connection_create_end(self, *_):
+        self.new_connections += 1
+
+    async def _on_connection_reuseconn(self, *_):
+        self.reused_connections += 1
+
+    async def _on_dns_cache_hit(self, *_):
+        self.dns_cache_hits += 1
+
+    async def _on_dns_cache_miss(self, *_):
+        self.dns_cache_misses += 1
+
+    def report(self) -> str:
+        connections = self.new_connections + self.reused_connections
+        reuse_ratio = self.reused_connections / connections if connections else 0
+
+        return (f'{self.requests} requests, {self.reused_connections}/{connections} connections reused '
+                f'({reuse_ratio:.0%}), {self.dns_cache_hits} DNS cache hits, {self.dns_cache_misses} misses')
+
+
+class Response:
+    """Fully read response returned by HttpClient.fetch."""
+    def __init__(self, r: aiohttp.ClientResponse, body: bytes):
+        self.status = r.status
+        self.reason = r.reason
+        self.url: URL = r.url
+        self.headers: CIMultiDictProxy = r.headers
+        self.body = body
+        self.encoding = r.get_encoding()
+
+        self._request_info = r.request_info
+        self._history: Tuple[aiohttp.ClientResponse, ...] = r.history
+
+    def text(self) -> str:
+        return self.body.decode(self.encoding, errors='replace')
+
+    def raise_for_status(self) -> None:
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(self._request_info, self._history, status=self.status,
+                                              message=self.reason or '', headers=self.headers)
+
+
+class HttpClient:
+    """Long-lived aiohttp session of a service.
+
+    The session is opened by start() and closed by close(), so connections, TLS sessions and DNS lookups
+    are reused across cycles instead of being set up again for every fetch."""
+    def __init__(self, headers: Union[Dict[str, str], None] = None,
+                 cookie_jar: Union[aiohttp.abc.AbstractCookieJar, None] = None,
+                 ssl_context: Union[ssl.SSLContext, None] = None,
+                 timeout: Union[aiohttp.ClientTimeout, None] = None,
+                 limit_per_host: int = 8, dns_cache_ttl: int = 300, keepalive_timeout: float = 90):
+        self.headers = headers
+        self.cookie_jar = cookie_jar
+        self.ssl_context = ssl_context
+        self.timeout = timeout
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+
+        self.stats = ConnectionStats()
+        self._session: Union[aiohttp.ClientSession, None] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError('HttpClient is not started')
+
+        return self._session
+
+    async def start(self) -> None:
+        if self._session is not None and not self._session.closed:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+            ssl=self.ssl_context if self.ssl_context is not None else True
+        )
+        kwargs = {}
+
+        if self.cookie_jar is not None:
+            kwargs['cookie_jar'] = self.cookie_jar
+        if self.timeout is not None:
+            kwargs['timeout'] = self.timeout
+
+        self._session = aiohttp.ClientSession(headers=self.headers, connector=connector,
+                                              trace_configs=[self.stats.trace_config()], **kwargs)
+
+    async def fetch(self, url: str, **kwargs) -> Response:
+        """GETs url once through the shared per-host rate limiter.
+        429 and 5xx responses are returned like any other. The limiter backs off the host on them,
+        and the item's RetryPolicy decides whether to try again, so that retries don't stack."""
+        async with RATE_LIMITER.limit(url) as slot:
+            async with self.session.get(url, **kwargs) as r:
+                body = await r.read()
+                slot.record(r.status, r.headers.get('Retry-After'))
+                return Response(r, body)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
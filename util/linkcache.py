@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import aiohttp
+from collections import OrderedDict
+from typing import Union, Callable, Tuple
+from urllib.parse import urljoin
+from util.ratelimit import RATE_LIMITER
+
+REDIRECT_STATUSES = frozenset((301, 302, 303, 307, 308))
+
+
+def pprint(*args, **kwargs):
+    print('[linkcache]', *args, **kwargs)
+
+
+class LinkCache:
+    """Persistent cache of short and share link resolutions, with a TTL and LRU eviction.
+
+    Links are resolved by following the redirect chain hop by hop without reading any response body,
+    and stop as soon as the URL is accepted by the caller."""
+    def __init__(self, path: str = 'links.json', ttl: float = 30 * 24 * 3600, max_entries: int = 1000,
+                 max_redirects: int = 10):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_redirects = max_redirects
+
+        self.hits = 0
+        self.misses = 0
+        self._entries: Union['OrderedDict[str, Tuple[str, float]]', None] = None
+
+    def _load(self) -> 'OrderedDict[str, Tuple[str, float]]':
+        if self._entries is None:
+            self._entries = OrderedDict()
+
+            try:
+                with open(self.path, 'r') as f:
+                    for url, (resolved, expires_at) in json.load(f).items():
+                        self._entries[url] = (resolved, expires_at)
+            except FileNotFoundError:
+                pass
+            except (json.JSONDecodeError, ValueError, TypeError):
+                pprint('Link cache file is invalid. Starting with an empty cache')
+
+        return self._entries
+
+    def save(self) -> None:
+        temp_path = self.path + '.tmp'
+
+        with open(temp_path, 'w') as f:
+            json.dump(self._load(), f, indent=4)
+
+        os.replace(temp_path, self.path)
+
+    def get(self, url: str) -> Union[str, None]:
+        entries = self._load()
+        entry = entries.get(url)
+
+        if entry is None:
+            return None
+
+        resolved, expires_at = entry
+
+        if expires_at < time.time():
+            del entries[url]
+            return None
+
+        entries.move_to_end(url)
+        return resolved
+
+    def put(self, url: str, resolved: str) -> None:
+        entries = self._load()
+        entries[url] = (resolved, time.time() + self.ttl)
+        entries.move_to_end(url)
+
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+        self.save()
+
+    async def resolve(self, session: aiohttp.ClientSession, url: str,
+                      accept: Union[Callable[[str], bool], None] = None) -> str:
+        """Returns the URL that url redirects to. Redirects are followed until accept returns True for the URL,
+        or a response is not a redirect. With accept, only resolutions it accepts are cached."""
+        if accept is not None and accept(url):
+            return url
+
+        resolved = self.get(url)
+
+        # Entries cached before accept was checked may not be accepted
+        if resolved is not None and (accept is None or accept(resolved)):
+            self.hits += 1
+            return resolved
+
+        self.misses += 1
+        resolved = url
+
+        for _ in range(self.max_redirects):
+            async with RATE_LIMITER.limit(resolved) as slot:
+                async with session.get(resolved, allow_redirects=False) as r:
+                    slot.record(r.status, r.headers.get('Retry-After'))
+                    location = r.headers.get('Location')
+
+                    if r.status not in REDIRECT_STATUSES or not location:
+                        # Failed resolutions are not cached, so that they are retried next time
+                        if r.status >= 400:
+                            return resolved
+                        break
+
+            resolved = urljoin(resolved, location)
+
+            if accept is not None and accept(resolved):
+                break
+        else:
+            pprint(f'Too many redirects while resolving {url}')
+            return resolved
+
+        # A chain ending somewhere else, like a login or error page, may lead to the right URL next time
+        if accept is not None and not accept(resolved):
+            return resolved
+
+        self.put(url, resolved)
+        return resolved
+
+    def report(self) -> str:
+        return f'Link cache: {self.hits} hits, {self.misses} resolved, {len(self._load())} entries'
+
+
+LINK_CACHE = LinkCache()
@@ -0,0 +1,196 @@
+import asyncio
+import traceback
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Union
+
+import discord as ds  # noqa
+
+from util.ratelimit import HostLimiter, parse_retry_after
+
+MAX_EMBEDS = 10
+MAX_EMBED_CHARS = 6000
+
+
+def pprint(*args, **kwargs):
+    print('[notifier]', *args, **kwargs)
+
+
+def pack(embeds: List[ds.Embed], max_count: int = MAX_EMBEDS, max_chars: int = MAX_EMBED_CHARS) -> List[List[ds.Embed]]:
+    """Packs embeds into as few messages as possible, each with at most max_count embeds and max_chars characters.
+
+    Embeds are placed largest first into the first message with room left, then every message keeps
+    the original order of its embeds and messages are ordered by their first embed."""
+    sizes = [len(embed) for embed in embeds]
+    messages: List[List[int]] = []
+    totals: List[int] = []
+
+    for i in sorted(range(len(embeds)), key=lambda i: -sizes[i]):
+        for j, message in enumerate(messages):
+            if len(message) < max_count and totals[j] + sizes[i] <= max_chars:
+                message.append(i)
+                totals[j] += sizes[i]
+                break
+        else:
+            # An embed over max_chars on its own still gets a message, so that Discord reports the error
+            messages.append([i])
+            totals.append(sizes[i])
+
+    messages = sorted(sorted(message) for message in messages)
+    return [[embeds[i] for i in message] for message in messages]
+
+
+class Pending:
+    __slots__ = ('first', 'latest', 'embed')
+
+    def __init__(self, first: Any, latest: Any, embed: Union[ds.Embed, None] = None):
+        self.first = first
+        self.latest = latest
+        self.embed = embed
+
+
+class Notifier:
+    """Outbound queue of notifications, sent by a single worker task so that price checks never wait on Discord.
+
+    Notifications pushed with the same key within window seconds are coalesced into one, rendered from the
+    first and the latest value. Every flush packs its embeds into as few messages as possible and calls after_flush
+    once. Discord calls made through call() are paced by a token bucket per route, and retried on 429 and 5xx."""
+    def __init__(self, send: Callable[[List[ds.Embed]], Awaitable[Any]],
+                 render: Callable[[Hashable, Any, Any], Union[ds.Embed, None]],
+                 after_flush: Union[Callable[[], Awaitable[None]], None] = None,
+                 is_busy: Union[Callable[[], bool], None] = None,
+                 window: float = 10, attempts: int = 5, route_rate: float = 1, route_burst: int = 5):
+        self.send = send
+        self.render = render
+        self.after_flush = after_flush
+        self.is_busy = is_busy
+        self.window = window
+        self.attempts = attempts
+        self.route_rate = route_rate
+        self.route_burst = route_burst
+
+        self.pending: 'OrderedDict[Hashable, Pending]' = OrderedDict()
+        self.routes: Dict[Hashable, HostLimiter] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Union[asyncio.Task, None] = None
+        self._counter = 0
+
+        self.messages = 0
+        self.embeds = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+            self._task = None
+
+        if self.pending:
+            pprint(f'Dropping {len(self.pending)} unsent notifications')
+
+    def push(self, key: Hashable, first: Any, latest: Any) -> None:
+        """Queues a notification about key changing from first to latest.
+        If one is already pending for key, it keeps its first value and takes the new latest value."""
+        pending = self.pending.get(key)
+
+        if pending is None:
+            self.pending[key] = Pending(first, latest)
+        else:
+            pending.latest = latest
+            self.coalesced += 1
+
+        self._wakeup.set()
+
+    def push_embed(self, embed: ds.Embed) -> None:
+        """Queues an embed that is sent as is."""
+        self._counter += 1
+        self.pending[('embed', self._counter)] = Pending(None, None, embed)
+        self._wakeup.set()
+
+    async def call(self, route: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Awaits func() within the rate limit of route, retrying on 429 and 5xx responses."""
+        if route not in self.routes:
+            self.routes[route] = HostLimiter(self.route_rate, self.route_burst, 1)
+
+        limiter = self.routes[route]
+
+        for attempt in range(self.attempts):
+            await limiter.acquire()
+            status = None
+            retry_after = None
+
+            try:
+                result = await func()
+                status = 200
+                return result
+            except ds.HTTPException as e:
+                status = e.status
+
+                if e.response is not None:
+                    retry_after = parse_retry_after(e.response.headers.get('Retry-After'))
+
+                if (status != 429 and status < 500) or attempt == self.attempts - 1:
+                    raise
+
+                self.retries += 1
+                pprint(f'Discord returned {status} on {route}. Retrying...')
+            finally:
+                limiter.release(status, retry_after)
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.window)
+
+            # Sending while the user is using the menu would bury the message they are interacting with
+            while self.is_busy is not None and self.is_busy():
+                await asyncio.sleep(1)
+
+            self._wakeup.clear()
+            batch, self.pending = self.pending, OrderedDict()
+
+            try:
+                await self.flush(batch)
+            except Exception as e:
+                pprint(f'Flush failed with exception {e}')
+                traceback.print_tb(e.__traceback__)
+
+    async def flush(self, batch: 'OrderedDict[Hashable, Pending]') -> None:
+        embeds = []
+
+        for key, pending in batch.items():
+            embed = pending.embed if pending.embed is not None else self.render(key, pending.first, pending.latest)
+
+            if embed is not None:
+                embeds.append(embed)
+
+        if not embeds:
+            return
+
+        for message in pack(embeds):
+            try:
+                await self.call('send', lambda: self.send(message))
+                self.messages += 1
+                self.embeds += len(message)
+            except ds.HTTPException as e:
+                self.failed += len(message)
+                pprint(f'Failed to send {len(message)} embeds: {e}')
+
+        if self.after_flush is not None:
+            await self.after_flush()
+
+        pprint(self.report())
+
+    def report(self) -> str:
+        return (f'{self.embeds} embeds sent in {self.messages} messages, {self.coalesced} coalesced, '
+                f'{self.retries} retries, {self.failed} failed, {len(self.pending)} pending')
@@ -0,0 +1,67 @@
+from importlib.util import find_spec
+from typing import Union, List, Dict, Iterable
+from bs4 import BeautifulSoup
+from bs4.filter import ElementFilter
+
+BACKENDS = ('lxml', 'html.parser')
+DEFAULT_BACKEND = 'lxml' if find_spec('lxml') is not None else 'html.parser'
+
+PARSER = DEFAULT_BACKEND
+
+
+def set_backend(backend: str) -> None:
+    """Selects the BeautifulSoup backend of every Region. auto picks lxml if it is installed.
+    Called in every parse worker too, so that all of them use the same backend."""
+    global PARSER
+
+    if backend == 'auto':
+        backend = DEFAULT_BACKEND
+    elif backend not in BACKENDS:
+        raise ValueError(f'Parser backend must be one of auto, {", ".join(BACKENDS)}, not {backend}')
+    elif backend == 'lxml' and DEFAULT_BACKEND != 'lxml':
+        raise ValueError('Parser backend lxml is not installed')
+
+    PARSER = backend
+
+
+class RegionFilter(ElementFilter):
+    """Lets the parser build only elements with one of the given classes or ids, and everything inside them."""
+    def __init__(self, classes: Iterable[str], ids: Iterable[str]):
+        super().__init__()
+        self.classes = frozenset(classes)
+        self.ids = frozenset(ids)
+
+    def allow_tag_creation(self, nsprefix, name: str, attrs: Union[Dict[str, str], None]) -> bool:
+        if not attrs:
+            return False
+
+        classes = attrs.get('class')
+
+        if classes and not self.classes.isdisjoint(classes.split()):
+            return True
+
+        return attrs.get('id') in self.ids
+
+    def allow_string_creation(self, string: str) -> bool:
+        return False
+
+
+class Region:
+    """Part of a page that a service reads from, given by the classes or ids of its outermost elements.
+
+    Only matching elements and their descendants are parsed, so the rest of the page is skipped.
+    Selectors used on the parsed region must not depend on ancestors outside of it."""
+    def __init__(self, classes: Union[str, List[str]], ids: Union[str, List[str]] = ()):
+        self.classes = [classes] if isinstance(classes, str) else list(classes)
+        self.ids = [ids] if isinstance(ids, str) else list(ids)
+        self.strainer = RegionFilter(self.classes, self.ids)
+
+    def parse(self, markup: Union[str, bytes], encoding: Union[str, None] = None,
+              parser: Union[str, None] = None) -> BeautifulSoup:
+        kwargs = {'from_encoding': encoding} if isinstance(markup, bytes) else {}
+        return BeautifulSoup(markup, parser or PARSER, parse_only=self.strainer, **kwargs)
+
+
+def text(tag) -> str:
+    """Text content of a tag, without re-serializing it to strip the markup."""
+    return tag.get_text() if tag is not None else ''
@@ -0,0 +1,150 @@
+import time
+import random
+import asyncio
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Union, Dict, AsyncIterator
+from urllib.parse import urlsplit
+
+
+def parse_retry_after(value: Union[str, None]) -> Union[float, None]:
+    """Parses a Retry-After header given either in seconds or as an HTTP date."""
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HostLimiter:
+    """Token bucket combined with AIMD concurrency control for a single host.
+
+    Successful responses raise the concurrency limit additively, while 429 and 5xx responses halve it
+    and pause the host for Retry-After or an exponential backoff with jitter."""
+    def __init__(self, rate: float, burst: int, max_concurrency: int,
+                 base_backoff: float = 2, max_backoff: float = 300):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self.tokens = float(burst)
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+        self.failures = 0
+        self.backoff_until = 0.0
+
+        self._refilled_at = time.monotonic()
+        self._released = asyncio.Event()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+
+            if now < self.backoff_until:
+                await asyncio.sleep(self.backoff_until - now)
+                continue
+
+            if self.in_flight >= int(self.concurrency):
+                self._released.clear()
+                await self._released.wait()
+                continue
+
+            self._refill(now)
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.in_flight += 1
+                return
+
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def release(self, status: Union[int, None], retry_after: Union[float, None] = None) -> None:
+        """Releases a slot. status is None if the request failed without a response."""
+        self.in_flight -= 1
+        self._released.set()
+
+        if status is not None and status != 429 and status < 500:
+            self.failures = 0
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            return
+
+        self.failures += 1
+        self.concurrency = max(1.0, self.concurrency / 2)
+
+        if retry_after is None:
+            backoff = min(self.max_backoff, self.base_backoff * 2 ** (self.failures - 1))
+            retry_after = random.uniform(backoff / 2, backoff)
+
+        self.backoff_until = max(self.backoff_until, time.monotonic() + retry_after)
+
+    def report(self) -> str:
+        backoff = self.backoff_until - time.monotonic()
+        state = f'backing off for {backoff:.0f}s' if backoff > 0 else 'ok'
+
+        return (f'{self.rate:g} req/s, concurrency {int(self.concurrency)}/{self.max_concurrency}, '
+                f'{self.in_flight} in flight, {self.failures} consecutive failures, {state}')
+
+
+class Slot:
+    """Handed out by RateLimiter.limit. Record the response status so that the host limiter can adapt."""
+    def __init__(self):
+        self.status: Union[int, None] = None
+        self.retry_after: Union[float, None] = None
+
+    def record(self, status: int, retry_after: Union[str, None] = None) -> None:
+        self.status = status
+        self.retry_after = parse_retry_after(retry_after)
+
+
+class RateLimiter:
+    """Registry of per-host limiters shared by every service."""
+    def __init__(self, rate: float = 2, burst: int = 4, max_concurrency: int = 6):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+
+        self.hosts: Dict[str, HostLimiter] = {}
+
+    def configure(self, rate: float, burst: int, max_concurrency: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.hosts.clear()
+
+    def get(self, url: str) -> HostLimiter:
+        host = urlsplit(url).hostname or ''
+
+        if host not in self.hosts:
+            self.hosts[host] = HostLimiter(self.rate, self.burst, self.max_concurrency)
+
+        return self.hosts[host]
+
+    @asynccontextmanager
+    async def limit(self, url: str) -> AsyncIterator[Slot]:
+        limiter = self.get(url)
+        await limiter.acquire()
+        slot = Slot()
+
+        try:
+            yield slot
+        finally:
+            limiter.release(slot.status, slot.retry_after)
+
+    def report(self) -> str:
+        return '\n'.join(f'{host}: {limiter.report()}' for host, limiter in self.hosts.items())
+
+
+RATE_LIMITER = RateLimiter()
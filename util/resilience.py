@@ -0,0 +1,189 @@
+import time
+import enum
+import random
+import asyncio
+import aiohttp
+from typing import Union, Any, Dict, Hashable
+from playwright.async_api import Error as PlaywrightError
+from util.browser import NavigationError
+
+# Statuses that will not fix themselves by retrying
+PERMANENT_STATUSES = frozenset((400, 403, 404, 410))
+
+# Raised by parsers when a page no longer has the expected layout
+PARSE_ERRORS = (AttributeError, IndexError, KeyError, TypeError, ValueError)
+
+
+class FetchStatus(enum.Enum):
+    OK = 'ok'
+    TRANSIENT = 'transient'  # Network errors, timeouts, 429 and 5xx. Worth retrying later
+    PERMANENT = 'permanent'  # Missing product or changed layout. Retrying won't help
+    SKIPPED = 'skipped'  # Not fetched because the service circuit is open
+
+
+class FetchResult:
+    """Result envelope of a single item fetch. Holds either the item or the error that prevented fetching it."""
+    __slots__ = ('status', 'item', 'error')
+
+    def __init__(self, status: FetchStatus, item: Any = None, error: Union[BaseException, None] = None):
+        self.status = status
+        self.item = item
+        self.error = error
+
+    @classmethod
+    def success(cls, item) -> 'FetchResult':
+        return cls(FetchStatus.OK, item=item)
+
+    @property
+    def ok(self) -> bool:
+        return self.status is FetchStatus.OK
+
+    def describe(self) -> str:
+        if self.ok:
+            return 'ok'
+
+        return f'{self.status.value}: {type(self.error).__name__}: {self.error}'
+
+    def __repr__(self):
+        return f'FetchResult({self.describe()})'
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_in: float):
+        super().__init__(f'circuit open, retrying in {retry_in:.0f}s')
+        self.retry_in = retry_in
+
+
+def classify_error(e: BaseException) -> FetchStatus:
+    """Sorts an exception raised while fetching an item into a transient or a permanent failure."""
+    if isinstance(e, (aiohttp.ClientResponseError, NavigationError)):
+        status = e.status
+        return FetchStatus.PERMANENT if status in PERMANENT_STATUSES else FetchStatus.TRANSIENT
+
+    if isinstance(e, (asyncio.TimeoutError, aiohttp.ClientError, PlaywrightError, OSError)):
+        return FetchStatus.TRANSIENT
+
+    if isinstance(e, PARSE_ERRORS):
+        return FetchStatus.PERMANENT
+
+    return FetchStatus.TRANSIENT
+
+
+class RetryPolicy:
+    """How often a single item is retried within one cycle after a transient failure.
+    Delays grow exponentially with full jitter."""
+    def __init__(self, attempts: int = 2, base_delay: float = 2, max_delay: float = 30):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Stops fetching from a service after too many consecutive transient failures.
+
+    While open, fetches are skipped until reset_timeout has passed. Then a single probe is let through:
+    success closes the circuit, failure opens it again with a doubled timeout.
+    The caller that got the probe must settle it with record_success, record_failure or end_probe."""
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60, max_reset_timeout: float = 1800):
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+
+        self.failures = 0
+        self.opened_at: Union[float, None] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+
+        return 'half-open' if self.probing else 'open'
+
+    def check(self) -> bool:
+        """Raises CircuitOpenError unless a fetch may go through. Returns True if the fetch is the probe."""
+        if self.opened_at is None:
+            return False
+
+        retry_in = self.opened_at + self.reset_timeout - time.monotonic()
+
+        if retry_in > 0 or self.probing:
+            raise CircuitOpenError(max(0.0, retry_in))
+
+        self.probing = True
+        return True
+
+    def end_probe(self) -> None:
+        """Releases a probe that ended without a result, e.g. because it was cancelled,
+        so that the next fetch probes again. Does nothing if the probe was already settled."""
+        self.probing = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.reset_timeout = self.base_reset_timeout
+
+    def record_failure(self) -> None:
+        self.failures += 1
+
+        if self.probing:
+            self.probing = False
+            self.reset_timeout = min(self.max_reset_timeout, self.reset_timeout * 2)
+            self.opened_at = time.monotonic()
+        elif self.opened_at is None and self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def report(self) -> str:
+        return f'circuit {self.state}, {self.failures} consecutive failures'
+
+
+class Quarantine:
+    """Counts consecutive failed fetches per item and quarantines items whose failures persist.
+
+    Permanent failures quarantine an item sooner than transient ones. Skipped fetches aren't counted,
+    since the item wasn't fetched at all."""
+    def __init__(self, transient_failures: int = 5, permanent_failures: int = 2):
+        self.transient_failures = transient_failures
+        self.permanent_failures = permanent_failures
+
+        self.failure_counts: Dict[Hashable, int] = {}
+        self.quarantined: Dict[Hashable, FetchResult] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.quarantined
+
+    def record_failure(self, key: Hashable, result: FetchResult) -> bool:
+        """Counts a failed fetch. Returns True only when the failure puts the item into quarantine."""
+        if result.status is FetchStatus.SKIPPED or key in self.quarantined:
+            return False
+
+        failures = self.failure_counts.get(key, 0) + 1
+        self.failure_counts[key] = failures
+
+        if result.status is FetchStatus.PERMANENT:
+            threshold = self.permanent_failures
+        else:
+            threshold = self.transient_failures
+
+        if failures < threshold:
+            return False
+
+        self.quarantined[key] = result
+        return True
+
+    def record_success(self, key: Hashable) -> bool:
+        """Resets the failures of an item. Returns True if it was quarantined."""
+        self.failure_counts.pop(key, None)
+        return self.quarantined.pop(key, None) is not None
+
+    def failures(self, key: Hashable) -> int:
+        return self.failure_counts.get(key, 0)
+
+    def forget(self, key: Hashable) -> None:
+        self.failure_counts.pop(key, None)
+        self.quarantined.pop(key, None)
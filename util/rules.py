@@ -0,0 +1,173 @@
+from typing import Dict, List, Any, Union, Hashable, FrozenSet
+
+
+class Rule:
+    """Alert condition checked against a diff. Only called if one of the fields it watches changed."""
+    FIELDS: FrozenSet[str] = frozenset()
+
+    def watches(self, item, changed: set) -> bool:
+        return bool(self.FIELDS & changed)
+
+    def matches(self, item, last_item) -> bool:
+        raise NotImplementedError
+
+
+class PriceBelow(Rule):
+    FIELDS = frozenset(('price',))
+
+    def __init__(self, value: Union[int, float]):
+        self.value = value
+
+    def matches(self, item, last_item) -> bool:
+        return item['price'] is not None and item['price'] < self.value
+
+    def __repr__(self):
+        return f'price_below({self.value})'
+
+
+class DropPercent(Rule):
+    FIELDS = frozenset(('price',))
+
+    def __init__(self, value: Union[int, float]):
+        self.value = value
+
+    def matches(self, item, last_item) -> bool:
+        price, last_price = item['price'], last_item['price']
+
+        if price is None or not last_price:
+            return False
+
+        return (last_price - price) * 100 >= self.value * last_price
+
+    def __repr__(self):
+        return f'drop_percent({self.value})'
+
+
+class BackInStock(Rule):
+    FIELDS = frozenset(('in_stock',))
+
+    def matches(self, item, last_item) -> bool:
+        return last_item.in_stock() is False and item.in_stock() is True
+
+    def __repr__(self):
+        return 'back_in_stock'
+
+
+class CardBenefit(Rule):
+    """Matches when a card or benefit field of the item gets a value it didn't have, e.g. a new card discount."""
+    def watches(self, item, changed: set) -> bool:
+        return not changed.isdisjoint(item.BENEFIT_FIELDS)
+
+    def matches(self, item, last_item) -> bool:
+        for key in item.BENEFIT_FIELDS:
+            value, last_value = item[key], last_item[key]
+
+            if isinstance(value, dict):
+                if value.keys() - last_value.keys():
+                    return True
+            elif value and not last_value:
+                return True
+
+        return False
+
+    def __repr__(self):
+        return 'card_benefit'
+
+
+RULE_TYPES = {
+    'price_below': PriceBelow,
+    'drop_percent': DropPercent,
+    'back_in_stock': BackInStock,
+    'card_benefit': CardBenefit
+}
+
+
+class RuleSet:
+    """Compiled alert rules of an item.
+
+    Ignored fields are dropped from every diff. A diff with any other change notifies if there are no rules,
+    otherwise only if one of the rules watching a changed field matches."""
+    __slots__ = ('rules', 'ignored')
+
+    def __init__(self, rules: List[Rule], ignored: FrozenSet[str]):
+        self.rules = rules
+        self.ignored = ignored
+
+    def evaluate(self, item, last_item) -> List[str]:
+        """Returns the changed fields to notify about, or an empty list if the change should not be notified."""
+        changed = [key for key in item.changed_fields(last_item) if key not in self.ignored]
+
+        if not changed or not self.rules:
+            return changed
+
+        changed_set = set(changed)
+
+        for rule in self.rules:
+            if rule.watches(item, changed_set) and rule.matches(item, last_item):
+                return changed
+
+        return []
+
+    def __repr__(self):
+        return f'RuleSet(rules={self.rules!r}, ignored={sorted(self.ignored)!r})'
+
+
+def compile_rules(specs: List[Dict[str, Any]]) -> RuleSet:
+    """Compiles rule specs like {"type": "drop_percent", "value": 10} or {"type": "ignore", "fields": [...]}.
+    Raises ValueError if a spec is invalid."""
+    rules = []
+    ignored = set()
+
+    for spec in specs:
+        if not isinstance(spec, dict) or 'type' not in spec:
+            raise ValueError(f'Rule must be an object with a type: {spec!r}')
+
+        rule_type = spec['type']
+
+        if rule_type == 'ignore':
+            fields = spec.get('fields')
+
+            if not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+                raise ValueError(f'ignore rule needs a list of field names: {spec!r}')
+
+            ignored.update(fields)
+        elif rule_type in ('price_below', 'drop_percent'):
+            value = spec.get('value')
+
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0:
+                raise ValueError(f'{rule_type} rule needs a positive value: {spec!r}')
+
+            rules.append(RULE_TYPES[rule_type](value))
+        elif rule_type in RULE_TYPES:
+            rules.append(RULE_TYPES[rule_type]())
+        else:
+            raise ValueError(f'Unknown rule type {rule_type!r}. '
+                             f'Valid types are ignore, {", ".join(RULE_TYPES)}')
+
+    return RuleSet(rules, frozenset(ignored))
+
+
+class RuleBook:
+    """Alert rules of every item, from per-service rules and per-item rules keyed by URL.
+    The rules of an item are its service rules followed by its own rules. Rule sets are compiled once
+    and shared by every check of the item."""
+    def __init__(self, service_rules: Dict[str, List[Dict[str, Any]]], item_rules: Dict[str, List[Dict[str, Any]]]):
+        # Compiled up front, so that an invalid rule is reported on startup instead of on the first change
+        for specs in list(service_rules.values()) + list(item_rules.values()):
+            compile_rules(specs)
+
+        self.service_rules = service_rules
+        self.item_rules = item_rules
+        self._compiled: Dict[Hashable, RuleSet] = {}
+
+    def get(self, service_name: str, url: str) -> RuleSet:
+        key = (service_name, url)
+
+        if key not in self._compiled:
+            self._compiled[key] = compile_rules(self.service_rules.get(service_name, [])
+                                                + self.item_rules.get(url, []))
+
+        return self._compiled[key]
+
+    def forget(self, service_name: str, url: str) -> None:
+        self._compiled.pop((service_name, url), None)
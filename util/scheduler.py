@@ -0,0 +1,155 @@
+import time
+import heapq
+import random
+import asyncio
+from typing import Hashable, Dict, List, Tuple, Union
+
+
+class ScheduleEntry:
+    __slots__ = ('interval', 'nominal', 'due', 'token')
+
+    def __init__(self, interval: float, nominal: float, due: float, token: int):
+        self.interval = interval
+        self.nominal = nominal
+        self.due = due
+        self.token = token
+
+
+class Scheduler:
+    """Priority queue of items keyed by their next due time.
+
+    Items run at a fixed rate: the next nominal due time is the previous one plus the interval,
+    so the time spent fetching does not make the period drift. Slots that were missed entirely are skipped.
+    Each due time is shifted by a random jitter of up to jitter * interval, which does not accumulate."""
+    def __init__(self, jitter: float = 0.1):
+        self.jitter = jitter
+
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._entries: Dict[Hashable, ScheduleEntry] = {}
+        self._counter = 0
+        self._updated = asyncio.Event()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _push(self, key: Hashable, entry: ScheduleEntry) -> None:
+        self._counter += 1
+        entry.token = self._counter
+        entry.due = entry.nominal + random.uniform(-self.jitter, self.jitter) * entry.interval
+        heapq.heappush(self._heap, (entry.due, entry.token, key))
+        self._updated.set()
+
+    def add(self, key: Hashable, interval: float, delay: Union[float, None] = None) -> None:
+        """Schedules key every interval seconds. The first run is after delay seconds,
+        or at a random point within the first interval to spread load if delay is None."""
+        if delay is None:
+            delay = random.uniform(0, interval)
+
+        entry = ScheduleEntry(interval, time.monotonic() + delay, 0, 0)
+        self._entries[key] = entry
+        self._push(key, entry)
+
+    def remove(self, key: Hashable) -> None:
+        # Stale heap entries are skipped when popped
+        self._entries.pop(key, None)
+
+    def reschedule(self, key: Hashable, interval: Union[float, None] = None) -> None:
+        """Schedules the next run of key after its previous nominal due time, optionally with a new interval."""
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return
+
+        if interval is not None:
+            entry.interval = interval
+
+        entry.nominal += entry.interval
+        now = time.monotonic()
+
+        if entry.nominal < now:
+            missed = (now - entry.nominal) // entry.interval + 1
+            entry.nominal += missed * entry.interval
+
+        self._push(key, entry)
+
+    def time_until_next(self) -> Union[float, None]:
+        while self._heap:
+            due, token, key = self._heap[0]
+            entry = self._entries.get(key)
+
+            if entry is None or entry.token != token:
+                heapq.heappop(self._heap)
+                continue
+
+            return max(0.0, due - time.monotonic())
+
+        return None
+
+    def pop_due(self, window: float = 0) -> List[Hashable]:
+        """Returns every key due within window seconds from now. Popped keys stay scheduled,
+        but are not returned again until they are rescheduled."""
+        deadline = time.monotonic() + window
+        due_keys = []
+
+        while self._heap and self._heap[0][0] <= deadline:
+            _, token, key = heapq.heappop(self._heap)
+            entry = self._entries.get(key)
+
+            if entry is not None and entry.token == token:
+                entry.token = 0
+                due_keys.append(key)
+
+        return due_keys
+
+    async def next_batch(self, window: float = 1) -> List[Hashable]:
+        """Waits until at least one key is due and returns every key due within window seconds."""
+        while True:
+            self._updated.clear()
+            delay = self.time_until_next()
+
+            if delay == 0:
+                due_keys = self.pop_due(window)
+
+                if due_keys:
+                    return due_keys
+                continue
+
+            try:
+                await asyncio.wait_for(self._updated.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+class AdaptiveInterval:
+    """Adapts the polling interval of each key to how often it changes.
+
+    Starting from the configured interval, a change shrinks the interval by speedup and a cycle without change
+    grows it by backoff, always within [min_interval, max_interval]. Urgent changes jump straight to min_interval."""
+    def __init__(self, min_interval: float, max_interval: float, speedup: float = 0.5, backoff: float = 1.25):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.speedup = speedup
+        self.backoff = backoff
+
+        self._intervals: Dict[Hashable, float] = {}
+
+    def update(self, key: Hashable, base: float, changed: bool, urgent: bool = False) -> float:
+        interval = self._intervals.get(key, base)
+
+        if urgent:
+            interval = self.min_interval
+        elif changed:
+            interval *= self.speedup
+        else:
+            interval *= self.backoff
+
+        interval = min(self.max_interval, max(self.min_interval, interval))
+        self._intervals[key] = interval
+
+        return interval
+
+    def forget(self, key: Hashable) -> None:
+        self._intervals.pop(key, None)
@@ -0,0 +1,69 @@
+import time
+import asyncio
+from typing import Hashable, Dict, Tuple, Callable, Awaitable, Union, TypeVar, Any
+
+T = TypeVar('T')
+
+# Handed to followers instead of cancelling them along with the leading call, since they weren't cancelled
+LEADER_CANCELLED = object()
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one call whose result is shared by every caller.
+
+    Results accepted by keep are remembered, so that callers passing max_age can reuse a result
+    that another caller produced at most max_age seconds ago instead of calling again.
+    If the leading caller is cancelled, one of the callers waiting for it calls again for the rest."""
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self._results: Dict[Hashable, Tuple[float, Any]] = {}
+
+        self.calls = 0
+        self.coalesced = 0
+        self.fresh_hits = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]], max_age: float = 0,
+                 keep: Union[Callable[[T], bool], None] = None) -> T:
+        if max_age > 0 and key in self._results:
+            finished_at, result = self._results[key]
+
+            if time.monotonic() - finished_at <= max_age:
+                self.fresh_hits += 1
+                return result
+
+        while key in self._in_flight:
+            self.coalesced += 1
+            # Shielded so that a cancelled follower doesn't cancel the call for everyone else
+            result = await asyncio.shield(self._in_flight[key])
+
+            if result is not LEADER_CANCELLED:
+                return result
+
+        self.calls += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.set_result(LEADER_CANCELLED)
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Retrieved here, so that it isn't logged when no one else was waiting
+            raise
+        else:
+            future.set_result(result)
+
+            if keep is None or keep(result):
+                self._results[key] = (time.monotonic(), result)
+
+            return result
+        finally:
+            del self._in_flight[key]
+
+    def forget(self, key: Hashable) -> None:
+        self._results.pop(key, None)
+
+    def report(self) -> str:
+        return f'{self.calls} calls, {self.coalesced} coalesced, {self.fresh_hits} fresh results reused'
@@ -0,0 +1,114 @@
+import json
+import time
+import sqlite3
+from typing import Dict, List, Any, Union
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS urls (
+    service TEXT NOT NULL,
+    url TEXT NOT NULL,
+    added_at REAL NOT NULL,
+    PRIMARY KEY (service, url)
+);
+CREATE TABLE IF NOT EXISTS service_meta (
+    service TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (service, key)
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    service TEXT NOT NULL,
+    url TEXT NOT NULL,
+    fields TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (service, url)
+);
+'''
+
+
+class Store:
+    """SQLite store of tracked URLs, per-service metadata and the last snapshot of every item.
+
+    The database runs in WAL mode, so writes append to the log instead of rewriting the file
+    and a crash never leaves a half-written watchlist behind."""
+    def __init__(self, path: str = 'prices.db'):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def has_urls(self) -> bool:
+        return self.connection.execute('SELECT 1 FROM urls LIMIT 1').fetchone() is not None
+
+    def load_urls(self) -> Dict[str, List[str]]:
+        url_dict = {}
+
+        for service, url in self.connection.execute('SELECT service, url FROM urls ORDER BY added_at, rowid'):
+            url_dict.setdefault(service, []).append(url)
+
+        return url_dict
+
+    def add_url(self, service: str, url: str) -> None:
+        with self.connection:
+            self.connection.execute('INSERT OR IGNORE INTO urls VALUES (?, ?, ?)', (service, url, time.time()))
+
+    def remove_url(self, service: str, url: str) -> None:
+        with self.connection:
+            self.connection.execute('DELETE FROM urls WHERE service = ? AND url = ?', (service, url))
+            self.connection.execute('DELETE FROM snapshots WHERE service = ? AND url = ?', (service, url))
+
+    def import_json(self, path: str) -> bool:
+        """Adds the URLs of a url.json file. Returns False if the file doesn't exist or is invalid."""
+        try:
+            with open(path, 'r') as f:
+                url_dict: Dict[str, List[str]] = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+
+        now = time.time()
+
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO urls VALUES (?, ?, ?)',
+                [(service, url, now) for service, url_list in url_dict.items() for url in url_list]
+            )
+
+        return True
+
+    def export_json(self, path: str, services: List[str]) -> None:
+        url_dict = {service: [] for service in services}
+        url_dict.update(self.load_urls())
+
+        with open(path, 'w') as f:
+            json.dump(url_dict, f, indent=4)
+
+    def get_meta(self, service: str, key: str) -> Union[str, None]:
+        row = self.connection.execute('SELECT value FROM service_meta WHERE service = ? AND key = ?',
+                                      (service, key)).fetchone()
+        return row[0] if row is not None else None
+
+    def set_meta(self, service: str, key: str, value: str) -> None:
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO service_meta VALUES (?, ?, ?)', (service, key, value))
+
+    def load_snapshots(self, service: str) -> Dict[str, Dict[str, Any]]:
+        """Returns the last saved fields of every item of service, by URL."""
+        return {url: json.loads(fields) for url, fields in
+                self.connection.execute('SELECT url, fields FROM snapshots WHERE service = ?', (service,))}
+
+    def save_snapshots(self, service: str, snapshots: Dict[str, Dict[str, Any]]) -> None:
+        now = time.time()
+
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?)',
+                [(service, url, json.dumps(fields, ensure_ascii=False), now) for url, fields in snapshots.items()]
+            )
+
+    def clear_snapshots(self, service: str) -> None:
+        with self.connection:
+            self.connection.execute('DELETE FROM snapshots WHERE service = ?', (service,))
+
+    def close(self) -> None:
+        self.connection.close()
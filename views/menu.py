@@ -7,7 +7,8 @@ from util.embed_factory import get_embed
 
 
 class MenuView(discord.ui.View):
-    def __init__(self, services: Dict[str, AbstractService], item_dict: Dict[str, Dict[str, BaseServiceItem]],
+    def __init__(self, services: Dict[str, AbstractService], url_dict: Dict[str, List[str]],
+                 item_dict: Dict[str, Dict[str, BaseServiceItem]],
                  add_callback: Callable[[discord.Interaction, str], Any],
                  list_callback: Callable[[discord.Interaction], Any],
                  info_callback: Callable[[discord.Interaction, str, str], Any],
@@ -15,7 +16,8 @@ class MenuView(discord.ui.View):
                  interaction_callback: Callable,
                  cancel_callback: Callable[[discord.Interaction], Any]):
         """Menu button view. All callbacks must be async functions.
-        :param item_dict: 상품 딕셔너리
+        :param url_dict: 서비스별 추가된 url 리스트
+        :param item_dict: 상품 딕셔너리 (정보를 가져오지 못한 상품은 없을 수 있음)
         :param add_callback: 추가 모달 콜백 (Interaction, url)
         :param list_callback: 상품 목록 콜백 (Interaction)
         :param info_callback: 상품 정보 확인 콜백 (Interaction, 서비스 명, url)
@@ -29,6 +31,7 @@ class MenuView(discord.ui.View):
         self.delete_callback = delete_callback
         self.interaction_callback = interaction_callback
         self.cancel_callback = cancel_callback
+        self.url_dict = url_dict
         self.item_dict = item_dict
 
     @discord.ui.button(label="추가", row=0, style=discord.ButtonStyle.green)
@@ -42,8 +45,8 @@ class MenuView(discord.ui.View):
 
     @discord.ui.button(label="상품 정보 보기", row=0, style=discord.ButtonStyle.primary)
     async def third_button_callback(self, _, interaction):
-        for service_dict in self.item_dict.values():
-            if service_dict:
+        for url_list in self.url_dict.values():
+            if url_list:
                 break
         else:
             await interaction.response.edit_message(
@@ -53,13 +56,13 @@ class MenuView(discord.ui.View):
         await self.interaction_callback()
         await interaction.response.edit_message(
             embed=get_embed(title='상품 정보 보기', description='정보를 볼 상품을 선택하세요.'),
-            view=ItemSelectView(self.services, self.item_dict, self.info_callback, self.cancel_callback)
+            view=ItemSelectView(self.services, self.url_dict, self.item_dict, self.info_callback, self.cancel_callback)
         )
 
     @discord.ui.button(label="삭제", row=0, style=discord.ButtonStyle.danger)
     async def fourth_button_callback(self, _, interaction):
-        for service_dict in self.item_dict.values():
-            if service_dict:
+        for url_list in self.url_dict.values():
+            if url_list:
                 break
         else:
             await interaction.response.edit_message(
@@ -69,5 +72,6 @@ class MenuView(discord.ui.View):
         await self.interaction_callback()
         await interaction.response.edit_message(
             embed=get_embed(title='상품 삭제', description='삭제할 상품을 선택하세요.'),
-            view=ItemSelectView(self.services, self.item_dict, self.delete_callback, self.cancel_callback, select_multiple=True)
+            view=ItemSelectView(self.services, self.url_dict, self.item_dict, self.delete_callback, self.cancel_callback,
+                                select_multiple=True)
         )
@@ -35,7 +35,9 @@ class ItemSelect(discord.ui.Select):
 
 
 class ServiceSelect(discord.ui.Select):
-    def __init__(self, services: Dict[str, AbstractService], item_dict: Dict[str, Dict[str, BaseServiceItem]], options: List[discord.SelectOption]):
+    def __init__(self, services: Dict[str, AbstractService], url_dict: Dict[str, List[str]],
+                 item_dict: Dict[str, Dict[str, BaseServiceItem]], options: List[discord.SelectOption]):
+        self.url_dict = url_dict
         self.item_dict = item_dict
 
         if len(options) == 1:
@@ -60,15 +62,16 @@ class ServiceSelect(discord.ui.Select):
             else:
                 option.default = False
 
-        self.view.add_item_select(service, self.item_dict[service])
+        self.view.add_item_select(service, self.url_dict[service], self.item_dict[service])
         await interaction.response.defer()
         await interaction.edit_original_response(view=self.view)
 
 
 class ItemSelectView(discord.ui.View):
-    def __init__(self, services: Dict[str, AbstractService], item_dict: Dict[str, Dict[str, BaseServiceItem]],
+    def __init__(self, services: Dict[str, AbstractService], url_dict: Dict[str, List[str]],
+                 item_dict: Dict[str, Dict[str, BaseServiceItem]],
                  callback: Callable, cancel_callback: Callable, select_multiple: bool = False):
-        """"""
+        """Lists every tracked URL, including the ones whose item couldn't be fetched yet."""
         super().__init__()
         self._callback = callback
         self._cancel_callback = cancel_callback
@@ -78,28 +81,35 @@ class ItemSelectView(discord.ui.View):
 
         options = [discord.SelectOption(label=services[service_name].SERVICE_LABEL,
                                         value=services[service_name].SERVICE_NAME,
-                                        description=f'{len(items)}개 추가됨')
-                   for service_name, items in item_dict.items() if items]
+                                        description=f'{len(url_list)}개 추가됨')
+                   for service_name, url_list in url_dict.items() if url_list]
 
-        service_select = ServiceSelect(services, item_dict, options)
+        service_select = ServiceSelect(services, url_dict, item_dict, options)
         self.add_item(service_select)
 
         if len(options) == 1:
-            self.add_item_select(options[0].value, item_dict[options[0].value])
+            self.add_item_select(options[0].value, url_dict[options[0].value], item_dict[options[0].value])
 
     @discord.ui.button(label="취소", row=4, style=discord.ButtonStyle.primary)
     async def first_button_callback(self, _, interaction):
         await interaction.response.defer()
         await self._cancel_callback(interaction)
 
-    def add_item_select(self, service_name, service_dict: Dict[str, BaseServiceItem]):
+    def add_item_select(self, service_name, url_list: List[str], service_dict: Dict[str, BaseServiceItem]):
         if self.item_select_added:
             self.remove_item(self.item_select)
         else:
             self.item_select_added = True
 
         options = []
-        for url, item in service_dict.items():
+        for url in url_list:
+            item = service_dict.get(url)
+
+            if item is None:
+                label = url if len(url) <= 100 else url[:97] + '...'
+                options.append(discord.SelectOption(label=label, value=url, description='상품 정보를 가져오지 못했습니다.'))
+                continue
+
             label = item['name']
             item_options_lines = []
             try: